@@ -1,12 +1,39 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
-from db import get_connection
+from flask import (Flask, render_template, request, redirect, url_for, flash, jsonify, session, abort, send_file,
+                   before_render_template, template_rendered)
+from werkzeug.formparser import parse_form_data
+from db import get_connection, estadisticas_pool, en_paralelo, consultas_en_paralelo
+from metricas import (iniciar_peticion, peticion_actual, terminar_peticion, medir_render, totales_consultas,
+                      exponer as exponer_metricas, gauges)
+from jerarquia import (obtener_jerarquia, invalidar_jerarquia, ids_subarbol,
+                       SUBARBOL_CTE, PROFUNDIDAD_MAX, registrar_nodos, ligar, desligar, cadena_mando,
+                       total_descendientes, reconstruir_cierre, CicloJerarquia)
+from organigrama import cache_render, nombre_valido, FORMATOS
+from catalogos import obtener_catalogos, invalidar_catalogos
+from plantilla import obtener_plantilla, invalidar_plantilla
+from permisos import cache_permisos, id_ruta, tiene_permiso, permisos_efectivos
+from servicio_persona import datos_formulario, obtener_persona_edicion, guardar_persona
+from importar import leer_filas, importar_personas, IMPORTAR_LOTE
+from exportar import filas_sin_buffer, respuesta_exportacion, FORMATOS_EXPORTACION
+from documentos import (SubidaDocumentos, nombre_contenido, colocar_archivo, candado_archivo,
+                        borrar_si_huerfano, etag_documento, DocumentoDemasiadoGrande,
+                        DOCUMENTO_MAX_BYTES, DOCUMENTOS_ACCEL_PREFIX)
+from arranque import calentar_en_segundo_plano, estado as estado_arranque
+from ausencias import ausencias_en_rango, serie_disponibles, intervalos_por_persona, leer_rango
+from migraciones import migrar, verificar_indices, explain_check
+from versiones import (incrementar_versiones, version_vigente, versiones_vigentes, invalidar_versiones,
+                       TABLAS_JERARQUIA, TABLAS_PLANTILLA, TABLAS_COLABORADOR)
+from grafo import grafo_versionado
+from respuestas import respuesta_json, a_columnas, comprimir
+from trabajos_render import (grafica_colaborador, cola_render, precalentar_organigramas,
+                             precalentar_periodicamente, precalentado)
+from collections import OrderedDict
 from datetime import datetime
-import plotly.express as px
+import json
+import mimetypes
 import os
-from io import BytesIO
-import base64
-import matplotlib
-matplotlib.use("Agg")
+import time
+import threading
+import click
 
 app = Flask(__name__)
 app.secret_key = 'clave_super_secreta'
@@ -17,14 +44,152 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg'}
 
+# Límite de cualquier cuerpo de petición (documentos, importaciones); Werkzeug
+# corta con 413 mientras lee, antes de terminar de recibir el archivo
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH_MB', 64)) * 1024 * 1024
+
+# Con X_SENDFILE=1 (Apache mod_xsendfile, lighttpd) send_file sólo manda la
+# cabecera X-Sendfile y el servidor web entrega el archivo
+app.config['USE_X_SENDFILE'] = os.environ.get('X_SENDFILE') == '1'
+
+# Cómo se resuelve el subárbol de un colaborador:
+#   'memoria' → índice jerárquico en memoria (jerarquia.py)
+#   'sql'     → WITH RECURSIVE sobre asigna_jefe, sólo viajan las filas del subárbol
+#   'cierre'  → tabla jerarquia_cierre (migración 3), un rango de su llave primaria
+app.config['SUBARBOL_MODO'] = os.environ.get('SUBARBOL_MODO', 'memoria')
+
+# Listado del index:
+#   'cliente'  → se manda toda la tabla y DataTables pagina en el navegador
+#   'servidor' → DataTables pide cada página a /personas/datatable
+app.config['INDEX_MODO'] = os.environ.get('INDEX_MODO', 'cliente')
+
+# Verificar permisos (roles + permisos directos) en cada petición.
+# El usuario se toma de session['usuario_id'].
+app.config['PERMISOS_ACTIVOS'] = os.environ.get('PERMISOS_ACTIVOS') == '1'
+
+# Con WARMUP=1 cada worker abre conexiones y arma caches en segundo plano en
+# cuanto arranca (las librerías de gráficas sólo con RENDER_PROCESOS=0).
+# Apagado por omisión: /warmup (startup probe) calienta el worker que lo atiende
+if os.environ.get('WARMUP') == '1':
+    calentar_en_segundo_plano()
+
+# Con ORGANIGRAMA_PRECALENTAR=<segundos> se dibujan periódicamente, en el
+# pool de render, los organigramas de los jefes de cada departamento
+precalentar_periodicamente(modo=app.config['SUBARBOL_MODO'])
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+
+# -----------------------
+# Métricas por petición (consultas, tiempo en DB, render)
+# -----------------------
+@app.before_request
+def iniciar_metricas():
+    iniciar_peticion()
+
+
+@before_render_template.connect_via(app)
+def _inicio_plantilla(sender, template, context, **extra):
+    datos = peticion_actual()
+    if datos is not None:
+        datos['_plantilla'] = time.perf_counter()
+
+
+@template_rendered.connect_via(app)
+def _fin_plantilla(sender, template, context, **extra):
+    datos = peticion_actual()
+    if datos is not None and '_plantilla' in datos:
+        datos['render_s'] += time.perf_counter() - datos.pop('_plantilla')
+
+
+@app.after_request
+def cabecera_server_timing(response):
+    datos = peticion_actual()
+    if datos is not None:
+        total = time.perf_counter() - datos['inicio']
+        response.headers['Server-Timing'] = (
+            f'db;dur={datos["db_s"] * 1000:.1f};desc="{datos["consultas"]} consultas", '
+            f'render;dur={datos["render_s"] * 1000:.1f}, app;dur={total * 1000:.1f}'
+        )
+    return response
+
+
+@app.after_request
+def comprimir_respuesta(response):
+    # gzip/brotli según Accept-Encoding, sólo para respuestas grandes
+    return comprimir(response)
+
+
+@app.teardown_request
+def registrar_metricas(exc):
+    terminar_peticion(request.endpoint)
+
+
+@app.before_request
+def verificar_permisos():
+    if not app.config['PERMISOS_ACTIVOS'] or request.url_rule is None:
+        return
+    # Las rutas que no estén registradas (activas) en la tabla rutas no se protegen
+    ruta_id = id_ruta(request.endpoint, request.url_rule.rule)
+    if ruta_id is None:
+        return
+    usuario_id = session.get('usuario_id')
+    if usuario_id is None:
+        abort(401)
+    if not tiene_permiso(usuario_id, ruta_id):
+        abort(403)
+
+
+def invalidar_caches_persona():
+    """Llamar después de escribir personas, puestos o asignaciones."""
+    invalidar_jerarquia()
+    invalidar_catalogos()
+    invalidar_plantilla()
+    invalidar_versiones()
+
+
+# -----------------------
+# GET condicional de las rutas JSON
+# -----------------------
+# El ETag sale de los contadores de version_tabla o de un hash guardado con
+# la cache, así que un 304 no consulta ni serializa nada. no-cache: el
+# navegador guarda la respuesta pero revalida siempre.
+def no_modificado(etag):
+    resp = app.response_class(status=304)
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    return resp
+
+
+def json_con_etag(datos, etag):
+    resp = respuesta_json(datos)
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    return resp
+
+
+def plantilla_vigente():
+    """Plantilla en cache, recargada si otro worker escribió desde que se armó."""
+    return obtener_plantilla(version_vigente(TABLAS_PLANTILLA))
+
 # -----------------------
 # Página de Inicio
 # -----------------------
 @app.route('/')
 def index():
+    modo = request.args.get('modo', app.config['INDEX_MODO'])
+    if modo == 'servidor':
+        # Sólo catálogos para los filtros; las filas llegan por AJAX
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT DISTINCT estatus FROM persona WHERE estatus IS NOT NULL ORDER BY estatus")
+            estatuses = [r['estatus'] for r in cursor.fetchall()]
+        departamentos, puestos, _ = obtener_catalogos()
+        puestos = sorted(puestos, key=lambda pu: pu['nombre'])
+        return render_template('index.html', data=[], server_side=True,
+                               estatuses=estatuses, departamentos=departamentos, puestos=puestos)
+
     query = """
         SELECT p.id, p.nombres, p.apellidop, p.apellidom, p.correo, p.numero_empleado,
                p.estatus, p.telefono_uno, p.telefono_dos,
@@ -61,40 +226,178 @@ def index():
     return render_template('index.html', data=data)
 
 
-# ----------------------- #
-# Registrar Persona
-# ----------------------- #
-@app.route('/registrar_persona', methods=['GET', 'POST'])
-def registrar_persona():
+# -----------------------
+# Listado paginado en servidor (protocolo server-side de DataTables)
+# -----------------------
+# Sólo el puesto activo: con el historial de puestos una persona saldría
+# repetida y las páginas no cuadrarían con COUNT(DISTINCT p.id)
+PERSONAS_JOINS = """
+    FROM persona p
+    LEFT JOIN baja_persona b ON p.id = b.id_persona
+    LEFT JOIN asigna_puesto ap ON p.id = ap.id_persona AND ap.activo = 1
+    LEFT JOIN puesto pu ON ap.id_puesto = pu.id
+    LEFT JOIN departamento dep ON dep.id = pu.departamento_id
+"""
+
+# Orden fijo del listado; también es la llave del paginado por keyset
+# (índice idx_persona_orden; las tres columnas son NOT NULL desde la migración 5)
+PERSONAS_ORDEN = "p.apellidop, p.apellidom, p.nombres, p.id"
+
+# Filas después de la llave, como rango sobre la primera columna para que
+# MySQL recorra el índice desde ahí; ni (a, b, c, d) > (...) ni COALESCE lo usan.
+# Parámetros: apellidop, apellidop, apellidom, apellidom, nombres, nombres, id
+PERSONAS_DESPUES = """(
+    p.apellidop >= %s AND (
+        p.apellidop > %s
+        OR p.apellidom > %s
+        OR (p.apellidom = %s AND (p.nombres > %s OR (p.nombres = %s AND p.id > %s)))
+    )
+)"""
+
+PERSONAS_MAX_PAGINA = 500
+
+# Conteos del listado por versión de las tablas que lo filtran: pasar de
+# página no vuelve a contar mientras nadie escriba
+PERSONAS_CONTEOS_MAX = 256
+_conteos_personas = OrderedDict()
+_lock_conteos = threading.Lock()
+
+
+def contar_personas(cursor, where, params, version):
+    llave = (version, where, tuple(params))
+    with _lock_conteos:
+        if llave in _conteos_personas:
+            _conteos_personas.move_to_end(llave)
+            return _conteos_personas[llave]
+    if where:
+        cursor.execute(f"SELECT COUNT(DISTINCT p.id) AS total {PERSONAS_JOINS} {where}", params)
+    else:
+        cursor.execute("SELECT COUNT(*) AS total FROM persona")
+    total = cursor.fetchone()['total']
+    with _lock_conteos:
+        _conteos_personas[llave] = total
+        while len(_conteos_personas) > PERSONAS_CONTEOS_MAX:
+            _conteos_personas.popitem(last=False)
+    return total
+
+
+def filtros_personas(args):
+    """
+    Traduce la búsqueda global y los filtros por columna (estatus, puesto,
+    departamento) a condiciones SQL. Regresa (condiciones, params).
+    """
+    condiciones = []
+    params = []
+
+    busqueda = (args.get('search[value]') or args.get('q') or '').strip()
+    if busqueda:
+        like = f"%{busqueda}%"
+        condiciones.append("""(
+            CONCAT_WS(' ', p.nombres, p.apellidop, p.apellidom) LIKE %s
+            OR p.correo LIKE %s
+            OR p.numero_empleado LIKE %s
+            OR pu.nombre LIKE %s
+            OR dep.nombre LIKE %s
+        )""")
+        params += [like] * 5
+
+    if args.get('estatus'):
+        condiciones.append("p.estatus = %s")
+        params.append(args['estatus'])
+    if args.get('puesto'):
+        condiciones.append("pu.id = %s")
+        params.append(args.get('puesto', type=int))
+    if args.get('departamento'):
+        condiciones.append("dep.id = %s")
+        params.append(args.get('departamento', type=int))
+
+    return condiciones, params
+
+
+@app.route('/personas/datatable')
+def personas_datatable():
+    draw = request.args.get('draw', 0, type=int)
+    start = max(request.args.get('start', 0, type=int), 0)
+    length = request.args.get('length', 10, type=int)
+    if length <= 0 or length > PERSONAS_MAX_PAGINA:
+        length = PERSONAS_MAX_PAGINA
+
+    condiciones, params = filtros_personas(request.args)
+    where = ("WHERE " + " AND ".join(condiciones)) if condiciones else ""
+
+    # Keyset: el cliente manda la llave de la última fila que ya vio y se
+    # sigue desde ahí; sin llave (salto directo a una página) se usa OFFSET
+    after = request.args.get('after')
+    pagina_where = where
+    pagina_params = list(params)
+    offset = start
+    if after:
+        try:
+            llave = json.loads(after)
+            assert isinstance(llave, list) and len(llave) == 4
+        except (ValueError, AssertionError):
+            return jsonify({'error': 'Cursor inválido'}), 400
+        apellidop, apellidom, nombres, persona_id = llave
+        pagina_where = ("WHERE " if not condiciones else where + " AND ") + PERSONAS_DESPUES
+        pagina_params += [apellidop, apellidop, apellidom, apellidom, nombres, nombres, persona_id]
+        offset = 0
+
+    version = version_vigente(TABLAS_PLANTILLA)
     with get_connection() as conn:
         cursor = conn.cursor()
+        total = contar_personas(cursor, "", [], version)
+        filtrados = contar_personas(cursor, where, params, version) if condiciones else total
 
-        # Traer departamentos activos
-        cursor.execute(
-            "SELECT id, nombre FROM departamento WHERE activo=1 ORDER BY nombre"
-        )
-        departamentos = cursor.fetchall()  # lista de tuplas (id, nombre)
+        cursor.execute(f"""
+            SELECT p.id, p.nombres, p.apellidop, p.apellidom, p.correo, p.numero_empleado,
+                   p.estatus, p.telefono_uno, p.telefono_dos,
+                   b.motivo AS motivo_baja,
+                   pu.nombre AS puesto, dep.nombre as departamento
+            {PERSONAS_JOINS}
+            {pagina_where}
+            ORDER BY {PERSONAS_ORDEN}
+            LIMIT %s OFFSET %s
+        """, pagina_params + [length, offset])
+        rows = cursor.fetchall()
 
-        # Traer todos los puestos activos con depto y nivel
-        cursor.execute(
-            "SELECT id, nombre, departamento_id, nivel FROM puesto WHERE activo=1 ORDER BY nivel"
-        )
-        puestos = cursor.fetchall()  # (id, nombre, departamento_id, nivel)
+    data = []
+    for row in rows:
+        data.append({
+            'id': row['id'],
+            'nombre_completo': f"{row['nombres']} {row['apellidop']} {row['apellidom']}",
+            'correo': row['correo'],
+            'numero_empleado': row['numero_empleado'],
+            'estatus': row['estatus'],
+            'telefono_uno': row['telefono_uno'],
+            'motivo_baja': row['motivo_baja'],
+            'puesto': row['puesto'] or '',
+            'departamento': row['departamento']
+        })
+
+    cursor_siguiente = None
+    if rows:
+        ultimo = rows[-1]
+        cursor_siguiente = [ultimo['apellidop'], ultimo['apellidom'], ultimo['nombres'], ultimo['id']]
+
+    return jsonify({
+        'draw': draw,
+        'recordsTotal': total,
+        'recordsFiltered': filtrados,
+        'data': data,
+        'start': start,
+        'cursor': cursor_siguiente
+    })
 
-        # Traer todos los jefes posibles con depto y nivel
-        cursor.execute("""
-            SELECT p.id, p.nombres, p.apellidop, p.apellidom, pu.departamento_id, pu.nivel
-            FROM persona p
-            INNER JOIN asigna_puesto ap ON ap.id_persona = p.id AND ap.activo=1
-            INNER JOIN puesto pu ON pu.id = ap.id_puesto
-            ORDER BY pu.nivel ASC, p.apellidop, p.apellidom
-        """)
-        jefes = cursor.fetchall()  # (id, nombres, apellidop, apellidom, departamento_id, nivel)
 
+# ----------------------- #
+# Registrar Persona
+# ----------------------- #
+@app.route('/registrar_persona', methods=['GET', 'POST'])
+def registrar_persona():
     if request.method == 'POST':
         nombres = request.form['nombres']
         apellidop = request.form['apellidop']
-        apellidom = request.form.get('apellidom')
+        apellidom = request.form.get('apellidom') or ''
         telefono_uno = request.form.get('telefono_uno')
         telefono_dos = request.form.get('telefono_dos')
         numero_empleado = request.form.get('numero_empleado')
@@ -112,8 +415,10 @@ def registrar_persona():
                 INSERT INTO persona (nombres, apellidop, apellidom, telefono_uno, telefono_dos, numero_empleado, correo, user_name, password)
                 VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
             """, (nombres, apellidop, apellidom, telefono_uno, telefono_dos, numero_empleado, correo, username, password))
-            conn.commit()
             persona_id = cursor.lastrowid
+            registrar_nodos(cursor, [persona_id])
+            incrementar_versiones(cursor, 'persona')
+            conn.commit()
 
             # Asignar puesto
             if puesto_id:
@@ -121,6 +426,7 @@ def registrar_persona():
                     "INSERT INTO asigna_puesto (id_persona, id_puesto) VALUES (%s, %s)",
                     (persona_id, puesto_id)
                 )
+                incrementar_versiones(cursor, 'asigna_puesto')
                 conn.commit()
 
             # Asignar jefe
@@ -129,11 +435,17 @@ def registrar_persona():
                     "INSERT INTO asigna_jefe (id_persona, id_jefe, fecha_inicio) VALUES (%s, %s, CURDATE())",
                     (persona_id, jefe_id)
                 )
+                ligar(cursor, [persona_id], jefe_id)
+                incrementar_versiones(cursor, 'asigna_jefe')
                 conn.commit()
 
+        invalidar_caches_persona()
         flash("Persona registrada correctamente.", "success")
         return redirect('/registrar_persona')
 
+    # Departamentos activos, puestos activos y jefes posibles (cache compartida)
+    departamentos, puestos, jefes = obtener_catalogos()
+
     return render_template(
         'registrar_persona.html',
         departamentos=departamentos,
@@ -143,143 +455,63 @@ def registrar_persona():
 
 
 # -----------------------
-# Editar Persona
+# Importar Personas (CSV / XLSX)
 # -----------------------
+@app.route('/personas/importar', methods=['GET', 'POST'])
+def importar_personas_archivo():
+    reporte = None
+    if request.method == 'POST':
+        file = request.files.get('archivo')
+        if not file or not file.filename:
+            flash("Archivo inválido o no seleccionado.", "danger")
+            return redirect(url_for('importar_personas_archivo'))
+        try:
+            filas = leer_filas(file.stream, file.filename)
+            reporte = importar_personas(filas, validar_solo=request.form.get('validar') == 'on')
+        except ValueError as e:
+            flash(str(e), "danger")
+            return redirect(url_for('importar_personas_archivo'))
+
+        if reporte['insertadas']:
+            invalidar_caches_persona()
+        if request.args.get('formato') == 'json':
+            return jsonify(reporte)
+
+    return render_template('importar_personas.html', reporte=reporte)
+
+
+@app.cli.command('importar-personas')
+@click.argument('archivo', type=click.Path(exists=True, dir_okay=False))
+@click.option('--validar', is_flag=True, help='Sólo validar, sin guardar.')
+@click.option('--lote', default=IMPORTAR_LOTE, show_default=True, help='Filas por transacción.')
+def importar_personas_cli(archivo, validar, lote):
+    """Importa personas desde un CSV o XLSX."""
+    with open(archivo, 'rb') as f:
+        reporte = importar_personas(leer_filas(f, archivo), lote=lote, validar_solo=validar)
+    for e in reporte['errores']:
+        click.echo(f"Fila {e['fila']}: {e['mensaje']}", err=True)
+    for e in reporte['avisos']:
+        click.echo(f"Fila {e['fila']} (aviso): {e['mensaje']}", err=True)
+    click.echo(f"Leídas: {reporte['total']}  Registradas: {reporte['insertadas']}  Con error: {reporte['con_error']}")
+
+
 # -----------------------
 # Editar Persona
 # -----------------------
-@app.route('/editar_persona/<int:persona_id>', methods=['GET','POST'])
-def editar_persona(persona_id):
-    with get_connection() as conn:
-        cursor = conn.cursor()
-
-        # Traer departamentos activos
-        cursor.execute("SELECT id, nombre FROM departamento WHERE activo=1 ORDER BY nombre")
-        departamentos = cursor.fetchall()
-
-        # Traer todos los puestos activos
-        cursor.execute("SELECT id, nombre, departamento_id, nivel FROM puesto WHERE activo=1 ORDER BY nivel")
-        puestos = cursor.fetchall()
-
-        # Traer todos los jefes posibles con depto y nivel
-        cursor.execute("""
-            SELECT p.id, p.nombres, p.apellidop, p.apellidom, pu.departamento_id, pu.nivel
-            FROM persona p
-            INNER JOIN asigna_puesto ap ON ap.id_persona = p.id AND ap.activo=1
-            INNER JOIN puesto pu ON pu.id = ap.id_puesto
-            WHERE p.id != %s
-            ORDER BY pu.nivel ASC, p.apellidop, p.apellidom
-        """, (persona_id,))
-        jefes = cursor.fetchall()
-
-        # Traer datos de la persona
-        cursor.execute("SELECT * FROM persona WHERE id=%s", (persona_id,))
-        persona = cursor.fetchone()
-
-        # Puesto actual
-        cursor.execute("SELECT id_puesto FROM asigna_puesto WHERE id_persona=%s", (persona_id,))
-        current_puesto = cursor.fetchone()
-        current_puesto_id = current_puesto['id_puesto'] if current_puesto else None
-
-        # Jefe actual
-        cursor.execute("SELECT id_jefe FROM asigna_jefe WHERE id_persona=%s AND fecha_fin IS NULL", (persona_id,))
-        current_jefe = cursor.fetchone()
-        current_jefe_id = current_jefe['id_jefe'] if current_jefe else None
-
-        if request.method == 'POST':
-            nombres = request.form['nombres']
-            apellidop = request.form['apellidop']
-            apellidom = request.form.get('apellidom')
-            telefono_uno = request.form.get('telefono_uno')
-            telefono_dos = request.form.get('telefono_dos')
-            numero_empleado = request.form.get('numero_empleado')
-            correo = request.form.get('correo')
-            puesto_id = request.form.get('puesto_id')
-            jefe_id = request.form.get('jefe_id')
-
-            # Actualizar datos de persona
-            cursor.execute("""
-                UPDATE persona
-                SET nombres=%s, apellidop=%s, apellidom=%s, telefono_uno=%s, telefono_dos=%s,
-                    numero_empleado=%s, correo=%s
-                WHERE id=%s
-            """, (nombres, apellidop, apellidom, telefono_uno, telefono_dos, numero_empleado, correo, persona_id))
-            conn.commit()
-
-            # -------------------------------------------
-            # Detectar si CAMBIÓ EL PUESTO
-            # -------------------------------------------
-            cambio_puesto = (str(puesto_id) != str(current_puesto_id))
-
-            # Actualizar puesto
-            cursor.execute("DELETE FROM asigna_puesto WHERE id_persona=%s", (persona_id,))
-            if puesto_id:
-                cursor.execute("""
-                    INSERT INTO asigna_puesto (id_persona, id_puesto) 
-                    VALUES (%s, %s)
-                """, (persona_id, puesto_id))
-            conn.commit()
-
-            # -------------------------------------------
-            # ***********************************+
-            # REGLA DE JERARQUÍA → SOLO SI CAMBIÓ EL PUESTO
-            # ***********************************+
-            if cambio_puesto:
-
-                # Obtener jefe directo actual antes de cambiar
-                cursor.execute("""
-                    SELECT id_jefe 
-                    FROM asigna_jefe 
-                    WHERE id_persona=%s AND fecha_fin IS NULL
-                """, (persona_id,))
-                row = cursor.fetchone()
-                jefe_directo_actual = row['id_jefe'] if row else None
-
-                # Obtener subordinados de esta persona
-                cursor.execute("""
-                    SELECT id_persona
-                    FROM asigna_jefe
-                    WHERE id_jefe=%s AND fecha_fin IS NULL
-                """, (persona_id,))
-                subordinados = [s['id_persona'] for s in cursor.fetchall()]
-
-                # Cerrar relación actual con subordinados
-                cursor.execute("""
-                    UPDATE asigna_jefe
-                    SET fecha_fin = CURDATE()
-                    WHERE id_jefe=%s AND fecha_fin IS NULL
-                """, (persona_id,))
-
-                # Reasignar subordinados al JEFE DIRECTO de esta persona
-                if jefe_directo_actual:
-                    for sub in subordinados:
-                        cursor.execute("""
-                            INSERT INTO asigna_jefe (id_persona, id_jefe, fecha_inicio)
-                            VALUES (%s, %s, CURDATE())
-                        """, (sub, jefe_directo_actual))
-
-                conn.commit()
-            # ***********************************+
-            # FIN DE REGLA DE JERARQUÍA
-            # -------------------------------------------
-
-            # Limpiar relaciones previas jefe → persona
-            cursor.execute("DELETE FROM asigna_jefe WHERE id_persona=%s", (persona_id,))
-
-            # Insertar nuevo jefe
-            if jefe_id:
-                cursor.execute("""
-                    INSERT INTO asigna_jefe (id_persona, id_jefe, fecha_inicio) 
-                    VALUES (%s, %s, CURDATE())
-                """, (persona_id, jefe_id))
-
-            conn.commit()
-
-            flash("Persona actualizada correctamente.", "success")
-            return redirect(url_for('index'))
+def contexto_edicion(persona_id):
+    """
+    Datos de las páginas de edición. La persona se consulta mientras se
+    obtienen los catálogos (de la cache compartida, sin la persona actual
+    como jefe posible); con la cache fría ambas cargas van en paralelo.
+    """
+    def persona_actual():
+        with get_connection() as conn:
+            return obtener_persona_edicion(conn.cursor(), persona_id)
 
-    return render_template(
-        'editar_persona.html',
+    (persona, current_puesto_id, current_jefe_id), (departamentos, puestos, jefes) = en_paralelo(
+        persona_actual, lambda: obtener_catalogos(excluir_persona=persona_id)
+    )
+    return dict(
         persona=persona,
         departamentos=departamentos,
         puestos=puestos,
@@ -288,94 +520,54 @@ def editar_persona(persona_id):
         current_jefe_id=current_jefe_id
     )
 
+
+@app.route('/editar_persona/<int:persona_id>', methods=['GET','POST'])
+def editar_persona(persona_id):
+    if request.method == 'POST':
+        # Todo el guardado (datos, puesto, regla de jerarquía y jefe) en una transacción
+        try:
+            with get_connection() as conn:
+                cambios = guardar_persona(conn, persona_id, datos_formulario(request.form),
+                                          reasignar_al_cambiar_puesto=True,
+                                          conservar_historial_jefe=False)
+        except CicloJerarquia as e:
+            flash(str(e), "danger")
+            return redirect(url_for('editar_persona', persona_id=persona_id))
+        if cambios is None:
+            flash("Persona no encontrada.", "danger")
+            return redirect(url_for('index'))
+        if any(cambios.values()):
+            invalidar_caches_persona()
+
+        flash("Persona actualizada correctamente.", "success")
+        return redirect(url_for('index'))
+
+    return render_template('editar_persona.html', **contexto_edicion(persona_id))
+
 # -----------------------
 # Editar Persona
 # -----------------------
 @app.route('/editar_persona_arbol/<int:persona_id>', methods=['GET','POST'])
 def editar_persona_arbol(persona_id):
-    with get_connection() as conn:
-        cursor = conn.cursor()
-
-        # Traer departamentos activos
-        cursor.execute("SELECT id, nombre FROM departamento WHERE activo=1 ORDER BY nombre")
-        departamentos = cursor.fetchall()
-
-        # Traer todos los puestos activos con depto y nivel
-        cursor.execute("SELECT id, nombre, departamento_id, nivel FROM puesto WHERE activo=1 ORDER BY nivel")
-        puestos = cursor.fetchall()
-
-        # Traer todos los jefes posibles con depto y nivel, excluyendo la persona actual
-        cursor.execute("""
-            SELECT p.id, p.nombres, p.apellidop, p.apellidom, pu.departamento_id, pu.nivel
-            FROM persona p
-            INNER JOIN asigna_puesto ap ON ap.id_persona = p.id AND ap.activo=1
-            INNER JOIN puesto pu ON pu.id = ap.id_puesto
-            WHERE p.id != %s
-            ORDER BY pu.nivel ASC, p.apellidop, p.apellidom
-        """, (persona_id,))
-        jefes = cursor.fetchall()
-
-        # Traer datos de la persona
-        cursor.execute("SELECT * FROM persona WHERE id=%s", (persona_id,))
-        persona = cursor.fetchone()
-
-        # Traer puesto actual
-        cursor.execute("SELECT id_puesto FROM asigna_puesto WHERE id_persona=%s", (persona_id,))
-        current_puesto = cursor.fetchone()
-        current_puesto_id = current_puesto['id_puesto'] if current_puesto else None
-
-        # Traer jefe actual
-        cursor.execute("SELECT id_jefe FROM asigna_jefe WHERE id_persona=%s AND fecha_fin IS NULL", (persona_id,))
-        current_jefe = cursor.fetchone()
-        current_jefe_id = current_jefe['id_jefe'] if current_jefe else None
-
-        if request.method == 'POST':
-            nombres = request.form['nombres']
-            apellidop = request.form['apellidop']
-            apellidom = request.form.get('apellidom')
-            telefono_uno = request.form.get('telefono_uno')
-            telefono_dos = request.form.get('telefono_dos')
-            numero_empleado = request.form.get('numero_empleado')
-            correo = request.form.get('correo')
-            puesto_id = request.form.get('puesto_id')
-            jefe_id = request.form.get('jefe_id')
-
-            # Actualizar datos de persona
-            cursor.execute("""
-                UPDATE persona
-                SET nombres=%s, apellidop=%s, apellidom=%s, telefono_uno=%s, telefono_dos=%s,
-                    numero_empleado=%s, correo=%s
-                WHERE id=%s
-            """, (nombres, apellidop, apellidom, telefono_uno, telefono_dos, numero_empleado, correo, persona_id))
-            conn.commit()
-
-            # Actualizar puesto
-            cursor.execute("DELETE FROM asigna_puesto WHERE id_persona=%s", (persona_id,))
-            if puesto_id:
-                cursor.execute("INSERT INTO asigna_puesto (id_persona, id_puesto) VALUES (%s, %s)",
-                               (persona_id, puesto_id))
-                conn.commit()
-
-            # Actualizar jefe
-            cursor.execute("UPDATE asigna_jefe SET fecha_fin=CURDATE() WHERE id_persona=%s AND fecha_fin IS NULL",
-                           (persona_id,))
-            if jefe_id:
-                cursor.execute("INSERT INTO asigna_jefe (id_persona, id_jefe, fecha_inicio) VALUES (%s, %s, CURDATE())",
-                               (persona_id, jefe_id))
-                conn.commit()
-
-            flash("Persona actualizada correctamente.", "success")
+    if request.method == 'POST':
+        # Mismo servicio de escritura que editar_persona; aquí el jefe anterior
+        # queda en el historial y no se aplica la regla de subordinados
+        try:
+            with get_connection() as conn:
+                cambios = guardar_persona(conn, persona_id, datos_formulario(request.form))
+        except CicloJerarquia as e:
+            flash(str(e), "danger")
+            return redirect(url_for('editar_persona_arbol', persona_id=persona_id))
+        if cambios is None:
+            flash("Persona no encontrada.", "danger")
             return redirect(url_for('nivel_jerarquico'))
+        if any(cambios.values()):
+            invalidar_caches_persona()
 
-    return render_template(
-        'editar_persona_arbol.html',
-        persona=persona,
-        departamentos=departamentos,
-        puestos=puestos,
-        jefes=jefes,
-        current_puesto_id=current_puesto_id,
-        current_jefe_id=current_jefe_id
-    )
+        flash("Persona actualizada correctamente.", "success")
+        return redirect(url_for('nivel_jerarquico'))
+
+    return render_template('editar_persona_arbol.html', **contexto_edicion(persona_id))
 
 
 # -----------------------
@@ -383,29 +575,14 @@ def editar_persona_arbol(persona_id):
 # -----------------------
 @app.route('/documentacion_persona/<int:persona_id>', methods=['GET','POST'])
 def documentacion_persona(persona_id):
+    if request.method == 'POST':
+        subir_documento(persona_id)
+        return redirect(url_for('documentacion_persona', persona_id=persona_id))
+
     with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM documento WHERE activo=1 ORDER BY nombre")
         documentos = cursor.fetchall()
-
-        if request.method == 'POST':
-            documento_id = request.form['documento_id']
-            file = request.files.get('archivo')
-            if file and allowed_file(file.filename):
-                ext = file.filename.rsplit('.', 1)[1].lower()
-                filename = f"{persona_id}_{int(datetime.now().timestamp())}.{ext}"
-                save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(save_path)
-                cursor.execute(
-                    "INSERT INTO carga_documento_persona (id_persona, id_documento, archivo) VALUES (%s,%s,%s)",
-                    (persona_id, documento_id, filename)
-                )
-                conn.commit()
-                flash("Documento cargado correctamente.", "success")
-            else:
-                flash("Archivo inválido o no seleccionado.", "danger")
-            return redirect(url_for('documentacion_persona', persona_id=persona_id))
-
         cursor.execute(""" 
             SELECT cd.id, d.nombre AS documento, cd.archivo, cd.fecha_carga, cd.valido 
             FROM carga_documento_persona cd 
@@ -417,6 +594,86 @@ def documentacion_persona(persona_id):
 
     return render_template('documentacion_persona.html', persona_id=persona_id, documentos=documentos, cargados=cargados)
 
+
+def subir_documento(persona_id):
+    # Rechazar por Content-Length antes de leer el cuerpo
+    if request.content_length and request.content_length > DOCUMENTO_MAX_BYTES + 64 * 1024:
+        flash(f"El archivo supera el máximo de {DOCUMENTO_MAX_BYTES // (1024 * 1024)} MB.", "danger")
+        return
+    # El cuerpo se parsea aquí y no con request.form/request.files: así cada
+    # archivo se escribe una sola vez, directo a su temporal, con el sha256 y
+    # el límite de tamaño aplicados mientras llega (también sin Content-Length)
+    subida = SubidaDocumentos(app.config['UPLOAD_FOLDER'])
+    try:
+        try:
+            _, form, files = parse_form_data(request.environ, stream_factory=subida,
+                                             max_content_length=app.config['MAX_CONTENT_LENGTH'])
+        except DocumentoDemasiadoGrande as e:
+            flash(f"{e}.", "danger")
+            return
+        file = files.get('archivo')
+        if not (file and allowed_file(file.filename) and form.get('documento_id')):
+            flash("Archivo inválido o no seleccionado.", "danger")
+            return
+        ext = file.filename.rsplit('.', 1)[1].lower()
+        archivo = file.stream
+        archivo.close()
+        # El nombre es el hash del contenido: un archivo repetido se guarda una sola vez
+        # y cada fila de carga_documento_persona cuenta como una referencia
+        filename = nombre_contenido(archivo.sha256(), ext)
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            with candado_archivo(cursor, filename):
+                cursor.execute(
+                    "INSERT INTO carga_documento_persona (id_persona, id_documento, archivo) VALUES (%s,%s,%s)",
+                    (persona_id, form['documento_id'], filename)
+                )
+                conn.commit()
+                colocar_archivo(archivo.ruta, app.config['UPLOAD_FOLDER'], filename)
+        flash("Documento cargado correctamente.", "success")
+    finally:
+        subida.limpiar()
+
+
+# -----------------------
+# Descargar Documento
+# -----------------------
+@app.route('/documento/<int:carga_id>')
+def descargar_documento(carga_id):
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT archivo FROM carga_documento_persona WHERE id=%s", (carga_id,))
+        row = cursor.fetchone()
+    if not row:
+        return "Documento no encontrado", 404
+
+    nombre = row['archivo']
+    etag = etag_documento(nombre)
+    # Un archivo guardado por hash nunca cambia; los anteriores se revalidan siempre
+    cache_control = 'private, max-age=31536000, immutable' if etag else 'private, no-cache'
+    if etag and request.if_none_match.contains_weak(etag):
+        resp = app.response_class(status=304)
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = cache_control
+        return resp
+
+    ruta = os.path.join(app.config['UPLOAD_FOLDER'], nombre)
+    if not os.path.isfile(ruta):
+        return "Documento no encontrado", 404
+
+    if DOCUMENTOS_ACCEL_PREFIX:
+        # nginx entrega el archivo (con Range) desde su location interna
+        resp = app.response_class(mimetype=mimetypes.guess_type(nombre)[0] or 'application/octet-stream')
+        resp.headers['X-Accel-Redirect'] = DOCUMENTOS_ACCEL_PREFIX + nombre
+        if etag:
+            resp.set_etag(etag)
+    else:
+        # conditional=True responde Range (206), If-Range e If-None-Match; el
+        # archivo se entrega con wsgi.file_wrapper (sendfile en gunicorn)
+        resp = send_file(ruta, conditional=True, etag=etag if etag else True)
+    resp.headers['Cache-Control'] = cache_control
+    return resp
+
 # -----------------------
 # Borrar Documento
 # -----------------------
@@ -427,11 +684,11 @@ def borrar_documento(doc_id, persona_id):
         cursor.execute("SELECT archivo FROM carga_documento_persona WHERE id=%s", (doc_id,))
         row = cursor.fetchone()
         if row:
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], row['archivo'])
-            if os.path.exists(file_path):
-                os.remove(file_path)
-            cursor.execute("DELETE FROM carga_documento_persona WHERE id=%s", (doc_id,))
-            conn.commit()
+            # El archivo puede estar compartido con otras cargas; sólo se borra con la última
+            with candado_archivo(cursor, row['archivo']):
+                cursor.execute("DELETE FROM carga_documento_persona WHERE id=%s", (doc_id,))
+                conn.commit()
+                borrar_si_huerfano(cursor, app.config['UPLOAD_FOLDER'], row['archivo'])
             flash("Documento eliminado correctamente.", "success")
         else:
             flash("Documento no encontrado.", "danger")
@@ -454,7 +711,12 @@ def baja_persona(persona_id):
             cursor.execute("INSERT INTO baja_persona (id_persona, motivo) VALUES (%s,%s)",
                            (persona_id, motivo))
             cursor.execute("UPDATE persona SET estatus='Baja' WHERE id=%s", (persona_id,))
+            # Igual que el CTE, que no baja por personas dadas de baja: ni ella
+            # ni su equipo cuentan ya en el subárbol de sus jefes
+            desligar(cursor, [persona_id])
+            incrementar_versiones(cursor, 'persona')
             conn.commit()
+            invalidar_caches_persona()
             flash(f"Persona {nombre_completo} dada de baja correctamente.", "success")
             return redirect(url_for('index'))
 
@@ -464,46 +726,39 @@ def baja_persona(persona_id):
 # ===============================================
 @app.route('/nivel_jerarquico/count/<int:dep_id>')
 def nivel_jerarquico_count(dep_id):
-    with get_connection() as conn:
-        cursor = conn.cursor()
+    plantilla = plantilla_vigente()
+    dep = plantilla['por_id'].get(dep_id)
+    if dep is None:
+        return jsonify([])
+    etag = f"count-{plantilla['etags'][dep_id]}"
+    if request.if_none_match.contains_weak(etag):
+        return no_modificado(etag)
+    return json_con_etag(dep['puestos'], etag)
+
+
+# ===============================================
+#   RUTA: PLANTILLA DE TODOS LOS DEPARTAMENTOS
+# ===============================================
+@app.route('/nivel_jerarquico/plantilla')
+def nivel_jerarquico_plantilla():
+    """Conteo por departamento × puesto × nivel y personas de mayor rango, de todos los departamentos."""
+    plantilla = plantilla_vigente()
+    etag = f"plantilla-{plantilla['etag']}"
+    if request.if_none_match.contains_weak(etag):
+        return no_modificado(etag)
+    return json_con_etag(plantilla['departamentos'], etag)
 
-        cursor.execute("""
-            SELECT 
-                pu.id AS id_puesto,
-                pu.nombre AS puesto,
-                pu.nivel,
-                d.nombre AS departamento,
-                COUNT(ap.id_persona) AS total_empleados
-            FROM puesto pu
-            LEFT JOIN asigna_puesto ap 
-                   ON ap.id_puesto = pu.id AND ap.activo = 1
-            LEFT JOIN departamento d 
-                   ON d.id = pu.departamento_id
-            WHERE pu.activo = 1
-              AND pu.departamento_id = %s
-            GROUP BY pu.id, pu.nombre, pu.nivel, d.nombre
-            ORDER BY pu.nivel DESC, pu.nombre;
-        """, (dep_id,))
-
-        data = cursor.fetchall()
-
-    return jsonify(data)
-    
 # ===============================================
 #   RUTA PRINCIPAL – MUESTRA EL SELECTOR
 # ===============================================
 @app.route('/nivel_jerarquico')
 def nivel_jerarquico():
-    departamentos = {
-        1: "Auditoría",
-        2: "Call Center",
-        3: "Campo 1-14",
-        4: "Campo 15-21",
-        5: "Sabuesos",
-        6: "Cobranza"
-    }
+    # Departamentos desde la tabla; la página trae también la plantilla para
+    # no pedir conteo y personas en cada selección
+    plantilla = plantilla_vigente()['departamentos']
+    departamentos = {d['id']: d['nombre'] for d in plantilla}
 
-    return render_template('nivel_jerarquico.html', departamentos=departamentos)
+    return render_template('nivel_jerarquico.html', departamentos=departamentos, plantilla=plantilla)
 
 
 # =====================================================================================================================================================================================
@@ -511,47 +766,14 @@ def nivel_jerarquico():
 # ======================================================================================================================================
 @app.route('/nivel_jerarquico/personas/<int:dep_id>')
 def nivel_jerarquico_personas(dep_id):
-    with get_connection() as conn:
-        cursor = conn.cursor()
-
-        print(f"🔍 Consultando personas de mayor rango del departamento ID: {dep_id}")
-
-        # Puestos del departamento
-        cursor.execute("""
-            SELECT id, nombre, nivel
-            FROM puesto
-            WHERE activo = 1 AND nombre != 'Gestor 1-14' AND departamento_id = %s
-        """, (dep_id,))
-        puestos = cursor.fetchall()
-
-        print(f"📋 Puestos encontrados: {len(puestos)}")
-
-        if not puestos:
-            print("⚠️ No hay puestos activos en este departamento.")
-            return jsonify([])
-
-        nivel_max = max(p['nivel'] for p in puestos)
-        puestos_top = [p['id'] for p in puestos if p['nivel'] == nivel_max]
-
-        print(f"🏆 Nivel jerárquico más alto: {nivel_max}")
-        print(f"🧩 Puestos top IDs: {puestos_top}")
-
-        # Personas que ocupan esos puestos
-        cursor.execute("""
-            SELECT p.id,
-                   CONCAT(p.apellidop,' ',p.apellidom,' ',p.nombres) AS nombre,
-                   ap.id_puesto
-            FROM persona p
-            JOIN asigna_puesto ap ON p.id = ap.id_persona
-            WHERE ap.id_puesto IN %s
-              AND p.estatus != 'Baja'
-        """, (tuple(puestos_top),))
-
-        personas_top = cursor.fetchall()
-
-        print(f"👤 Personas de mayor rango encontradas: {len(personas_top)}")
-
-    return jsonify(personas_top)
+    plantilla = plantilla_vigente()
+    dep = plantilla['por_id'].get(dep_id)
+    if dep is None:
+        return jsonify([])
+    etag = f"personas-{plantilla['etags'][dep_id]}"
+    if request.if_none_match.contains_weak(etag):
+        return no_modificado(etag)
+    return json_con_etag(dep['top'], etag)
 
 
 
@@ -560,259 +782,185 @@ def nivel_jerarquico_personas(dep_id):
 # ===============================================
 @app.route('/nivel_jerarquico/colaborador/<int:persona_id>')
 def nivel_jerarquico_colaborador(persona_id):
-    import matplotlib.pyplot as plt
-    import networkx as nx
-    from networkx.drawing.nx_pydot import graphviz_layout
-    from io import BytesIO
-    import base64
-    import colorsys
-    import time
-
-    print("\n" + "="*60)
-    print(f"📊 [INICIO] Generando organigrama desde colaborador ID: {persona_id}")
-    inicio = time.time()
+    # ?format=svg usa el render vectorial nativo; por defecto PNG con matplotlib
+    formato = request.args.get('format', 'png')
+    if formato not in FORMATOS:
+        formato = 'png'
 
     with get_connection() as conn:
-        cursor = conn.cursor()
+        nodos, aristas = grafica_colaborador(conn.cursor(), persona_id, app.config['SUBARBOL_MODO'])
 
-        print("🔍 Consultando personas y relaciones jerárquicas...")
-        cursor.execute("""
-            SELECT p.id,
-                   p.nombres,
-                   p.apellidop,
-                   ap.id_puesto,
-                   aj.id_jefe
-            FROM persona p
-            JOIN asigna_puesto ap ON p.id = ap.id_persona
-            LEFT JOIN asigna_jefe aj 
-                  ON p.id = aj.id_persona 
-                 AND (aj.fecha_fin IS NULL OR aj.fecha_fin >= CURDATE())
-            WHERE p.estatus != 'Baja'
-        """)
-        personas = cursor.fetchall()
-        print(f"✅ Personas activas obtenidas: {len(personas)}")
-
-        cursor.execute("SELECT id, nombre, nivel FROM puesto")
-        puestos = cursor.fetchall()
-        print(f"✅ Puestos cargados: {len(puestos)}")
-
-        puesto_map = {p['id']: p for p in puestos}
-
-    # Encontrar subárbol empezando en persona_id
-    print("🌳 Construyendo subárbol jerárquico...")
-    hijos = []
-    pendientes = [persona_id]
-
-    while pendientes:
-        actual = pendientes.pop(0)
-        hijos.append(actual)
-        for p in personas:
-            if p.get('id_jefe') == actual:
-                pendientes.append(p['id'])
-
-    personas_filtradas = [p for p in personas if p['id'] in hijos]
-    print(f"✅ Subárbol construido con {len(personas_filtradas)} personas.\n")
-
-    # ---------------------------------------------------
-    # REUTILIZAR LA FUNCIÓN DE GENERAR GRÁFICA
-    # ---------------------------------------------------
-    def generar_grafica(personas_dep):
-        import matplotlib.pyplot as plt
-        import networkx as nx
-        from networkx.drawing.nx_pydot import graphviz_layout
-        from io import BytesIO
-        import base64
-        import colorsys
-
-        print("🎨 [GRAFICANDO] Iniciando render del organigrama...")
-        G = nx.DiGraph()
-        nodos_map = {}
-        niveles_map = {}
-
-        for persona in personas_dep:
-            puesto = puesto_map.get(persona['id_puesto'])
-            if not puesto:
-                print(f"⚠️ Puesto no encontrado para persona ID {persona['id']}")
-                continue
-           # Agregar gestores_count al nodo solo si hay gestores bajo este jefe
-            # Crear nodo principal del jefe
-            nodo = f"{persona['nombres']}\n{persona['apellidop']}\n({puesto['nombre']})"
-            G.add_node(nodo)
-            nodos_map[persona['id']] = nodo
-            niveles_map[nodo] = puesto['nivel']
-
-            # --- NUEVO: agregar nodo de Gestores ---
-            # --- NUEVO: agregar nodo de Gestores ---
-            count = persona.get('gestores_count', 0)
-            if count > 0:
-                # ID único para que cada jefe tenga su propio nodo de gestores
-                nodo_gestores_id = f"gestores_{persona['id']}"
-                # Etiqueta visual del nodo (lo que se mostrará en la gráfica)
-                etiqueta_gestores = f"{count} Gestores"
-                
-                # Crear nodo único pero con etiqueta visible igual
-                G.add_node(nodo_gestores_id, label=etiqueta_gestores)
-                niveles_map[nodo_gestores_id] = puesto['nivel'] + 0.5
-                G.add_edge(nodo, nodo_gestores_id)
-
-
-        print(f"✅ Nodos creados: {len(G.nodes())}")
-
-        relaciones = 0
-        for persona in personas_dep:
-            if persona.get('id_jefe'):
-                jefe_nodo = nodos_map.get(persona['id_jefe'])
-                if jefe_nodo:
-                    G.add_edge(jefe_nodo, nodos_map[persona['id']])
-                    relaciones += 1
-
-        print(f"🧩 Relaciones jerárquicas detectadas: {relaciones}")
-
-        # Intentar con graphviz primero
-        try:
-            pos = graphviz_layout(G, prog='dot')
-            print("✅ Layout generado con Graphviz.")
-        except Exception as e:
-            print(f"⚠️ Error con Graphviz ({e}), usando spring_layout...")
-            pos = nx.spring_layout(G)
-            print("✅ Layout alternativo generado con spring_layout.")
-
-        niveles_unicos = sorted(set(niveles_map.values()))
-        print(f"🌈 Niveles jerárquicos detectados: {len(niveles_unicos)}")
-
-        def pastel(h):
-            r, g, b = colorsys.hls_to_rgb(h, 0.8, 0.6)
-            return (r, g, b)
-
-        color_map = {
-            nivel: pastel(i / len(niveles_unicos))
-            for i, nivel in enumerate(niveles_unicos)
-        }
-        # Define un color fijo para todos los nodos "gestores"
-        color_gestores = (0.95, 0.90, 0.65)  # tono beige claro, puedes cambiarlo
-
-        node_colors = []
-        for n in G.nodes():
-            if str(n).startswith("gestores_"):
-                node_colors.append(color_gestores)
-            else:
-                node_colors.append(color_map[niveles_map[n]])
-
-        max_size = 2000
-        min_size = 1000
-        nivel_max = max(niveles_unicos)
-        nivel_min = min(niveles_unicos)
-        node_sizes = [
-            min_size + (niveles_map[n] - nivel_min) / (nivel_max - nivel_min) * (max_size - min_size)
-            if nivel_max != nivel_min else max_size
-            for n in G.nodes()
-        ]
-
-        plt.figure(figsize=(14, 6))
-        nx.draw_networkx_nodes(G, pos, node_color=node_colors, node_size=node_sizes)
-        labels = {n: G.nodes[n].get('label', n) for n in G.nodes()}
-        nx.draw_networkx_labels(G, pos, labels=labels, font_size=7)
-        nx.draw_networkx_edges(G, pos, arrows=False)
-        plt.axis('off')
-
-        img = BytesIO()
-        plt.savefig(img, format='png', bbox_inches='tight')
-        plt.close()
-        img.seek(0)
-
-        print("✅ Imagen del organigrama generada correctamente.\n")
-        return base64.b64encode(img.read()).decode('utf-8')
-
-    from collections import defaultdict
-    import copy
-
-    # Crear copia para no alterar el original
-    personas_filtradas_pre = copy.deepcopy(personas_filtradas)
-
-    # Contar gestores por jefe
-    gestores_count = defaultdict(int)
-    for p in personas_filtradas_pre:
-        if p['id_puesto'] == 1 and p.get('id_jefe'):
-            gestores_count[p['id_jefe']] += 1
-
-    # Marcar jefes con la cantidad de gestores
-    for p in personas_filtradas_pre:
-        count = gestores_count.get(p['id'], 0)
-        if count > 0:
-            # Agregar campo extra para mostrar en la etiqueta del nodo
-            p['gestores_count'] = count
-        else:
-            p['gestores_count'] = 0
+    # El dibujo se hace en el pool de render; si el mismo equipo ya se dibujó
+    # (o se está dibujando) se reutiliza. Los chicos terminan dentro de la espera.
+    with medir_render():
+        trabajo = cola_render.enviar(nodos, aristas, formato)
+        estado = cola_render.esperar(trabajo) if trabajo else None
 
-    # Eliminar los nodos individuales de los gestores para que no se dibujen
-    personas_filtradas_pre = [p for p in personas_filtradas_pre if p['id_puesto'] != 1]
+    graph_url = url_for('organigrama_imagen', nombre=trabajo) if estado == 'listo' else None
+    trabajo_url = url_for('organigrama_trabajo', nombre=trabajo) if estado == 'pendiente' else None
+    return render_template('nivel_jerarquico_dep.html',
+                           graph_url=graph_url, trabajo_url=trabajo_url)
 
-    # Ahora pasas personas_filtradas_pre a tu función original
-    graph_base64 = generar_grafica(personas_filtradas_pre)
 
+# ===============================================
+#   RUTA: GRAFO DEL SUBÁRBOL EN JSON (con diferencias por versión)
+# ===============================================
+@app.route('/nivel_jerarquico/grafo/<int:persona_id>')
+def nivel_jerarquico_grafo(persona_id):
+    """
+    Nodos (persona, puesto, nivel, gestores) y aristas del subárbol con la
+    versión de la jerarquía. Con ?since=<versión> sólo regresa lo agregado,
+    cambiado y eliminado desde esa versión (o el grafo completo con
+    completo=true si el servidor ya no tiene esa versión).
+    """
+    desde = request.args.get('since', type=int)
+    with get_connection() as conn:
+        return respuesta_json(grafo_versionado(conn, persona_id, desde, app.config['SUBARBOL_MODO']))
 
-    fin = time.time()
-    print(f"⏱️ [FIN] Organigrama del colaborador ID {persona_id} generado en {fin - inicio:.2f} segundos.")
-    print("="*60 + "\n")
 
-    return render_template('nivel_jerarquico_dep.html',
-                           graph_base64=graph_base64)
+# -----------------------
+# Imagen del organigrama (cache por contenido)
+# -----------------------
+@app.route('/nivel_jerarquico/organigrama/<nombre>')
+def organigrama_imagen(nombre):
+    if not nombre_valido(nombre):
+        return "Imagen no encontrada", 404
+    etag, ext = nombre.rsplit('.', 1)
+    if request.if_none_match.contains_weak(etag):
+        resp = app.response_class(status=304)
+    else:
+        datos = cache_render.obtener(nombre)
+        if datos is None:
+            return "Imagen no encontrada", 404
+        resp = app.response_class(datos, mimetype=FORMATOS[ext])
+    # El nombre es el hash del contenido: la imagen nunca cambia bajo la misma URL
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return resp
+
+
+@app.route('/nivel_jerarquico/organigrama/trabajo/<nombre>')
+def organigrama_trabajo(nombre):
+    """Estado de un render encolado; el id del trabajo es el nombre de la imagen."""
+    if not nombre_valido(nombre):
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    estado = cola_render.estado(nombre)
+    if estado is None:
+        # Lo encoló otro worker o se perdió: el cliente vuelve a pedir el organigrama
+        return jsonify({'id': nombre, 'estado': 'desconocido'}), 404
+    if estado == 'listo':
+        return jsonify({'id': nombre, 'estado': 'listo',
+                        'url': url_for('organigrama_imagen', nombre=nombre)})
+    if estado == 'pendiente':
+        return jsonify({'id': nombre, 'estado': 'pendiente'}), 202
+    return jsonify({'id': nombre, 'estado': 'error', 'error': estado[1]}), 500
+
+
+@app.route('/nivel_jerarquico/organigrama/trabajos')
+def organigrama_trabajos():
+    return jsonify({'cola': cola_render.estadisticas(), 'precalentado': precalentado,
+                    'cache': cache_render.estadisticas()})
+
+
+@app.cli.command('precalentar-organigramas')
+@click.option('--formato', 'formatos', multiple=True, default=('png',), show_default=True,
+              type=click.Choice(sorted(FORMATOS)))
+def precalentar_organigramas_cli(formatos):
+    """Dibuja los organigramas de las personas de mayor rango de cada departamento."""
+    total = precalentar_organigramas(formatos, modo=app.config['SUBARBOL_MODO'], esperar=True)
+    click.echo(f"Organigramas encolados: {total}  {cola_render.estadisticas()}")
 
 
 
 
 # -----------------------
+COLABORADOR_COLUMNAS = """
+    SELECT p.id, p.nombres, p.apellidop, p.apellidom, p.correo, p.numero_empleado,
+           p.estatus, p.telefono_uno, p.telefono_dos, 
+           pu.id AS id_puesto, pu.nombre AS puesto, pu.departamento_id,
+           aj.id_jefe, dep.nombre as departamento,
+           CONCAT(j.nombres, ' ', j.apellidop, ' ', j.apellidom) AS nombre_jefe,
+           pu_jefe.nombre AS puesto_jefe
+"""
+
+COLABORADOR_JOINS = """
+    JOIN asigna_puesto ap 
+        ON ap.id_persona = p.id 
+        AND ap.activo = 1
+    LEFT JOIN puesto pu 
+        ON pu.id = ap.id_puesto
+    LEFT JOIN departamento dep 
+        ON dep.id = pu.departamento_id
+    LEFT JOIN asigna_jefe aj 
+        ON aj.id_persona = p.id 
+        AND aj.fecha_fin IS NULL
+    LEFT JOIN persona j 
+        ON j.id = aj.id_jefe
+    LEFT JOIN asigna_puesto ap_jefe 
+        ON ap_jefe.id_persona = j.id 
+        AND ap_jefe.activo = 1
+    LEFT JOIN puesto pu_jefe 
+        ON pu_jefe.id = ap_jefe.id_puesto
+"""
+
+
+def consulta_colaborador_tabla(persona_id, condiciones=(), params_extra=(), version=None):
+    """
+    SQL del subárbol de persona_id con sus joins, según SUBARBOL_MODO.
+    Regresa (sql, params, profundidades); profundidades es None cuando la
+    columna ya viene en la consulta (modos 'sql' y 'cierre'). `version` (de
+    la jerarquía) evita usar un índice en memoria anterior a ella.
+    """
+    extra = "".join(f" AND {c}" for c in condiciones)
+    if app.config['SUBARBOL_MODO'] == 'sql':
+        # El subárbol y sus joins se resuelven en un solo viaje a MySQL
+        sql = (SUBARBOL_CTE + COLABORADOR_COLUMNAS
+               + ", s.profundidad FROM subarbol s JOIN persona p ON p.id = s.id"
+               + COLABORADOR_JOINS + "WHERE p.estatus != 'Baja'" + extra)
+        return sql, [persona_id, PROFUNDIDAD_MAX, *params_extra], None
+    if app.config['SUBARBOL_MODO'] == 'cierre':
+        sql = (COLABORADOR_COLUMNAS
+               + ", c.profundidad FROM jerarquia_cierre c JOIN persona p ON p.id = c.descendiente"
+               + COLABORADOR_JOINS + "WHERE c.ancestro = %s AND p.estatus != 'Baja'" + extra)
+        return sql, [persona_id, *params_extra], None
+
+    # Subárbol desde el índice jerárquico
+    profundidades = obtener_jerarquia(version).profundidades(persona_id)
+    sql = (COLABORADOR_COLUMNAS + "FROM persona p" + COLABORADOR_JOINS
+           + "WHERE p.estatus != 'Baja' AND p.id IN %s" + extra)
+    return sql, [tuple(profundidades), *params_extra], profundidades
+
+
 @app.route('/nivel_jerarquico/colaborador_tabla/<int:persona_id>')
 def nivel_jerarquico_colaborador_tabla(persona_id):
     """
     Devuelve en JSON todos los empleados bajo un colaborador
     incluyendo al colaborador mismo, similar a la tabla del index.
+    El ETag es la versión de las tablas de las que sale la respuesta; el
+    jefe vigente es el de fecha_fin IS NULL, así que el cuerpo no cambia
+    con la fecha y un 304 sigue siendo válido después de medianoche.
+    Con ?formato=columnas manda un arreglo por columna y los textos
+    repetidos como índices a un diccionario (ver respuestas.a_columnas).
     """
+    modo = app.config['SUBARBOL_MODO']
+    formato = 'columnas' if request.args.get('formato') == 'columnas' else 'filas'
+    # ETag e índice salen de la misma lectura de contadores: si la cache se
+    # refresca a media petición, el cuerpo no queda de otra versión que su ETag
+    versiones = versiones_vigentes()
+    etag = f"colaborador-{persona_id}-{modo}-{formato}-{version_vigente(TABLAS_COLABORADOR, versiones)}"
+    if request.if_none_match.contains_weak(etag):
+        return no_modificado(etag)
+
+    sql, params, profundidades = consulta_colaborador_tabla(
+        persona_id, version=version_vigente(TABLAS_JERARQUIA, versiones))
     with get_connection() as conn:
         cursor = conn.cursor()
+        cursor.execute(sql, params)
+        filtrados = cursor.fetchall()
 
-        # Obtener personas y su puesto
-        cursor.execute("""
-            SELECT p.id, p.nombres, p.apellidop, p.apellidom, p.correo, p.numero_empleado,
-                   p.estatus, p.telefono_uno, p.telefono_dos, 
-                   pu.id AS id_puesto, pu.nombre AS puesto, pu.departamento_id,
-                   aj.id_jefe, dep.nombre as departamento,
-                   CONCAT(j.nombres, ' ', j.apellidop, ' ', j.apellidom) AS nombre_jefe,
-                   pu_jefe.nombre AS puesto_jefe
-            FROM persona p
-            JOIN asigna_puesto ap 
-                ON ap.id_persona = p.id 
-                AND ap.activo = 1
-            LEFT JOIN puesto pu 
-                ON pu.id = ap.id_puesto
-            LEFT JOIN departamento dep 
-                ON dep.id = pu.departamento_id
-            LEFT JOIN asigna_jefe aj 
-                ON aj.id_persona = p.id 
-                AND (aj.fecha_fin IS NULL OR aj.fecha_fin >= CURDATE())
-            LEFT JOIN persona j 
-                ON j.id = aj.id_jefe
-            LEFT JOIN asigna_puesto ap_jefe 
-                ON ap_jefe.id_persona = j.id 
-                AND ap_jefe.activo = 1
-            LEFT JOIN puesto pu_jefe 
-                ON pu_jefe.id = ap_jefe.id_puesto
-            WHERE p.estatus != 'Baja';
-        """)
-        personas = cursor.fetchall()
-
-    # Construir mapa de jerarquía
-    hijos = []
-    pendientes = [persona_id]
-    while pendientes:
-        actual = pendientes.pop(0)
-        hijos.append(actual)
-        for p in personas:
-            if p.get('id_jefe') == actual:
-                pendientes.append(p['id'])
-
-    # Filtrar solo los de la misma jerarquía
-    filtrados = [p for p in personas if p['id'] in hijos]
+    if profundidades is not None:
+        for p in filtrados:
+            p['profundidad'] = profundidades.get(p['id'])
 
     # Formatear como en index
     data = []
@@ -833,11 +981,104 @@ def nivel_jerarquico_colaborador_tabla(persona_id):
         'jefe_id': p['id_jefe'],                   # <-- Filtro Gestor / Jefe
         'departamento': p['departamento'],
         'nombre_jefe': p['nombre_jefe'],
-        'puesto_jefe': p['puesto_jefe']
+        'puesto_jefe': p['puesto_jefe'],
+        'profundidad': p['profundidad']
 
     })
 
-    return jsonify(data)
+    if formato == 'columnas':
+        return json_con_etag(a_columnas(data), etag)
+    return json_con_etag(data, etag)
+
+
+@app.route('/nivel_jerarquico/colaborador/<int:persona_id>/cadena')
+def nivel_jerarquico_cadena(persona_id):
+    """Cadena de mando hasta la cabeza del departamento y tamaño del equipo (tabla de cierre)."""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cadena = cadena_mando(cursor, persona_id)
+        total = total_descendientes(cursor, [persona_id])[persona_id]
+    return jsonify({'persona_id': persona_id, 'cadena': cadena, 'total_descendientes': total})
+
+
+@app.cli.command('reconstruir-cierre')
+def reconstruir_cierre_cli():
+    """Rehace jerarquia_cierre desde asigna_jefe (carga inicial o reparación)."""
+    with get_connection() as conn:
+        total = reconstruir_cierre(conn)
+    click.echo(f"Filas en jerarquia_cierre: {total}")
+
+
+# -----------------------
+# Exportar (CSV / XLSX en streaming)
+# -----------------------
+def _nombre_completo(p):
+    return f"{p['nombres']} {p['apellidop']} {p['apellidom']}"
+
+
+@app.route('/personas/exportar.<formato>')
+def exportar_personas(formato):
+    """Listado del index con los mismos filtros que /personas/datatable."""
+    if formato not in FORMATOS_EXPORTACION:
+        return "Formato no soportado", 404
+    condiciones, params = filtros_personas(request.args)
+    where = ("WHERE " + " AND ".join(condiciones)) if condiciones else ""
+    sql = f"""
+        SELECT p.id, p.nombres, p.apellidop, p.apellidom, p.correo, p.numero_empleado,
+               p.estatus, p.telefono_uno, p.telefono_dos,
+               b.motivo AS motivo_baja,
+               pu.nombre AS puesto, dep.nombre as departamento
+        {PERSONAS_JOINS}
+        {where}
+        ORDER BY {PERSONAS_ORDEN}
+    """
+    columnas = [
+        ('ID', lambda p: p['id']),
+        ('Nombre Completo', _nombre_completo),
+        ('Número de Empleado', lambda p: p['numero_empleado']),
+        ('Correo', lambda p: p['correo']),
+        ('Teléfono 1', lambda p: p['telefono_uno']),
+        ('Teléfono 2', lambda p: p['telefono_dos']),
+        ('Departamento', lambda p: p['departamento']),
+        ('Puesto', lambda p: p['puesto'] or ''),
+        ('Estatus', lambda p: p['estatus']),
+        ('Motivo Baja', lambda p: p['motivo_baja']),
+    ]
+    return respuesta_exportacion(filas_sin_buffer(sql, params), columnas, 'personas', formato)
+
+
+@app.route('/nivel_jerarquico/colaborador_tabla/<int:persona_id>/exportar.<formato>')
+def exportar_colaborador_tabla(persona_id, formato):
+    """Subárbol de un colaborador; acepta los filtros de la vista (puesto, nombre_jefe)."""
+    if formato not in FORMATOS_EXPORTACION:
+        return "Formato no soportado", 404
+    condiciones, params_extra = [], []
+    if request.args.get('puesto'):
+        condiciones.append("pu.nombre = %s")
+        params_extra.append(request.args['puesto'])
+    if request.args.get('nombre_jefe'):
+        condiciones.append("CONCAT(j.nombres, ' ', j.apellidop, ' ', j.apellidom) = %s")
+        params_extra.append(request.args['nombre_jefe'])
+
+    sql, params, profundidades = consulta_colaborador_tabla(persona_id, condiciones, params_extra)
+    if profundidades is None:
+        profundidad = lambda p: p['profundidad']
+    else:
+        profundidad = lambda p: profundidades.get(p['id'])
+
+    columnas = [
+        ('ID', lambda p: p['id']),
+        ('Nombre Completo', _nombre_completo),
+        ('Número de Empleado', lambda p: p['numero_empleado']),
+        ('Departamento', lambda p: p['departamento']),
+        ('Puesto', lambda p: p['puesto'] or ''),
+        ('Estatus', lambda p: p['estatus']),
+        ('Nombre Jefe', lambda p: p['nombre_jefe']),
+        ('Puesto Jefe', lambda p: p['puesto_jefe']),
+        ('Profundidad', profundidad),
+    ]
+    return respuesta_exportacion(filas_sin_buffer(sql, params), columnas,
+                                 f'colaborador_{persona_id}', formato)
 #------------------------------------------
 # ------------------------------------------
 # ***********************************+
@@ -947,6 +1188,7 @@ def registrar_ausencia(persona_id=None):
                 VALUES (%s,%s,%s,%s,%s,%s)
             """, (id_persona, id_razon, descripcion, fecha_inicio.strftime('%Y-%m-%d %H:%M:%S'),
                   fecha_fin.strftime('%Y-%m-%d %H:%M:%S'), (request.remote_addr or 'web')))
+            incrementar_versiones(cursor, 'ausencia')
             conn.commit()
         flash("Ausencia registrada correctamente.", "success")
         return redirect(url_for('index'))
@@ -970,12 +1212,51 @@ def ver_ausencias_persona(persona_id):
         ausencias = cursor.fetchall()
     return render_template('ver_ausencias_persona.html', ausencias=ausencias, persona_id=persona_id)
 
+# Ausencias de un subárbol en un rango de fechas
+@app.route('/ausencia/subarbol/<int:persona_id>')
+def ausencias_subarbol(persona_id):
+    """
+    Quién del subárbol de persona_id está ausente entre ?desde y ?hasta
+    (YYYY-MM-DD, ambos incluidos) y cuántos quedan disponibles cada día.
+    """
+    try:
+        desde, hasta = leer_rango(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        ids = ids_subarbol(cursor, persona_id, app.config['SUBARBOL_MODO'])
+        ausencias = ausencias_en_rango(cursor, ids, desde, hasta)
+
+    intervalos = intervalos_por_persona(ausencias, desde, hasta)
+    return jsonify({
+        'persona_id': persona_id,
+        'desde': desde.isoformat(),
+        'hasta': hasta.isoformat(),
+        'plantilla': len(ids),
+        'ausentes': len(intervalos),
+        'ausencias': [{
+            'id': a['id'],
+            'id_persona': a['id_persona'],
+            'nombre': a['nombre'],
+            'numero_empleado': a['numero_empleado'],
+            'razon': a['razon'],
+            'descripcion': a['descripcion'],
+            'fecha_inicio': a['fecha_inicio'].isoformat(),
+            'fecha_fin': a['fecha_fin'].isoformat(),
+        } for a in ausencias],
+        'serie': serie_disponibles(ausencias, len(ids), desde, hasta),
+    })
+
+
 # Desactivar (eliminar lógico) ausencia
 @app.route('/ausencia/eliminar/<int:ausencia_id>', methods=['POST'])
 def eliminar_ausencia(ausencia_id):
     with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("UPDATE ausencia SET activo=0 WHERE id=%s", (ausencia_id,))
+        incrementar_versiones(cursor, 'ausencia')
         conn.commit()
     flash("Ausencia desactivada.", "warning")
     return redirect(request.referrer or url_for('index'))
@@ -1036,119 +1317,178 @@ def eliminar_rol(rol_id):
 # Editar permisos de un ROL (checkboxes por ruta)
 @app.route('/roles/<int:rol_id>/permisos', methods=['GET','POST'])
 def editar_permisos_rol(rol_id):
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        # Obtener rol
-        cursor.execute("SELECT * FROM roles WHERE id=%s", (rol_id,))
-        rol = cursor.fetchone()
-
-        # Todas las rutas/módulos
-        cursor.execute("SELECT * FROM rutas WHERE activo=1 ORDER BY id")
-        rutas = cursor.fetchall()
-
-        # Permisos actuales del rol
-        cursor.execute("SELECT ruta_id FROM permiso_rol WHERE rol_id=%s", (rol_id,))
-        actuales = {r['ruta_id'] for r in cursor.fetchall()}
-
-        if request.method == 'POST':
-            seleccionadas = request.form.getlist('rutas')  # strings de ids
-            # Normalizar a ints (seguro)
-            seleccionadas = [int(x) for x in seleccionadas]
+    if request.method == 'POST':
+        seleccionadas = request.form.getlist('rutas')  # strings de ids
+        # Normalizar a ints (seguro)
+        seleccionadas = [int(x) for x in seleccionadas]
 
+        with get_connection() as conn:
+            cursor = conn.cursor()
             # Eliminar permisos previos y reinsertar
             cursor.execute("DELETE FROM permiso_rol WHERE rol_id=%s", (rol_id,))
             if seleccionadas:
                 args = [(rol_id, rid) for rid in seleccionadas]
                 cursor.executemany("INSERT INTO permiso_rol (rol_id, ruta_id) VALUES (%s,%s)", args)
+            incrementar_versiones(cursor, 'permiso_rol')
             conn.commit()
-            flash("Permisos del rol actualizados.", "success")
-            return redirect(url_for('editar_permisos_rol', rol_id=rol_id))
+        cache_permisos.invalidar()
+        flash("Permisos del rol actualizados.", "success")
+        return redirect(url_for('editar_permisos_rol', rol_id=rol_id))
+
+    # Rol, rutas activas y permisos actuales del rol, en paralelo
+    rol, rutas, actuales = consultas_en_paralelo(
+        ("SELECT * FROM roles WHERE id=%s", (rol_id,), True),
+        ("SELECT * FROM rutas WHERE activo=1 ORDER BY id", None),
+        ("SELECT ruta_id FROM permiso_rol WHERE rol_id=%s", (rol_id,)),
+    )
+    actuales = {r['ruta_id'] for r in actuales}
 
     return render_template('editar_permisos.html', rol=rol, rutas=rutas, actuales=actuales)
 
 # Asignar roles a un usuario (multiples)
 @app.route('/usuarios/<int:usuario_id>/roles', methods=['GET','POST'])
 def asignar_roles_usuario(usuario_id):
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, nombres, apellidop, apellidom FROM persona WHERE id=%s", (usuario_id,))
-        usuario = cursor.fetchone()
-
-        # Lista de roles activos
-        cursor.execute("SELECT * FROM roles WHERE activo=1 ORDER BY nombre")
-        roles = cursor.fetchall()
-
-        # Roles actuales del usuario
-        cursor.execute("SELECT rol_id FROM usuario_roles WHERE usuario_id=%s", (usuario_id,))
-        actuales = {r['rol_id'] for r in cursor.fetchall()}
-
-        if request.method == 'POST':
-            seleccionados = request.form.getlist('roles')  # strings
-            seleccionados = [int(x) for x in seleccionados]
+    if request.method == 'POST':
+        seleccionados = request.form.getlist('roles')  # strings
+        seleccionados = [int(x) for x in seleccionados]
 
+        with get_connection() as conn:
+            cursor = conn.cursor()
             # Reemplazar asignaciones (simple estrategia)
             cursor.execute("DELETE FROM usuario_roles WHERE usuario_id=%s", (usuario_id,))
             if seleccionados:
                 args = [(usuario_id, rid) for rid in seleccionados]
                 cursor.executemany("INSERT INTO usuario_roles (usuario_id, rol_id) VALUES (%s,%s)", args)
+            incrementar_versiones(cursor, 'usuario_roles')
             conn.commit()
-            flash("Roles asignados al usuario.", "success")
-            return redirect(url_for('asignar_roles_usuario', usuario_id=usuario_id))
+        cache_permisos.invalidar()
+        flash("Roles asignados al usuario.", "success")
+        return redirect(url_for('asignar_roles_usuario', usuario_id=usuario_id))
+
+    # Usuario, roles activos y roles actuales del usuario, en paralelo
+    usuario, roles, actuales = consultas_en_paralelo(
+        ("SELECT id, nombres, apellidop, apellidom FROM persona WHERE id=%s", (usuario_id,), True),
+        ("SELECT * FROM roles WHERE activo=1 ORDER BY nombre", None),
+        ("SELECT rol_id FROM usuario_roles WHERE usuario_id=%s", (usuario_id,)),
+    )
+    actuales = {r['rol_id'] for r in actuales}
 
     return render_template('asignar_roles.html', usuario=usuario, roles=roles, actuales=actuales)
 
 # Editar permisos por USUARIO (excepciones directas)
 @app.route('/usuarios/<int:usuario_id>/permisos', methods=['GET','POST'])
 def editar_permisos_usuario(usuario_id):
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, nombres, apellidop, apellidom FROM persona WHERE id=%s", (usuario_id,))
-        usuario = cursor.fetchone()
-
-        cursor.execute("SELECT * FROM rutas WHERE activo=1 ORDER BY nombre")
-        rutas = cursor.fetchall()
-
-        cursor.execute("SELECT ruta_id FROM permisos_usuario WHERE usuario_id=%s", (usuario_id,))
-        actuales = {r['ruta_id'] for r in cursor.fetchall()}
-
-        if request.method == 'POST':
-            seleccionadas = [int(x) for x in request.form.getlist('rutas')]
+    if request.method == 'POST':
+        seleccionadas = [int(x) for x in request.form.getlist('rutas')]
+        with get_connection() as conn:
+            cursor = conn.cursor()
             cursor.execute("DELETE FROM permisos_usuario WHERE usuario_id=%s", (usuario_id,))
             if seleccionadas:
                 args = [(usuario_id, rid) for rid in seleccionadas]
                 cursor.executemany("INSERT INTO permisos_usuario (usuario_id, ruta_id) VALUES (%s,%s)", args)
+            incrementar_versiones(cursor, 'permisos_usuario')
             conn.commit()
-            flash("Permisos directos del usuario actualizados.", "success")
-            return redirect(url_for('editar_permisos_usuario', usuario_id=usuario_id))
+        cache_permisos.invalidar()
+        flash("Permisos directos del usuario actualizados.", "success")
+        return redirect(url_for('editar_permisos_usuario', usuario_id=usuario_id))
+
+    usuario, rutas, actuales = consultas_en_paralelo(
+        ("SELECT id, nombres, apellidop, apellidom FROM persona WHERE id=%s", (usuario_id,), True),
+        ("SELECT * FROM rutas WHERE activo=1 ORDER BY nombre", None),
+        ("SELECT ruta_id FROM permisos_usuario WHERE usuario_id=%s", (usuario_id,)),
+    )
+    actuales = {r['ruta_id'] for r in actuales}
 
     return render_template('editar_permisos_usuario.html', usuario=usuario, rutas=rutas, actuales=actuales)
 
 
 # Helper: obtener permisos efectivos de un usuario (roles + permisos usuario)
 def obtener_permisos_efectivos(usuario_id):
+    return permisos_efectivos(usuario_id)
+
+
+# -----------------------
+# Estado del pool de conexiones
+# -----------------------
+@app.route('/db/pool')
+def db_pool():
+    return jsonify(estadisticas_pool())
+
+
+# -----------------------
+# Métricas (Prometheus). Cada worker expone las suyas.
+# -----------------------
+@app.route('/metrics')
+def metrics():
+    extras = (gauges('db_pool', estadisticas_pool(), 'Pool de conexiones MySQL')
+              + gauges('organigrama_cola', cola_render.estadisticas(), 'Cola de renders')
+              + gauges('organigrama_cache', cache_render.estadisticas(), 'Cache de renders'))
+    return app.response_class(exponer_metricas(extras), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/metrics/consultas')
+def metrics_consultas():
+    """Huellas de consulta ordenadas por tiempo acumulado, con su texto."""
+    return jsonify(totales_consultas.top(request.args.get('n', 50, type=int)))
+
+
+# -----------------------
+# Calentamiento (startup probe de Cloud Run)
+# -----------------------
+@app.route('/warmup')
+def warmup():
+    """
+    200 cuando el worker terminó de calentar. Con migraciones pendientes
+    (ver arranque.calentar) responde 503 siempre: la instancia no recibe
+    tráfico en vez de dar 500 en cada escritura.
+    """
+    calentar_en_segundo_plano()
+    listo = estado_arranque['terminado'] and 'esquema' not in estado_arranque['errores']
+    return jsonify(estado_arranque), (200 if listo else 503)
+
+
+# -----------------------
+# Esquema de la base (migraciones y versiones)
+# -----------------------
+@app.cli.command('migrar')
+@click.option('--verificar', is_flag=True, help='Sólo comparar los índices con los esperados, sin migrar.')
+def migrar_cli(verificar):
+    """Aplica las migraciones de esquema pendientes (índices compuestos)."""
+    if not verificar:
+        for version, descripcion in migrar():
+            click.echo(f"Aplicada {version}: {descripcion}")
+    problemas = verificar_indices()
+    for nombre, tabla, esperado, actual in problemas:
+        click.echo(f"{tabla}.{nombre}: esperado ({', '.join(esperado)}), "
+                   f"{'no existe' if actual is None else 'tiene (' + ', '.join(actual) + ')'}", err=True)
+    if problemas:
+        raise SystemExit(1)
+    click.echo("Índices al día.")
+
+
+@app.cli.command('incrementar-version')
+@click.argument('tablas', nargs=-1, required=True)
+def incrementar_version_cli(tablas):
+    """Sube el contador de tablas editadas fuera de la app (p. ej. puesto, departamento)."""
     with get_connection() as conn:
-        cursor = conn.cursor()
-        # Permisos via roles
-        cursor.execute("""
-            SELECT r.ruta
-            FROM permiso_rol pr
-            JOIN rutas r ON r.id = pr.ruta_id
-            JOIN usuario_roles ur ON ur.rol_id = pr.rol_id
-            WHERE ur.usuario_id = %s
-        """, (usuario_id,))
-        via_roles = {row['ruta'] for row in cursor.fetchall()}
-
-        # Permisos directos usuario (añadir)
-        cursor.execute("""
-            SELECT r.ruta
-            FROM permisos_usuario pu
-            JOIN rutas r ON r.id = pu.ruta_id
-            WHERE pu.usuario_id = %s
-        """, (usuario_id,))
-        directos = {row['ruta'] for row in cursor.fetchall()}
-
-    # union: roles + directos
-    return via_roles | directos
+        incrementar_versiones(conn.cursor(), *tablas)
+        conn.commit()
+    click.echo(f"Versiones incrementadas: {', '.join(sorted(set(tablas)))}")
+
+
+@app.cli.command('explain-check')
+@click.option('--estricto', is_flag=True, help='Reportar también catálogos chicos y planes sobre pocas filas.')
+def explain_check_cli(estricto):
+    """Corre EXPLAIN sobre las consultas del código y reporta recorridos completos y filesorts."""
+    reporte = explain_check(estricto=estricto)
+    for archivo, linea, motivo in reporte['omitidas']:
+        click.echo(f"{archivo}:{linea}  omitida: {motivo}")
+    for archivo, linea, problemas, sql in reporte['problemas']:
+        click.echo(f"{archivo}:{linea}  {'; '.join(problemas)}\n    {sql[:300]}", err=True)
+    click.echo(f"Revisadas: {reporte['revisadas']}  Omitidas: {len(reporte['omitidas'])}  "
+               f"Con problemas: {len(reporte['problemas'])}")
+    if reporte['problemas']:
+        raise SystemExit(1)
 
 
 # -----------------------
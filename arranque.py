@@ -0,0 +1,85 @@
+import os
+import time
+import threading
+import importlib
+
+from db import pool
+from jerarquia import obtener_jerarquia
+from catalogos import obtener_catalogos
+from migraciones import verificar_esquema
+from trabajos_render import cola_render
+
+# Librerías de gráficas: sólo las usan las rutas de organigrama, así que no se
+# importan al cargar app.py. Con el pool de render (RENDER_PROCESOS > 0) los
+# organigramas se dibujan en otros procesos y el worker nunca las necesita;
+# el calentamiento sólo las trae cuando el render es en el mismo proceso.
+MODULOS_GRAFICAS = (
+    'matplotlib',
+    'matplotlib.pyplot',
+    'networkx',
+    'networkx.drawing.nx_pydot',
+    'pydot',
+)
+
+# Conexiones que se abren por adelantado en el pool
+CONEXIONES_INICIALES = int(os.environ.get('WARMUP_CONEXIONES', 2))
+
+estado = {'iniciado': False, 'terminado': False, 'tiempos_ms': {}, 'errores': {}}
+_lock = threading.Lock()
+
+
+def precargar_graficas():
+    # El backend se fija antes de que cualquier import traiga pyplot
+    import matplotlib
+    matplotlib.use("Agg")
+    for modulo in MODULOS_GRAFICAS:
+        importlib.import_module(modulo)
+
+
+def _cebar_pool():
+    # Se sostienen todas a la vez para que el pool abra conexiones nuevas en
+    # vez de reciclar la misma; si una falla, las ya obtenidas se regresan
+    conexiones = []
+    try:
+        for _ in range(min(CONEXIONES_INICIALES, pool.size)):
+            conexiones.append(pool.obtener())
+    finally:
+        for conn in conexiones:
+            conn.close()
+
+
+def _medir(nombre, fn):
+    inicio = time.perf_counter()
+    try:
+        fn()
+    except Exception as e:
+        estado['errores'][nombre] = str(e)
+    estado['tiempos_ms'][nombre] = round((time.perf_counter() - inicio) * 1000, 1)
+
+
+def calentar(graficas=None):
+    """
+    Abre conexiones, construye caches y, si se van a usar aquí, precarga
+    librerías pesadas. Antes verifica que no falten migraciones: se hace aquí
+    (startup probe) y no al importar app.py, para no sumar un viaje a MySQL
+    al arranque de cada worker.
+    """
+    if graficas is None:
+        graficas = cola_render.procesos <= 0
+    _medir('esquema', verificar_esquema)
+    _medir('pool', _cebar_pool)
+    _medir('jerarquia', obtener_jerarquia)
+    _medir('catalogos', obtener_catalogos)
+    if graficas:
+        _medir('graficas', precargar_graficas)
+    estado['terminado'] = True
+    return estado
+
+
+def calentar_en_segundo_plano(graficas=None):
+    """Lanza calentar() en un hilo daemon, una sola vez por proceso."""
+    with _lock:
+        if estado['iniciado']:
+            return
+        estado['iniciado'] = True
+    threading.Thread(target=calentar, args=(graficas,), name='warmup', daemon=True).start()
@@ -0,0 +1,138 @@
+import os
+from datetime import date, datetime, time, timedelta
+from collections import defaultdict
+
+from versiones import version_de
+
+# Rango máximo (en días) que se puede consultar de una vez
+AUSENCIAS_MAX_DIAS = int(os.environ.get('AUSENCIAS_MAX_DIAS', 366))
+
+# La duración máxima de una ausencia acota por abajo el rango de fecha_inicio.
+# Se guarda con la versión de la tabla ausencia con la que se calculó (cada
+# alta o baja de ausencia sube el contador en su transacción) y sólo se usa
+# si es la misma versión que ve la consulta: una cota vieja dejaría fuera
+# ausencias largas registradas en otro worker.
+_duracion_max = (None, 0)
+
+
+def duracion_max(cursor):
+    """Días que dura la ausencia activa más larga, en el snapshot de `cursor`."""
+    global _duracion_max
+    version = version_de(cursor, ('ausencia',))
+    guardada, dias = _duracion_max
+    if guardada == version:
+        return dias
+    cursor.execute("""
+        SELECT COALESCE(MAX(DATEDIFF(fecha_fin, fecha_inicio)), 0) + 1 AS dias
+        FROM ausencia
+        WHERE activo = 1
+    """)
+    dias = int(cursor.fetchone()['dias'])
+    if guardada is None or version > guardada:
+        _duracion_max = (version, dias)
+    return dias
+
+
+# -----------------------
+# Consulta de traslape
+# -----------------------
+def ausencias_en_rango(cursor, persona_ids, desde, hasta):
+    """
+    Ausencias activas de `persona_ids` que se traslapan con los días
+    [desde, hasta]. Traslape: inicio <= fin del rango y fin >= inicio del
+    rango. Como ninguna ausencia dura más que la máxima registrada,
+    fecha_inicio también queda acotada por abajo y la búsqueda en el índice
+    es un rango cerrado aunque haya años de historial (índices de ausencia
+    en migraciones.INDICES).
+    """
+    if not persona_ids:
+        return []
+    inicio = datetime.combine(desde, time.min)
+    fin = datetime.combine(hasta + timedelta(days=1), time.min)
+    cota = inicio - timedelta(days=duracion_max(cursor))
+    cursor.execute("""
+        SELECT a.id, a.id_persona,
+               CONCAT(p.nombres, ' ', p.apellidop, ' ', p.apellidom) AS nombre,
+               p.numero_empleado,
+               a.id_razon, r.nombre AS razon, a.descripcion,
+               a.fecha_inicio, a.fecha_fin
+        FROM ausencia a
+        JOIN persona p ON p.id = a.id_persona
+        LEFT JOIN razon_ausencia r ON r.id = a.id_razon
+        WHERE a.activo = 1
+          AND a.id_persona IN %s
+          AND a.fecha_inicio < %s
+          AND a.fecha_inicio >= %s
+          AND a.fecha_fin >= %s
+        ORDER BY a.fecha_inicio, a.id
+    """, (tuple(persona_ids), fin, cota, inicio))
+    return cursor.fetchall()
+
+
+# -----------------------
+# Serie por día
+# -----------------------
+def _dia(valor):
+    return valor.date() if isinstance(valor, datetime) else valor
+
+
+def intervalos_por_persona(ausencias, desde, hasta):
+    """
+    {persona: [(dia_inicio, dia_fin)]} recortados a [desde, hasta] y
+    fusionados: dos ausencias que se enciman cuentan una sola vez.
+    """
+    por_persona = defaultdict(list)
+    for a in ausencias:
+        ini = max(_dia(a['fecha_inicio']), desde)
+        fin = min(_dia(a['fecha_fin']), hasta)
+        if ini <= fin:
+            por_persona[a['id_persona']].append((ini, fin))
+
+    fusionados = {}
+    for persona, intervalos in por_persona.items():
+        intervalos.sort()
+        resultado = [list(intervalos[0])]
+        for ini, fin in intervalos[1:]:
+            ultimo = resultado[-1]
+            if ini <= ultimo[1] + timedelta(days=1):
+                ultimo[1] = max(ultimo[1], fin)
+            else:
+                resultado.append([ini, fin])
+        fusionados[persona] = [tuple(i) for i in resultado]
+    return fusionados
+
+
+def serie_disponibles(ausencias, plantilla, desde, hasta):
+    """
+    [{'fecha', 'ausentes', 'disponibles'}] por cada día del rango. Barrido
+    con arreglo de diferencias sobre los intervalos fusionados: O(ausencias + días).
+    """
+    dias = (hasta - desde).days + 1
+    delta = [0] * (dias + 1)
+    for intervalos in intervalos_por_persona(ausencias, desde, hasta).values():
+        for ini, fin in intervalos:
+            delta[(ini - desde).days] += 1
+            delta[(fin - desde).days + 1] -= 1
+
+    serie = []
+    ausentes = 0
+    for i in range(dias):
+        ausentes += delta[i]
+        serie.append({
+            'fecha': (desde + timedelta(days=i)).isoformat(),
+            'ausentes': ausentes,
+            'disponibles': plantilla - ausentes,
+        })
+    return serie
+
+
+def leer_rango(args):
+    """(desde, hasta) de ?desde=YYYY-MM-DD&hasta=YYYY-MM-DD; por defecto hoy. ValueError si no es válido."""
+    hoy = date.today()
+    desde = date.fromisoformat(args['desde']) if args.get('desde') else hoy
+    hasta = date.fromisoformat(args['hasta']) if args.get('hasta') else desde
+    if hasta < desde:
+        raise ValueError("'hasta' no puede ser anterior a 'desde'")
+    if (hasta - desde).days + 1 > AUSENCIAS_MAX_DIAS:
+        raise ValueError(f"El rango no puede pasar de {AUSENCIAS_MAX_DIAS} días")
+    return desde, hasta
@@ -0,0 +1,72 @@
+"""
+Desglose del costo de importación de app.py (arranque en frío).
+
+Ejecuta `python -X importtime -c "import app"` en un proceso limpio, agrupa
+el tiempo acumulado por paquete de primer nivel y falla si el total supera
+el presupuesto.
+
+    python benchmarks/bench_arranque.py [--presupuesto-ms 1500] [--top 15]
+    python benchmarks/bench_arranque.py --modulo organigrama
+"""
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# import time:     self [us] | cumulative | imported package
+_LINEA = re.compile(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def medir_importacion(modulo):
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    env.pop('WARMUP', None)  # medir sólo el import, no el calentamiento
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {modulo}'],
+        cwd=RAIZ, env=env, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        ultimas = [l for l in proc.stderr.splitlines() if not l.startswith('import time:')]
+        raise SystemExit(f"No se pudo importar {modulo}:\n" + '\n'.join(ultimas[-10:]))
+
+    por_paquete = {}
+    total_us = 0
+    for linea in proc.stderr.splitlines():
+        m = _LINEA.match(linea)
+        if not m:
+            continue
+        propio, acumulado, sangria, nombre = int(m.group(1)), int(m.group(2)), m.group(3), m.group(4)
+        paquete = nombre.split('.')[0]
+        por_paquete[paquete] = por_paquete.get(paquete, 0) + propio
+        # Las líneas sin sangría extra son imports de primer nivel
+        if len(sangria) == 1:
+            total_us += acumulado
+    return total_us, por_paquete
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modulo', default='app')
+    parser.add_argument('--presupuesto-ms', type=float,
+                        default=float(os.environ.get('ARRANQUE_PRESUPUESTO_MS', 1500)))
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    total_us, por_paquete = medir_importacion(args.modulo)
+
+    print(f"{'paquete':<30} {'ms':>9} {'%':>6}")
+    for paquete, us in sorted(por_paquete.items(), key=lambda x: -x[1])[:args.top]:
+        print(f"{paquete:<30} {us / 1000:>9.1f} {us / total_us * 100 if total_us else 0:>6.1f}")
+    print(f"{'TOTAL import ' + args.modulo:<30} {total_us / 1000:>9.1f}")
+    print(f"{'presupuesto':<30} {args.presupuesto_ms:>9.1f}")
+
+    if total_us / 1000 > args.presupuesto_ms:
+        print("❌ El arranque en frío excede el presupuesto.")
+        sys.exit(1)
+    print("✅ Dentro del presupuesto.")
+
+
+if __name__ == '__main__':
+    main()
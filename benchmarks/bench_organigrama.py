@@ -0,0 +1,78 @@
+"""
+Compara el render del organigrama con matplotlib (PNG) contra el render SVG
+nativo sobre subárboles sintéticos de distintos tamaños.
+
+    python benchmarks/bench_organigrama.py [tamaños...]
+
+Ejemplo: python benchmarks/bench_organigrama.py 50 200 1000
+"""
+import os
+import sys
+import time
+import random
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from organigrama import preparar_grafica, generar_png, generar_svg  # noqa: E402
+
+# Mismos niveles que usa la app: 1 = Gestor (se agrupan en "N Gestores")
+PUESTOS = {
+    1: {'id': 1, 'nombre': 'Gestor 1-14', 'nivel': 1},
+    2: {'id': 2, 'nombre': 'Supervisor', 'nivel': 2},
+    3: {'id': 3, 'nombre': 'Coordinador', 'nivel': 3},
+    4: {'id': 4, 'nombre': 'Gerente', 'nivel': 4},
+    5: {'id': 5, 'nombre': 'Director', 'nivel': 5},
+}
+
+
+def subarbol_sintetico(total, semilla=7):
+    """Árbol de `total` personas: un director, mandos medios y gestores como hojas."""
+    rnd = random.Random(semilla)
+    personas = [{'id': 1, 'nombres': 'Persona', 'apellidop': 'Uno', 'id_puesto': 5, 'id_jefe': None}]
+    por_nivel = {5: [1]}
+    siguiente = 2
+    while siguiente <= total:
+        nivel = rnd.choice([4, 3, 2, 1, 1, 1, 1])
+        superiores = [j for n in range(nivel + 1, 6) for j in por_nivel.get(n, [])]
+        jefe = rnd.choice(superiores[-20:])
+        personas.append({'id': siguiente, 'nombres': f'Persona{siguiente}', 'apellidop': 'Sintetica',
+                         'id_puesto': nivel, 'id_jefe': jefe})
+        por_nivel.setdefault(nivel, []).append(siguiente)
+        siguiente += 1
+    return personas
+
+
+def medir(fn, *args):
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    datos = fn(*args)
+    dur = time.perf_counter() - inicio
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return dur, pico, len(datos or b'')
+
+
+def main(tamanos):
+    print(f"{'personas':>9} {'nodos':>6} | {'png s':>8} {'png MB':>8} {'png KB':>8} | "
+          f"{'svg s':>8} {'svg MB':>8} {'svg KB':>8}")
+    for total in tamanos:
+        nodos, aristas = preparar_grafica(subarbol_sintetico(total), PUESTOS)
+        try:
+            png = medir(generar_png, nodos, aristas)
+        except ImportError as e:
+            png = None
+            print(f"(render PNG no disponible: {e})")
+        svg = medir(generar_svg, nodos, aristas)
+
+        fila = f"{total:>9} {len(nodos):>6} | "
+        if png:
+            fila += f"{png[0]:>8.3f} {png[1] / 2**20:>8.1f} {png[2] / 1024:>8.1f} | "
+        else:
+            fila += f"{'-':>8} {'-':>8} {'-':>8} | "
+        fila += f"{svg[0]:>8.3f} {svg[1] / 2**20:>8.1f} {svg[2] / 1024:>8.1f}"
+        print(fila)
+
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or [100, 500, 2000, 10000])
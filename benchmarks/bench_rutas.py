@@ -0,0 +1,445 @@
+"""
+Benchmark de las rutas de jerarquía y listados sobre organizaciones sintéticas.
+
+Genera organizaciones de N personas con profundidad y abanico realistas
+(director → gerentes → coordinadores → supervisores → gestores), gestores
+con id_puesto == 1 como hojas, bajas, historial de jefes y de ausencias.
+Las carga en una base MySQL/MariaDB de pruebas y recorre cada ruta con el
+test client de Flask reportando p50/p95, consultas por petición y memoria
+pico.
+
+    python benchmarks/bench_rutas.py --tamanos 1000 10000 --repeticiones 20
+    python benchmarks/bench_rutas.py --solo-memoria --tamanos 100000 500000
+    python benchmarks/bench_rutas.py --json actual.json --comparar anterior.json
+
+La base se toma de BENCH_DB_HOST, BENCH_DB_PORT, BENCH_DB_USER,
+BENCH_DB_PASSWORD y BENCH_DB_NAME (por defecto catalogo_bench en localhost).
+Las tablas de esa base se vacían en cada tamaño. Con SUBARBOL_MODO=sql o
+SUBARBOL_MODO=cierre se miden las rutas con ese modo de subárbol.
+
+--solo-memoria no necesita MySQL: mide índice jerárquico, subárbol,
+preparación del organigrama y serie de ausencias con los mismos datos.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tracemalloc
+from collections import deque
+from datetime import date, datetime, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+DEPARTAMENTOS = ["Auditoría", "Call Center", "Campo 1-14", "Campo 15-21", "Sabuesos", "Cobranza"]
+
+# nivel -> (nombre, abanico mínimo, abanico máximo) de subordinados directos
+NIVELES = {
+    5: ("Director", None, None),      # el director recibe gerentes hasta llenar el departamento
+    4: ("Gerente", 3, 8),
+    3: ("Coordinador", 3, 7),
+    2: ("Supervisor", 6, 14),
+    1: ("Gestor", 0, 0),
+}
+# Probabilidad de que un supervisor tenga un supervisor intermedio (más profundidad)
+PROB_SUPERVISOR_INTERMEDIO = 0.1
+PROB_BAJA = 0.05
+PROB_JEFE_ANTERIOR = 0.2
+AUSENCIAS_POR_ANIO = 1.5
+ANIOS_HISTORIAL = 3
+RAZONES = ["Vacaciones", "Incapacidad", "Permiso", "Capacitación", "Maternidad"]
+
+BASE_PROHIBIDA = 'estado_cuenta'   # la base de producción nunca se usa para esto
+
+
+# -----------------------
+# Generador
+# -----------------------
+def org_sintetica(total, semilla=11):
+    """Regresa {tabla: [tuplas]} listo para cargar, más metadatos para elegir personas."""
+    rnd = random.Random(semilla)
+    hoy = date.today()
+
+    puestos = []            # (id, nombre, departamento_id, nivel, activo)
+    puesto_de = {}          # (dep, nivel) -> id
+    puestos.append((1, "Gestor 1-14", 3, 1, 1))
+    puesto_de[(3, 1)] = 1
+    siguiente_puesto = 2
+    for dep in range(1, len(DEPARTAMENTOS) + 1):
+        for nivel, (nombre, _, _) in sorted(NIVELES.items(), reverse=True):
+            if (dep, nivel) in puesto_de:
+                continue
+            puestos.append((siguiente_puesto, f"{nombre} {DEPARTAMENTOS[dep - 1]}", dep, nivel, 1))
+            puesto_de[(dep, nivel)] = siguiente_puesto
+            siguiente_puesto += 1
+
+    personas, asigna_puesto, asigna_jefe, bajas = [], [], [], []
+    jefe_de, nivel_de = {}, {}
+    siguiente = [1]
+
+    def nueva(dep, nivel, jefe):
+        pid = siguiente[0]
+        siguiente[0] += 1
+        baja = nivel < 5 and rnd.random() < PROB_BAJA
+        personas.append((pid, f"Nombre{pid}", f"Apellido{pid % 997}", f"Materno{pid % 313}",
+                         f"55{pid:08d}"[:10], None, str(100000 + pid), f"p{pid}@ejemplo.com",
+                         'Baja' if baja else 'Activo'))
+        asigna_puesto.append((pid, puesto_de[(dep, nivel)], 1))
+        if jefe:
+            inicio = hoy - timedelta(days=rnd.randint(30, 365 * ANIOS_HISTORIAL))
+            if rnd.random() < PROB_JEFE_ANTERIOR:
+                anterior_fin = inicio - timedelta(days=1)
+                asigna_jefe.append((pid, jefe, anterior_fin - timedelta(days=rnd.randint(30, 400)), anterior_fin))
+            asigna_jefe.append((pid, jefe, inicio, (hoy - timedelta(days=1)) if baja else None))
+        if baja:
+            bajas.append((pid, "Renuncia"))
+        jefe_de[pid] = jefe
+        nivel_de[pid] = nivel
+        return pid
+
+    # Tamaño de cada departamento: Campo y Call Center concentran la plantilla
+    pesos = [0.05, 0.25, 0.3, 0.25, 0.05, 0.1]
+    cupos = [max(5, int(total * p)) for p in pesos]
+    cupos[2] += total - sum(cupos)
+
+    raices = []
+    for dep, cupo in enumerate(cupos, start=1):
+        limite = siguiente[0] + cupo
+        director = nueva(dep, 5, None)
+        raices.append(director)
+        cola = deque()
+        while siguiente[0] < limite:
+            # El director recibe gerentes; cada gerente se llena a lo ancho
+            cola.append((nueva(dep, 4, director), 4))
+            while cola and siguiente[0] < limite:
+                jefe, nivel = cola.popleft()
+                _, minimo, maximo = NIVELES[nivel]
+                for _ in range(rnd.randint(minimo, maximo)):
+                    if siguiente[0] >= limite:
+                        break
+                    sub = nivel - 1
+                    if nivel == 2 and rnd.random() < PROB_SUPERVISOR_INTERMEDIO:
+                        sub = 2
+                    pid = nueva(dep, sub, jefe)
+                    if sub > 1:
+                        cola.append((pid, sub))
+
+    # Historial de ausencias
+    ausencias = []
+    dias_historial = 365 * ANIOS_HISTORIAL
+    for pid, *_ in personas:
+        for _ in range(int(rnd.expovariate(1 / (AUSENCIAS_POR_ANIO * ANIOS_HISTORIAL)))):
+            razon = rnd.randint(1, len(RAZONES))
+            dur = 90 if razon == 5 else rnd.choice([1, 1, 2, 3, 5, 10, 15])
+            inicio = datetime.combine(hoy - timedelta(days=rnd.randint(-30, dias_historial)), datetime.min.time())
+            ausencias.append((pid, razon, None, inicio + timedelta(hours=9),
+                              inicio + timedelta(days=dur - 1, hours=18), 'bench', 1))
+
+    return {
+        'departamento': [(i, n, 1) for i, n in enumerate(DEPARTAMENTOS, start=1)],
+        'puesto': puestos,
+        'persona': personas,
+        'asigna_puesto': asigna_puesto,
+        'asigna_jefe': asigna_jefe,
+        'baja_persona': bajas,
+        'razon_ausencia': [(i, f"R{i}", n, None, 1) for i, n in enumerate(RAZONES, start=1)],
+        'ausencia': ausencias,
+        '_meta': {'raices': raices, 'jefe_de': jefe_de, 'nivel_de': nivel_de},
+    }
+
+
+def personas_de_prueba(org):
+    """Director más grande, un gerente y un supervisor del mismo departamento."""
+    meta = org['_meta']
+    activos = {p[0] for p in org['persona'] if p[8] != 'Baja'}
+    hijos = {}
+    for pid, jefe in meta['jefe_de'].items():
+        if jefe and pid in activos:
+            hijos.setdefault(jefe, []).append(pid)
+    director = max(meta['raices'], key=lambda r: len(hijos.get(r, ())))
+    gerente = max(hijos.get(director, [director]), key=lambda g: len(hijos.get(g, ())))
+    coordinador = max(hijos.get(gerente, [gerente]), key=lambda c: len(hijos.get(c, ())))
+    supervisor = next((s for s in hijos.get(coordinador, ()) if meta['nivel_de'][s] == 2), coordinador)
+    return {'director': director, 'gerente': gerente, 'supervisor': supervisor}
+
+
+# -----------------------
+# Carga en MySQL
+# -----------------------
+ESQUEMA = [
+    """CREATE TABLE IF NOT EXISTS departamento (
+        id INT PRIMARY KEY, nombre VARCHAR(100), activo TINYINT DEFAULT 1)""",
+    """CREATE TABLE IF NOT EXISTS puesto (
+        id INT PRIMARY KEY, nombre VARCHAR(100), departamento_id INT, nivel INT, activo TINYINT DEFAULT 1)""",
+    """CREATE TABLE IF NOT EXISTS persona (
+        id INT PRIMARY KEY AUTO_INCREMENT, nombres VARCHAR(100) NOT NULL DEFAULT '',
+        apellidop VARCHAR(100) NOT NULL DEFAULT '', apellidom VARCHAR(100) NOT NULL DEFAULT '',
+        telefono_uno VARCHAR(20), telefono_dos VARCHAR(20), numero_empleado VARCHAR(20), correo VARCHAR(150),
+        estatus VARCHAR(20) DEFAULT 'Activo', user_name VARCHAR(100), password VARCHAR(255))""",
+    """CREATE TABLE IF NOT EXISTS asigna_puesto (
+        id INT PRIMARY KEY AUTO_INCREMENT, id_persona INT, id_puesto INT, activo TINYINT DEFAULT 1,
+        KEY (id_persona), KEY (id_puesto))""",
+    """CREATE TABLE IF NOT EXISTS asigna_jefe (
+        id INT PRIMARY KEY AUTO_INCREMENT, id_persona INT, id_jefe INT, fecha_inicio DATE, fecha_fin DATE,
+        KEY (id_persona), KEY (id_jefe))""",
+    """CREATE TABLE IF NOT EXISTS baja_persona (
+        id INT PRIMARY KEY AUTO_INCREMENT, id_persona INT, motivo VARCHAR(255), KEY (id_persona))""",
+    """CREATE TABLE IF NOT EXISTS razon_ausencia (
+        id INT PRIMARY KEY, clave VARCHAR(20), nombre VARCHAR(100), descripcion VARCHAR(255), activo TINYINT DEFAULT 1)""",
+    """CREATE TABLE IF NOT EXISTS ausencia (
+        id INT PRIMARY KEY AUTO_INCREMENT, id_persona INT, id_razon INT, descripcion VARCHAR(255),
+        fecha_inicio DATETIME, fecha_fin DATETIME, creado_por VARCHAR(50), activo TINYINT DEFAULT 1,
+        fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""",
+]
+
+COLUMNAS = {
+    'departamento': "(id, nombre, activo)",
+    'puesto': "(id, nombre, departamento_id, nivel, activo)",
+    'persona': "(id, nombres, apellidop, apellidom, telefono_uno, telefono_dos, numero_empleado, correo, estatus)",
+    'asigna_puesto': "(id_persona, id_puesto, activo)",
+    'asigna_jefe': "(id_persona, id_jefe, fecha_inicio, fecha_fin)",
+    'baja_persona': "(id_persona, motivo)",
+    'razon_ausencia': "(id, clave, nombre, descripcion, activo)",
+    'ausencia': "(id_persona, id_razon, descripcion, fecha_inicio, fecha_fin, creado_por, activo)",
+}
+
+
+def config_bench():
+    import pymysql
+    nombre = os.environ.get('BENCH_DB_NAME', 'catalogo_bench')
+    if nombre == BASE_PROHIBIDA:
+        raise SystemExit("BENCH_DB_NAME apunta a la base de producción; usa una base de pruebas.")
+    return {
+        'host': os.environ.get('BENCH_DB_HOST', '127.0.0.1'),
+        'port': int(os.environ.get('BENCH_DB_PORT', 3306)),
+        'user': os.environ.get('BENCH_DB_USER', 'root'),
+        'password': os.environ.get('BENCH_DB_PASSWORD', ''),
+        'database': nombre,
+        'cursorclass': pymysql.cursors.DictCursor,
+    }
+
+
+def cargar_mysql(config, org, lote=5000):
+    import pymysql
+    inicio = time.perf_counter()
+    conn = pymysql.connect(**config)
+    try:
+        cursor = conn.cursor()
+        for ddl in ESQUEMA:
+            cursor.execute(ddl)
+        for tabla, columnas in COLUMNAS.items():
+            cursor.execute(f"TRUNCATE TABLE {tabla}")
+            filas = org[tabla]
+            marcas = ', '.join(['%s'] * len(filas[0])) if filas else ''
+            for i in range(0, len(filas), lote):
+                cursor.executemany(f"INSERT INTO {tabla} {columnas} VALUES ({marcas})", filas[i:i + lote])
+            conn.commit()
+        from jerarquia import TABLA_CIERRE, reconstruir_cierre
+        from migraciones import INDICES, crear_indice
+        from versiones import TABLA_VERSIONES
+        cursor.execute(TABLA_CIERRE)
+        cursor.execute(TABLA_VERSIONES)
+        for nombre in INDICES:
+            crear_indice(cursor, nombre)
+        conn.commit()
+        reconstruir_cierre(conn)
+    finally:
+        conn.close()
+    return time.perf_counter() - inicio
+
+
+# -----------------------
+# Medición
+# -----------------------
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    if not ordenados:
+        return 0.0
+    k = (len(ordenados) - 1) * p
+    f = int(k)
+    c = min(f + 1, len(ordenados) - 1)
+    return ordenados[f] + (ordenados[c] - ordenados[f]) * (k - f)
+
+
+def _consultas_totales():
+    from metricas import totales_consultas
+    return sum(t['consultas'] for t in totales_consultas.top(10 ** 9))
+
+
+def medir_llamada(fn, repeticiones):
+    """Primera llamada (fría), p50/p95 de las siguientes, consultas por llamada y memoria pico."""
+    antes = _consultas_totales() if 'metricas' in sys.modules else 0
+    inicio = time.perf_counter()
+    fn()
+    frio = time.perf_counter() - inicio
+    consultas_frio = (_consultas_totales() - antes) if 'metricas' in sys.modules else 0
+
+    tiempos = []
+    antes = _consultas_totales() if 'metricas' in sys.modules else 0
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        fn()
+        tiempos.append(time.perf_counter() - inicio)
+    consultas = ((_consultas_totales() - antes) / repeticiones) if 'metricas' in sys.modules and repeticiones else 0
+
+    tracemalloc.start()
+    fn()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'frio_ms': round(frio * 1000, 2),
+        'p50_ms': round(percentil(tiempos, 0.5) * 1000, 2),
+        'p95_ms': round(percentil(tiempos, 0.95) * 1000, 2),
+        'consultas_frio': consultas_frio,
+        'consultas': round(consultas, 1),
+        'pico_mb': round(pico / 2 ** 20, 2),
+    }
+
+
+def rutas_a_medir(personas, hoy):
+    d, g, s = personas['director'], personas['gerente'], personas['supervisor']
+    desde = (hoy - timedelta(days=30)).isoformat()
+    return [
+        ('index', '/'),
+        ('personas_datatable', '/personas/datatable?draw=1&start=0&length=50'),
+        ('plantilla', '/nivel_jerarquico/plantilla'),
+        ('colaborador svg (supervisor)', f'/nivel_jerarquico/colaborador/{s}?format=svg'),
+        ('colaborador svg (gerente)', f'/nivel_jerarquico/colaborador/{g}?format=svg'),
+        ('colaborador png (supervisor)', f'/nivel_jerarquico/colaborador/{s}'),
+        ('grafo json (gerente)', f'/nivel_jerarquico/grafo/{g}'),
+        ('colaborador_tabla (gerente)', f'/nivel_jerarquico/colaborador_tabla/{g}'),
+        ('colaborador_tabla (director)', f'/nivel_jerarquico/colaborador_tabla/{d}'),
+        ('colaborador_tabla columnas (director)', f'/nivel_jerarquico/colaborador_tabla/{d}?formato=columnas'),
+        ('colaborador_tabla columnas gzip (director)', f'/nivel_jerarquico/colaborador_tabla/{d}?formato=columnas',
+         {'Accept-Encoding': 'gzip'}),
+        ('ausencias 30 días (director)', f'/ausencia/subarbol/{d}?desde={desde}&hasta={hoy.isoformat()}'),
+        ('editar_persona GET', f'/editar_persona/{s}'),
+        ('editar_persona_arbol GET', f'/editar_persona_arbol/{s}'),
+    ]
+
+
+def bench_rutas(org, repeticiones):
+    # El render se hace dentro de la petición para que cuente en la latencia
+    os.environ.setdefault('RENDER_PROCESOS', '0')
+    os.environ.pop('WARMUP', None)
+    os.environ.pop('ORGANIGRAMA_PRECALENTAR', None)
+
+    import db
+    db.config.update(config_bench())
+    db.pool.cerrar_todo()
+    import app as aplicacion
+    from jerarquia import invalidar_jerarquia
+    from catalogos import invalidar_catalogos
+    from plantilla import invalidar_plantilla
+    invalidar_jerarquia()
+    invalidar_catalogos()
+    invalidar_plantilla()
+
+    cliente = aplicacion.app.test_client()
+    resultados = {}
+    for nombre, url, *cabeceras in rutas_a_medir(personas_de_prueba(org), date.today()):
+        tamanos = []
+
+        def llamar(url=url, cabeceras=cabeceras[0] if cabeceras else None):
+            resp = cliente.get(url, headers=cabeceras)
+            if resp.status_code >= 400:
+                raise RuntimeError(f"{url} respondió {resp.status_code}")
+            tamanos.append(len(resp.get_data()))
+        resultados[nombre] = medir_llamada(llamar, repeticiones)
+        # Bytes que viajan (ya comprimidos si la ruta lo negoció)
+        resultados[nombre]['kb'] = round(tamanos[-1] / 1024, 1)
+    return resultados
+
+
+def bench_memoria(org, repeticiones):
+    """Mismas operaciones que las rutas, sin base de datos."""
+    from jerarquia import IndiceJerarquia, filas_cierre
+    from organigrama import preparar_grafica, generar_svg
+    from ausencias import serie_disponibles
+
+    activos = {p[0]: p for p in org['persona'] if p[8] != 'Baja'}
+    puesto_de = {ap[0]: ap[1] for ap in org['asigna_puesto']}
+    jefe_vigente = {aj[0]: aj[1] for aj in org['asigna_jefe'] if aj[3] is None}
+    filas = [{'id': pid, 'id_puesto': puesto_de[pid], 'id_jefe': jefe_vigente.get(pid)} for pid in activos]
+    puesto_map = {p[0]: {'id': p[0], 'nombre': p[1], 'nivel': p[3]} for p in org['puesto']}
+    personas = personas_de_prueba(org)
+    indice = IndiceJerarquia(filas)
+
+    def subarbol_personas(raiz):
+        return [{'id': i, 'nombres': activos[i][1], 'apellidop': activos[i][2],
+                 'id_puesto': puesto_de[i], 'id_jefe': jefe_vigente.get(i)} for i in indice.subarbol(raiz)]
+
+    hoy = date.today()
+    sub_director = set(indice.subarbol(personas['director']))
+    ausencias = [{'id_persona': a[0], 'fecha_inicio': a[3], 'fecha_fin': a[4]} for a in org['ausencia']
+                 if a[0] in sub_director and a[4].date() >= hoy - timedelta(days=30) and a[3].date() <= hoy]
+    sup = subarbol_personas(personas['supervisor'])
+    ger = subarbol_personas(personas['gerente'])
+
+    return {
+        'índice jerárquico': medir_llamada(lambda: IndiceJerarquia(filas), max(1, repeticiones // 5)),
+        'subárbol director': medir_llamada(lambda: indice.subarbol(personas['director']), repeticiones),
+        'filas de cierre': medir_llamada(lambda: sum(1 for _ in filas_cierre(indice)), max(1, repeticiones // 5)),
+        'preparar_grafica gerente': medir_llamada(lambda: preparar_grafica(ger, puesto_map), repeticiones),
+        'svg supervisor': medir_llamada(lambda: generar_svg(*preparar_grafica(sup, puesto_map)), repeticiones),
+        'serie ausencias 30 días': medir_llamada(
+            lambda: serie_disponibles(ausencias, len(sub_director), hoy - timedelta(days=30), hoy), repeticiones),
+    }
+
+
+# -----------------------
+# Reporte
+# -----------------------
+def imprimir(tamano, resultados, anterior=None):
+    print(f"\n== {tamano:,} personas ==")
+    print(f"{'operación':<44} {'frío ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'consultas':>9} {'pico MB':>8} {'KB':>8}"
+          + (f" {'Δ p95':>8}" if anterior else ''))
+    for nombre, r in resultados.items():
+        fila = (f"{nombre:<44} {r['frio_ms']:>9.1f} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} "
+                f"{r['consultas']:>9} {r['pico_mb']:>8.1f} {r.get('kb', ''):>8}")
+        previo = (anterior or {}).get(nombre)
+        if previo and previo['p95_ms']:
+            fila += f" {(r['p95_ms'] / previo['p95_ms'] - 1) * 100:>+7.0f}%"
+        print(fila)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tamanos', type=int, nargs='+', default=[1000, 10000, 100000, 500000])
+    parser.add_argument('--repeticiones', type=int, default=20)
+    parser.add_argument('--solo-memoria', action='store_true')
+    parser.add_argument('--semilla', type=int, default=11)
+    parser.add_argument('--json', help='Guardar resultados en este archivo')
+    parser.add_argument('--comparar', help='Resultados JSON de otra versión para mostrar la diferencia de p95')
+    args = parser.parse_args()
+
+    anterior = {}
+    if args.comparar:
+        with open(args.comparar) as f:
+            anterior = json.load(f)
+
+    salida = {}
+    for tamano in args.tamanos:
+        inicio = time.perf_counter()
+        org = org_sintetica(tamano, args.semilla)
+        print(f"\nOrganización de {tamano:,}: {len(org['persona']):,} personas, {len(org['asigna_jefe']):,} "
+              f"relaciones, {len(org['ausencia']):,} ausencias ({time.perf_counter() - inicio:.1f} s)")
+        if args.solo_memoria:
+            resultados = bench_memoria(org, args.repeticiones)
+        else:
+            print(f"Carga en MySQL: {cargar_mysql(config_bench(), org):.1f} s")
+            resultados = bench_rutas(org, args.repeticiones)
+        imprimir(tamano, resultados, anterior.get(str(tamano)))
+        salida[str(tamano)] = resultados
+
+    print(f"\nMemoria máxima del proceso: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(salida, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
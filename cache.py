@@ -0,0 +1,38 @@
+import time
+import threading
+
+
+class CacheTTL:
+    """
+    Valor calculado por `cargar()` y reutilizado hasta que expira o se
+    invalida. Una sola recarga a la vez; los demás hilos esperan el resultado.
+    """
+
+    def __init__(self, cargar, ttl):
+        self.cargar = cargar
+        self.ttl = ttl
+        self._valor = None
+        self._cargado = 0.0
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def _vigente(self):
+        return self._valor is not None and time.monotonic() - self._cargado < self.ttl
+
+    def obtener(self):
+        if self._vigente():
+            return self._valor
+        with self._lock:
+            if not self._vigente():
+                version = self._version
+                valor = self.cargar()
+                # Si se invalidó mientras cargábamos, no guardar datos viejos
+                if version == self._version:
+                    self._valor = valor
+                    self._cargado = time.monotonic()
+                return valor
+            return self._valor
+
+    def invalidar(self):
+        self._version += 1
+        self._valor = None
@@ -0,0 +1,56 @@
+import os
+
+from db import consultas_en_paralelo
+from cache import CacheTTL
+from versiones import TABLAS_CATALOGOS, version_vigente
+
+# Los catálogos casi no cambian. Cada lectura compara la copia con la
+# versión de TABLAS_CATALOGOS, así que una escritura en otro worker se ve en
+# cuanto se refrescan los contadores; el TTL sólo acota el uso de memoria.
+CATALOGOS_TTL = int(os.environ.get('CATALOGOS_TTL', 300))
+
+
+def _cargar_catalogos():
+    # La versión se lee antes que los datos: si algo cambia en medio, la
+    # copia queda marcada como anterior y la siguiente lectura la recarga
+    version = version_vigente(TABLAS_CATALOGOS)
+    # Las tres lecturas son independientes: cada una en su conexión, al mismo tiempo
+    departamentos, puestos, jefes = consultas_en_paralelo(
+        # Departamentos activos
+        ("SELECT id, nombre FROM departamento WHERE activo=1 ORDER BY nombre", None),
+        # Puestos activos con depto y nivel
+        ("SELECT id, nombre, departamento_id, nivel FROM puesto WHERE activo=1 ORDER BY nivel", None),
+        # Todos los jefes posibles con depto y nivel
+        ("""
+            SELECT p.id, p.nombres, p.apellidop, p.apellidom, pu.departamento_id, pu.nivel
+            FROM persona p
+            INNER JOIN asigna_puesto ap ON ap.id_persona = p.id AND ap.activo=1
+            INNER JOIN puesto pu ON pu.id = ap.id_puesto
+            ORDER BY pu.nivel ASC, p.apellidop, p.apellidom
+        """, None),
+    )
+
+    return {'departamentos': departamentos, 'puestos': puestos, 'jefes': jefes, 'version': version}
+
+
+_catalogos = CacheTTL(_cargar_catalogos, CATALOGOS_TTL)
+
+
+def obtener_catalogos(excluir_persona=None):
+    """
+    Regresa (departamentos, puestos, jefes). Las listas son compartidas entre
+    peticiones: no modificarlas. `excluir_persona` quita a esa persona de la
+    lista de jefes posibles (no puede ser su propio jefe).
+    """
+    c = _catalogos.obtener()
+    if c['version'] < version_vigente(TABLAS_CATALOGOS):
+        _catalogos.invalidar()
+        c = _catalogos.obtener()
+    jefes = c['jefes']
+    if excluir_persona is not None:
+        jefes = [j for j in jefes if j['id'] != excluir_persona]
+    return c['departamentos'], c['puestos'], jefes
+
+
+def invalidar_catalogos():
+    _catalogos.invalidar()
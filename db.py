@@ -1,6 +1,12 @@
 import os
+import time
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 import pymysql
 
+from metricas import CursorMedido, contexto_tarea, sumar_parcial
+
 config = {
     'host': '34.9.147.5',
     'user': 'jonathan',
@@ -10,5 +16,286 @@ config = {
     'cursorclass': pymysql.cursors.DictCursor
 }
 
+# -----------------------
+# Configuración del pool
+# -----------------------
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+POOL_MAX_OVERFLOW = int(os.environ.get('DB_POOL_MAX_OVERFLOW', 10))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))     # segundos de vida máxima
+POOL_PING_IDLE = int(os.environ.get('DB_POOL_PING_IDLE', 30))   # ping si estuvo ociosa más de esto
+
+# Hilos para lecturas independientes en paralelo (en_paralelo); 1 = en serie
+PARALELO_HILOS = int(os.environ.get('DB_PARALELO_HILOS', 4))
+
+
+class PoolAgotado(Exception):
+    pass
+
+
+class _ConexionPool:
+    """
+    Envoltura de una conexión pymysql que, al cerrarse (o al salir del
+    `with`), regresa la conexión al pool en lugar de cerrar el socket.
+    """
+
+    def __init__(self, pool, raw, creada):
+        self._pool = pool
+        self._raw = raw
+        self._creada = creada
+        self._cerrada = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def cursor(self, *args, **kwargs):
+        # Cada consulta queda medida (latencia, filas, huella) en metricas.py
+        return CursorMedido(self._raw.cursor(*args, **kwargs))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        if self._cerrada:
+            return
+        self._cerrada = True
+        self._pool._devolver(self._raw, self._creada)
+
+
+class PoolConexiones:
+    def __init__(self, params, size=POOL_SIZE, max_overflow=POOL_MAX_OVERFLOW,
+                 timeout=POOL_TIMEOUT, recycle=POOL_RECYCLE, ping_idle=POOL_PING_IDLE):
+        self.params = params
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_idle = ping_idle
+
+        self._libres = []          # [(raw, creada, devuelta)]
+        self._abiertas = 0         # conexiones vivas (libres + en uso)
+        self._en_uso = 0
+        self._cond = threading.Condition()
+
+        self._checkouts = 0
+        self._esperas = 0
+        self._espera_total = 0.0
+        self._espera_max = 0.0
+        self._recicladas = 0
+        self._descartadas = 0
+
+    # -----------------------
+    # Crear / validar
+    # -----------------------
+    def _crear(self):
+        return pymysql.connect(**self.params), time.monotonic()
+
+    def _cerrar_raw(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _valida(self, raw, creada, devuelta):
+        ahora = time.monotonic()
+        if self.recycle and ahora - creada > self.recycle:
+            self._recicladas += 1
+            return False
+        if ahora - devuelta > self.ping_idle:
+            try:
+                raw.ping(reconnect=False)
+            except Exception:
+                self._descartadas += 1
+                return False
+        return True
+
+    # -----------------------
+    # Checkout / checkin
+    # -----------------------
+    def obtener(self):
+        inicio = time.monotonic()
+        limite = inicio + self.timeout if self.timeout else None
+        esperado = False
+
+        while True:
+            with self._cond:
+                while not self._libres and self._abiertas >= self.size + self.max_overflow:
+                    esperado = True
+                    restante = None if limite is None else limite - time.monotonic()
+                    if restante is not None and restante <= 0:
+                        raise PoolAgotado(
+                            f"Sin conexiones disponibles tras {self.timeout}s "
+                            f"(size={self.size}, overflow={self.max_overflow})"
+                        )
+                    self._cond.wait(restante)
+
+                if self._libres:
+                    raw, creada, devuelta = self._libres.pop()
+                    crear = False
+                else:
+                    raw = creada = devuelta = None
+                    crear = True
+                # Reservar el lugar antes de soltar el lock
+                self._en_uso += 1
+                if crear:
+                    self._abiertas += 1
+
+            # Validar o crear fuera del lock: ping y connect son I/O de red
+            try:
+                if not crear and not self._valida(raw, creada, devuelta):
+                    self._cerrar_raw(raw)
+                    crear = True
+                if crear:
+                    raw, creada = self._crear()
+            except Exception:
+                with self._cond:
+                    self._en_uso -= 1
+                    self._abiertas -= 1
+                    self._cond.notify()
+                raise
+
+            espera = time.monotonic() - inicio
+            with self._cond:
+                self._checkouts += 1
+                if esperado:
+                    self._esperas += 1
+                self._espera_total += espera
+                self._espera_max = max(self._espera_max, espera)
+            return _ConexionPool(self, raw, creada)
+
+    def _devolver(self, raw, creada):
+        # Terminar cualquier transacción abierta para no arrastrar estado ni snapshots
+        descartar = False
+        try:
+            raw.rollback()
+        except Exception:
+            descartar = True
+
+        with self._cond:
+            self._en_uso -= 1
+            if descartar or raw.open is False or len(self._libres) >= self.size:
+                self._abiertas -= 1
+                cerrar = True
+            else:
+                self._libres.append((raw, creada, time.monotonic()))
+                cerrar = False
+            self._cond.notify()
+
+        if cerrar:
+            self._cerrar_raw(raw)
+
+    def cerrar_todo(self):
+        with self._cond:
+            libres, self._libres = self._libres, []
+            self._abiertas -= len(libres)
+        for raw, _, _ in libres:
+            self._cerrar_raw(raw)
+
+    def estadisticas(self):
+        with self._cond:
+            return {
+                'size': self.size,
+                'max_overflow': self.max_overflow,
+                'abiertas': self._abiertas,
+                'en_uso': self._en_uso,
+                'libres': len(self._libres),
+                'checkouts': self._checkouts,
+                'esperas': self._esperas,
+                'espera_total_s': round(self._espera_total, 4),
+                'espera_promedio_ms': round(self._espera_total / self._checkouts * 1000, 3) if self._checkouts else 0.0,
+                'espera_max_ms': round(self._espera_max * 1000, 3),
+                'recicladas': self._recicladas,
+                'descartadas': self._descartadas,
+            }
+
+
+pool = PoolConexiones(config)
+
+
 def get_connection():
-    return pymysql.connect(**config)
+    return pool.obtener()
+
+
+def estadisticas_pool():
+    return pool.estadisticas()
+
+
+# -----------------------
+# Lecturas independientes en paralelo
+# -----------------------
+_ejecutor = None
+_ejecutor_lock = threading.Lock()
+_hilo = threading.local()
+
+
+def _ejecutor_paralelo():
+    global _ejecutor
+    if _ejecutor is None:
+        with _ejecutor_lock:
+            if _ejecutor is None:
+                _ejecutor = ThreadPoolExecutor(PARALELO_HILOS, thread_name_prefix='db-paralelo')
+    return _ejecutor
+
+
+def _en_hilo_paralelo(tarea):
+    _hilo.en_paralelo = True
+    try:
+        return tarea()
+    finally:
+        _hilo.en_paralelo = False
+
+
+def en_paralelo(*tareas):
+    """
+    Ejecuta funciones independientes al mismo tiempo y regresa sus resultados
+    en el mismo orden. Cada tarea debe tomar su propia conexión del pool; la
+    latencia total se acerca a la de la tarea más lenta en vez de la suma.
+
+    La última tarea corre en el hilo que llama (puede a su vez usar
+    en_paralelo); dentro de los hilos auxiliares todo corre en serie para no
+    agotar el ejecutor esperándose a sí mismo. Si alguna falla, la excepción
+    se lanza después de que terminan las demás.
+    """
+    if len(tareas) <= 1 or PARALELO_HILOS <= 1 or getattr(_hilo, 'en_paralelo', False):
+        return [t() for t in tareas]
+    ejecutor = _ejecutor_paralelo()
+    # Cada tarea con su copia del contexto y su propio acumulador de métricas;
+    # se suman a los de la petición en este hilo, ya terminada la tarea
+    futuros = []
+    for t in tareas[:-1]:
+        contexto, parcial = contexto_tarea()
+        futuros.append((ejecutor.submit(contexto.run, _en_hilo_paralelo, t), parcial))
+    try:
+        ultimo = tareas[-1]()
+    finally:
+        resultados = []
+        error = None
+        for f, parcial in futuros:
+            try:
+                resultados.append(f.result())
+            except Exception as e:
+                error = error or e
+                resultados.append(None)
+            sumar_parcial(parcial)
+    if error is not None:
+        raise error
+    return resultados + [ultimo]
+
+
+def consultar(sql, params=None, uno=False):
+    """Una consulta en su propia conexión del pool; fetchone si uno=True."""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        return cursor.fetchone() if uno else cursor.fetchall()
+
+
+def consultas_en_paralelo(*consultas):
+    """
+    Varias lecturas independientes a la vez. Cada consulta es
+    (sql, params) o (sql, params, True) para traer una sola fila.
+    """
+    return en_paralelo(*[partial(consultar, *c) for c in consultas])
@@ -0,0 +1,138 @@
+import os
+import re
+import hashlib
+import tempfile
+from contextlib import contextmanager
+
+# Tamaño máximo de un documento; se corta la lectura del cuerpo en cuanto se rebasa
+DOCUMENTO_MAX_BYTES = int(os.environ.get('DOCUMENTO_MAX_MB', 10)) * 1024 * 1024
+
+# Segundos que se espera el candado de un archivo antes de rendirse
+DOCUMENTO_LOCK_TIMEOUT = 10
+
+# Con nginx delante: prefijo de la location `internal` que apunta a la carpeta
+# de uploads (p. ej. /_uploads/). Si está vacío los bytes los manda el worker.
+DOCUMENTOS_ACCEL_PREFIX = os.environ.get('DOCUMENTOS_ACCEL_PREFIX', '')
+
+_NOMBRE_HASH_RE = re.compile(r'^([0-9a-f]{64})\.[a-z0-9]+$')
+
+
+class DocumentoDemasiadoGrande(Exception):
+    pass
+
+
+class ArchivoSubida:
+    """
+    Temporal dentro de `carpeta` que calcula sha256 y cuenta bytes en cada
+    write(). Lo llena directamente el parser multipart de Werkzeug, así que
+    el hash y el límite de tamaño se aplican conforme se lee el cuerpo.
+    """
+
+    def __init__(self, carpeta, max_bytes=DOCUMENTO_MAX_BYTES):
+        fd, self.ruta = tempfile.mkstemp(dir=carpeta, prefix='.subida-')
+        self._archivo = os.fdopen(fd, 'w+b')
+        self._digest = hashlib.sha256()
+        self.max_bytes = max_bytes
+        self.bytes = 0
+
+    def write(self, datos):
+        self.bytes += len(datos)
+        if self.bytes > self.max_bytes:
+            # Corta el parseo: el resto del cuerpo ya no se escribe
+            raise DocumentoDemasiadoGrande(
+                f"El archivo supera el máximo de {self.max_bytes // (1024 * 1024)} MB"
+            )
+        self._digest.update(datos)
+        return self._archivo.write(datos)
+
+    def sha256(self):
+        return self._digest.hexdigest()
+
+    def __getattr__(self, nombre):
+        # seek, read, close, etc. del archivo real (FileStorage los usa)
+        return getattr(self._archivo, nombre)
+
+
+class SubidaDocumentos:
+    """
+    stream_factory para werkzeug.formparser.parse_form_data: cada parte con
+    archivo va a su ArchivoSubida. limpiar() borra los temporales que no se
+    colocaron (error, parte sobrante o archivo rechazado).
+    """
+
+    def __init__(self, carpeta, max_bytes=DOCUMENTO_MAX_BYTES):
+        self.carpeta = carpeta
+        self.max_bytes = max_bytes
+        self.archivos = []
+
+    def __call__(self, total_content_length=None, content_type=None, filename=None, content_length=None):
+        archivo = ArchivoSubida(self.carpeta, self.max_bytes)
+        self.archivos.append(archivo)
+        return archivo
+
+    def limpiar(self):
+        for archivo in self.archivos:
+            archivo.close()
+            try:
+                os.remove(archivo.ruta)
+            except OSError:
+                pass
+
+
+def nombre_contenido(sha256_hex, ext):
+    """Nombre del archivo según su contenido: el mismo archivo siempre cae en el mismo nombre."""
+    return f"{sha256_hex}.{ext}"
+
+
+def etag_documento(nombre):
+    """
+    ETag fuerte de un archivo guardado por contenido (su sha256). Los archivos
+    anteriores al almacenamiento por hash no tienen uno y regresan None.
+    """
+    m = _NOMBRE_HASH_RE.match(nombre)
+    return m.group(1) if m else None
+
+
+def colocar_archivo(tmp, carpeta, nombre):
+    """Mueve el temporal a su nombre definitivo; si ya existe (duplicado) sólo se descarta."""
+    destino = os.path.join(carpeta, nombre)
+    if os.path.exists(destino):
+        os.remove(tmp)
+    else:
+        os.replace(tmp, destino)
+    return destino
+
+
+@contextmanager
+def candado_archivo(cursor, nombre, timeout=DOCUMENTO_LOCK_TIMEOUT):
+    """
+    Candado con nombre de MySQL por archivo. Serializa "insertar referencia +
+    colocar archivo" contra "borrar referencia + contar + borrar archivo",
+    también entre workers, para que un duplicado recién subido no pierda
+    su archivo porque otra petición borró la última referencia anterior.
+    """
+    clave = 'doc:' + nombre[:60]
+    cursor.execute("SELECT GET_LOCK(%s, %s) AS ok", (clave, timeout))
+    if not cursor.fetchone()['ok']:
+        raise TimeoutError(f"No se obtuvo el candado del archivo {nombre}")
+    try:
+        yield
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (clave,))
+        cursor.fetchall()
+
+
+def referencias(cursor, nombre):
+    """Cuántas filas de carga_documento_persona apuntan al archivo."""
+    cursor.execute("SELECT COUNT(*) AS n FROM carga_documento_persona WHERE archivo=%s", (nombre,))
+    return cursor.fetchone()['n']
+
+
+def borrar_si_huerfano(cursor, carpeta, nombre):
+    """Borra el archivo físico sólo si ya no lo referencia ninguna fila."""
+    if referencias(cursor, nombre):
+        return False
+    ruta = os.path.join(carpeta, nombre)
+    if os.path.exists(ruta):
+        os.remove(ruta)
+    return True
@@ -0,0 +1,110 @@
+import io
+import os
+import csv
+import tempfile
+
+import pymysql
+from flask import Response, request
+from werkzeug.wsgi import wrap_file
+
+from db import get_connection
+
+# Filas que se juntan antes de mandar un pedazo del CSV al cliente
+EXPORTAR_FILAS_POR_ENVIO = int(os.environ.get('EXPORTAR_FILAS_POR_ENVIO', 500))
+EXPORTAR_BLOQUE_BYTES = 64 * 1024
+
+FORMATOS_EXPORTACION = ('csv', 'xlsx')
+
+
+def filas_sin_buffer(sql, params=None):
+    """
+    Genera las filas de la consulta conforme llegan de MySQL (cursor del lado
+    del servidor), sin cargar el resultado completo en memoria. La conexión
+    se ocupa mientras el generador esté vivo y se devuelve al pool al terminar
+    o si el cliente corta la descarga.
+    """
+    conn = get_connection()
+    cursor = None
+    try:
+        cursor = conn.cursor(pymysql.cursors.SSDictCursor)
+        cursor.execute(sql, params)
+        while True:
+            fila = cursor.fetchone()
+            if fila is None:
+                break
+            yield fila
+    finally:
+        if cursor is not None:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        conn.close()
+
+
+def _csv_stream(filas, columnas):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM para que Excel abra el CSV como UTF-8 (acentos)
+    buffer.write('\ufeff')
+    writer.writerow([titulo for titulo, _ in columnas])
+    pendientes = 0
+    for fila in filas:
+        writer.writerow([valor(fila) for _, valor in columnas])
+        pendientes += 1
+        if pendientes >= EXPORTAR_FILAS_POR_ENVIO:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            pendientes = 0
+    yield buffer.getvalue().encode('utf-8')
+
+
+def _xlsx_archivo(filas, columnas):
+    """
+    Escribe el XLSX en modo write_only (memoria constante) a un archivo
+    temporal y lo regresa abierto y ya borrado del disco: el espacio se libera
+    al cerrar el archivo, aunque el cuerpo de la respuesta nunca se lea.
+    """
+    from openpyxl import Workbook
+
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet('Datos')
+    hoja.append([titulo for titulo, _ in columnas])
+    for fila in filas:
+        hoja.append([valor(fila) for _, valor in columnas])
+
+    tmp = tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False)
+    tmp.close()
+    try:
+        libro.save(tmp.name)
+        return open(tmp.name, 'rb')
+    finally:
+        os.remove(tmp.name)
+
+
+def respuesta_exportacion(filas, columnas, nombre, formato):
+    """
+    columnas: [(encabezado, funcion(fila) -> valor)]
+
+    CSV se manda por pedazos mientras se leen las filas: el primer byte sale
+    en cuanto llega la primera página de MySQL. XLSX no puede mandarse antes
+    de cerrar el libro, así que se arma en disco sin acumular filas en memoria
+    y luego se transmite por bloques.
+    """
+    if formato == 'xlsx':
+        archivo = _xlsx_archivo(filas, columnas)
+        # El servidor WSGI cierra el wrapper (y el archivo) al terminar la
+        # respuesta, se haya leído o no el cuerpo
+        resp = Response(
+            wrap_file(request.environ, archivo, EXPORTAR_BLOQUE_BYTES),
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            direct_passthrough=True
+        )
+        resp.headers['Content-Length'] = str(os.fstat(archivo.fileno()).st_size)
+    else:
+        resp = Response(_csv_stream(filas, columnas), mimetype='text/csv')
+    resp.headers['Content-Disposition'] = f'attachment; filename="{nombre}.{formato}"'
+    # Evitar que un proxy intermedio junte toda la respuesta antes de reenviarla
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
@@ -0,0 +1,139 @@
+import os
+import json
+
+from jerarquia import ids_subarbol
+from organigrama import CacheRender, CACHE_DIR
+from versiones import version_jerarquia
+
+# Fotos de grafos ya servidos, por (raíz, versión): de ellas sale la
+# diferencia que se manda con ?since=. El disco se comparte entre workers
+# del mismo contenedor; si la foto no está se manda el grafo completo.
+GRAFO_CACHE_MEM_BYTES = int(os.environ.get('GRAFO_CACHE_MEM_MB', 16)) * 1024 * 1024
+GRAFO_CACHE_DISCO_BYTES = int(os.environ.get('GRAFO_CACHE_DISCO_MB', 128)) * 1024 * 1024
+
+cache_grafos = CacheRender(os.path.join(CACHE_DIR, 'grafos'), GRAFO_CACHE_MEM_BYTES, GRAFO_CACHE_DISCO_BYTES)
+
+
+# -----------------------
+# Grafo de un subárbol
+# -----------------------
+def grafo_subarbol(cursor, persona_id, modo='sql'):
+    """
+    Nodos y aristas del subárbol de persona_id con el mismo criterio que el
+    organigrama: los gestores (id_puesto == 1) no son nodos, cuentan en
+    `gestores` de su jefe. El subárbol se resuelve en MySQL ('cierre' o
+    'sql') para que salga del mismo snapshot que la versión; el índice en
+    memoria puede ir atrasado respecto a ella.
+
+    {'nodos': {id: {'id', 'nombre', 'puesto', 'id_puesto', 'nivel', 'gestores'}},
+     'aristas': {(jefe, id)}}
+    """
+    ids = ids_subarbol(cursor, persona_id, 'cierre' if modo == 'cierre' else 'sql')
+    cursor.execute("""
+        SELECT p.id,
+               CONCAT(p.nombres, ' ', p.apellidop) AS nombre,
+               ap.id_puesto,
+               pu.nombre AS puesto,
+               pu.nivel,
+               aj.id_jefe
+        FROM persona p
+        JOIN asigna_puesto ap ON p.id = ap.id_persona
+        LEFT JOIN puesto pu ON pu.id = ap.id_puesto
+        LEFT JOIN asigna_jefe aj
+              ON p.id = aj.id_persona
+             AND aj.fecha_fin IS NULL
+        WHERE p.estatus != 'Baja'
+          AND p.id IN %s
+        ORDER BY p.id
+    """, (tuple(ids),))
+    filas = cursor.fetchall()
+
+    nodos = {}
+    jefes = {}
+    gestores = {}
+    for f in filas:
+        if f['id_puesto'] == 1:
+            if f['id_jefe']:
+                gestores[f['id_jefe']] = gestores.get(f['id_jefe'], 0) + 1
+            continue
+        if f['id'] in nodos or f['puesto'] is None:
+            continue
+        nodos[f['id']] = {
+            'id': f['id'],
+            'nombre': f['nombre'],
+            'puesto': f['puesto'],
+            'id_puesto': f['id_puesto'],
+            'nivel': f['nivel'],
+            'gestores': 0,
+        }
+        jefes[f['id']] = f['id_jefe']
+    for jefe_id, total in gestores.items():
+        if jefe_id in nodos:
+            nodos[jefe_id]['gestores'] = total
+
+    aristas = {(jefe_id, pid) for pid, jefe_id in jefes.items() if jefe_id in nodos and pid != persona_id}
+    return {'nodos': nodos, 'aristas': aristas}
+
+
+def diferencia(anterior, actual):
+    """Nodos agregados, cambiados y eliminados y aristas agregadas y eliminadas de anterior a actual."""
+    antes, ahora = anterior['nodos'], actual['nodos']
+    return {
+        'agregados': [n for i, n in ahora.items() if i not in antes],
+        'cambiados': [n for i, n in ahora.items() if i in antes and antes[i] != n],
+        'eliminados': [i for i in antes if i not in ahora],
+        'aristas_agregadas': sorted(actual['aristas'] - anterior['aristas']),
+        'aristas_eliminadas': sorted(anterior['aristas'] - actual['aristas']),
+    }
+
+
+# -----------------------
+# Fotos por versión
+# -----------------------
+def _nombre_foto(raiz, version):
+    return f"{int(raiz)}-{int(version)}.json"
+
+
+def guardar_foto(raiz, version, grafo):
+    nombre = _nombre_foto(raiz, version)
+    if cache_grafos.existe(nombre):
+        return
+    datos = {'nodos': list(grafo['nodos'].values()), 'aristas': sorted(grafo['aristas'])}
+    cache_grafos.guardar(nombre, json.dumps(datos, separators=(',', ':')).encode('utf-8'))
+
+
+def leer_foto(raiz, version):
+    datos = cache_grafos.obtener(_nombre_foto(raiz, version))
+    if datos is None:
+        return None
+    foto = json.loads(datos)
+    return {'nodos': {n['id']: n for n in foto['nodos']},
+            'aristas': {tuple(a) for a in foto['aristas']}}
+
+
+def grafo_versionado(conn, persona_id, desde=None, modo='sql'):
+    """
+    Respuesta de la API de grafo. Sin `desde` (o si no hay foto de esa
+    versión) regresa el grafo completo; con `desde` igual a la versión actual
+    no consulta el subárbol. Versión y grafo salen de la misma transacción.
+    El grafo depende sólo de los contadores (la relación vigente es
+    fecha_fin IS NULL, no de la fecha), así que la foto por (raíz, versión)
+    y el diff vacío con desde == versión no caducan a medianoche.
+    """
+    cursor = conn.cursor()
+    version = version_jerarquia(cursor)
+    respuesta = {'raiz': persona_id, 'version': version}
+    if desde is not None and desde == version:
+        return dict(respuesta, desde=desde, completo=False,
+                    agregados=[], cambiados=[], eliminados=[],
+                    aristas_agregadas=[], aristas_eliminadas=[])
+
+    grafo = grafo_subarbol(cursor, persona_id, modo)
+    guardar_foto(persona_id, version, grafo)
+
+    anterior = leer_foto(persona_id, desde) if desde is not None and desde < version else None
+    if anterior is not None:
+        return dict(respuesta, desde=desde, completo=False, **diferencia(anterior, grafo))
+    return dict(respuesta, completo=True,
+                nodos=list(grafo['nodos'].values()),
+                aristas=sorted(grafo['aristas']))
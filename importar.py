@@ -0,0 +1,256 @@
+import io
+import os
+import csv
+from itertools import islice
+
+from db import get_connection
+from jerarquia import registrar_nodos, ligar
+from versiones import incrementar_versiones
+
+# Filas por lote: cada lote es una transacción (personas fila por fila, el
+# resto con un executemany por tabla)
+IMPORTAR_LOTE = int(os.environ.get('IMPORTAR_LOTE', 500))
+
+# Máximo de errores que se guardan en el reporte (el conteo sigue completo)
+IMPORTAR_MAX_ERRORES = int(os.environ.get('IMPORTAR_MAX_ERRORES', 1000))
+
+COLUMNAS = ('nombres', 'apellidop', 'apellidom', 'telefono_uno', 'telefono_dos',
+            'numero_empleado', 'correo', 'puesto', 'jefe', 'username', 'password')
+
+
+def _clave(texto):
+    """Normaliza nombres para buscarlos: minúsculas y espacios simples."""
+    return ' '.join(str(texto).split()).lower() if texto is not None else ''
+
+
+def _celda(valor):
+    if valor is None:
+        return None
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)  # Excel guarda números de empleado como float
+    valor = str(valor).strip()
+    return valor or None
+
+
+# -----------------------
+# Lectura en streaming
+# -----------------------
+def leer_csv(stream):
+    texto = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    for fila in csv.DictReader(texto):
+        yield {_clave(k).replace(' ', '_'): _celda(v) for k, v in fila.items() if k}
+
+
+def leer_xlsx(stream):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError("Para importar XLSX se necesita openpyxl instalado.")
+    # read_only: las filas se leen conforme se recorren, sin cargar la hoja completa
+    libro = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        filas = libro.active.iter_rows(values_only=True)
+        encabezado = next(filas, None)
+        if not encabezado:
+            return
+        columnas = [_clave(c).replace(' ', '_') if c else None for c in encabezado]
+        for valores in filas:
+            if not any(v is not None for v in valores):
+                continue
+            yield {c: _celda(v) for c, v in zip(columnas, valores) if c}
+    finally:
+        libro.close()
+
+
+def leer_filas(stream, nombre_archivo):
+    ext = nombre_archivo.rsplit('.', 1)[-1].lower() if '.' in nombre_archivo else ''
+    if ext == 'csv':
+        return leer_csv(stream)
+    if ext in ('xlsx', 'xlsm'):
+        return leer_xlsx(stream)
+    raise ValueError("Formato no soportado; usa CSV o XLSX.")
+
+
+# -----------------------
+# Búsquedas en memoria
+# -----------------------
+class Referencias:
+    """Puestos por nombre/id y posibles jefes por número de empleado o nombre completo."""
+
+    def __init__(self, cursor):
+        cursor.execute("SELECT id, nombre FROM puesto WHERE activo=1")
+        self.puestos = {}
+        for p in cursor.fetchall():
+            self.puestos[_clave(p['nombre'])] = p['id']
+            self.puestos[str(p['id'])] = p['id']
+
+        self.por_numero = {}
+        self.por_nombre = {}
+        cursor.execute("SELECT id, nombres, apellidop, apellidom, numero_empleado FROM persona WHERE estatus != 'Baja'")
+        for p in cursor.fetchall():
+            self.agregar_persona(p['id'], p)
+
+    def agregar_persona(self, persona_id, p):
+        if p.get('numero_empleado'):
+            self.por_numero[str(p['numero_empleado'])] = persona_id
+        nombre = _clave(' '.join(filter(None, [p.get('nombres'), p.get('apellidop'), p.get('apellidom')])))
+        # Un nombre repetido ya no sirve para identificar al jefe
+        self.por_nombre[nombre] = None if nombre in self.por_nombre else persona_id
+
+    def puesto(self, valor):
+        return self.puestos.get(_clave(valor))
+
+    def jefe(self, valor):
+        """(id, error). Primero por número de empleado, luego por nombre completo."""
+        if valor in self.por_numero:
+            return self.por_numero[valor], None
+        clave = _clave(valor)
+        if clave in self.por_nombre:
+            if self.por_nombre[clave] is None:
+                return None, f"Jefe '{valor}' es ambiguo; usa su número de empleado"
+            return self.por_nombre[clave], None
+        return None, f"Jefe '{valor}' no encontrado"
+
+
+# -----------------------
+# Importación por lotes
+# -----------------------
+def _validar(fila, refs):
+    if not fila.get('nombres') or not fila.get('apellidop'):
+        return None, "nombres y apellidop son obligatorios"
+    if fila.get('numero_empleado') and fila['numero_empleado'] in refs.por_numero:
+        return None, f"numero_empleado {fila['numero_empleado']} ya existe"
+
+    puesto_id = None
+    if fila.get('puesto'):
+        puesto_id = refs.puesto(fila['puesto'])
+        if puesto_id is None:
+            return None, f"Puesto '{fila['puesto']}' no encontrado"
+
+    return {'fila': fila, 'puesto_id': puesto_id}, None
+
+
+def _insertar_lote(conn, lote, refs):
+    """
+    Inserta persona, asigna_puesto, asigna_jefe y la tabla de cierre del lote
+    en una transacción.
+    Los jefes se resuelven al final para que una fila pueda apuntar a otra
+    del mismo lote. Regresa [(num_fila, persona_id | None, error | None)].
+    """
+    cursor = conn.cursor()
+    # Una persona por INSERT: con innodb_autoinc_lock_mode=2 y otras
+    # escrituras en paralelo, los ids de un INSERT de varias filas no son
+    # necesariamente consecutivos, así que cada id sale de su propio lastrowid
+    ids = []
+    for _, v in lote:
+        f = v['fila']
+        cursor.execute("""
+            INSERT INTO persona (nombres, apellidop, apellidom, telefono_uno, telefono_dos, numero_empleado, correo, user_name, password)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, (f['nombres'], f['apellidop'], f.get('apellidom') or '', f.get('telefono_uno'), f.get('telefono_dos'),
+              f.get('numero_empleado'), f.get('correo'), f.get('username'), f.get('password')))
+        ids.append(cursor.lastrowid)
+        refs.agregar_persona(cursor.lastrowid, f)
+
+    puestos = [(pid, v['puesto_id']) for pid, (_, v) in zip(ids, lote) if v['puesto_id']]
+    if puestos:
+        cursor.executemany("INSERT INTO asigna_puesto (id_persona, id_puesto) VALUES (%s, %s)", puestos)
+
+    resultado = []
+    jefes = []
+    # Sólo las personas del lote pueden formar un ciclo entre sí: las que ya
+    # existían no tienen jefes nuevos
+    jefe_en_lote = {}
+    for persona_id, (num, v) in zip(ids, lote):
+        error = None
+        if v['fila'].get('jefe'):
+            jefe_id, error = refs.jefe(v['fila']['jefe'])
+            if jefe_id == persona_id:
+                jefe_id, error = None, "Una persona no puede ser su propio jefe"
+            arriba = jefe_id
+            while arriba is not None and arriba != persona_id:
+                arriba = jefe_en_lote.get(arriba)
+            if jefe_id and arriba == persona_id:
+                jefe_id, error = None, "El jefe es subordinado de la persona en el mismo archivo"
+            if jefe_id:
+                jefes.append((persona_id, jefe_id))
+                jefe_en_lote[persona_id] = jefe_id
+        # La persona se registra aunque el jefe no se resuelva; se reporta como aviso
+        resultado.append((num, persona_id, error))
+    registrar_nodos(cursor, ids)
+    if jefes:
+        cursor.executemany(
+            "INSERT INTO asigna_jefe (id_persona, id_jefe, fecha_inicio) VALUES (%s, %s, CURDATE())", jefes
+        )
+        # Tabla de cierre: un INSERT ... SELECT por jefe distinto; el orden no
+        # importa porque cada uno copia el subárbol completo de sus subordinados
+        por_jefe = {}
+        for persona_id, jefe_id in jefes:
+            por_jefe.setdefault(jefe_id, []).append(persona_id)
+        for jefe_id, subordinados in por_jefe.items():
+            ligar(cursor, subordinados, jefe_id)
+
+    incrementar_versiones(cursor, 'persona', *(['asigna_puesto'] if puestos else []),
+                          *(['asigna_jefe'] if jefes else []))
+    conn.commit()
+    return resultado
+
+
+def importar_personas(filas, lote=IMPORTAR_LOTE, validar_solo=False):
+    """
+    Consume `filas` (iterador de dicts) por lotes: las filas en memoria son
+    a lo más `lote`. Las búsquedas no: Referencias guarda a las personas
+    activas de la base más las que se van registrando, y `vistos` los números
+    de empleado del archivo, así que eso crece como O(personas activas +
+    empleados distintos del archivo), unos cientos de bytes por persona.
+    Regresa el reporte:
+    {'total', 'insertadas', 'errores': [{'fila', 'mensaje'}], 'avisos': [...]}
+    """
+    reporte = {'total': 0, 'insertadas': 0, 'con_error': 0, 'errores': [], 'avisos': []}
+
+    def error(num, mensaje, tipo='errores'):
+        if tipo == 'errores':
+            reporte['con_error'] += 1
+        if len(reporte[tipo]) < IMPORTAR_MAX_ERRORES:
+            reporte[tipo].append({'fila': num, 'mensaje': mensaje})
+
+    # La fila 1 es el encabezado
+    numeradas = enumerate(filas, start=2)
+    # Números de empleado del archivo completo: con validar_solo no se
+    # insertan, así que refs no ve los repetidos entre lotes
+    vistos = set()
+    with get_connection() as conn:
+        refs = Referencias(conn.cursor())
+        while True:
+            bloque = list(islice(numeradas, lote))
+            if not bloque:
+                break
+            validas = []
+            for num, fila in bloque:
+                reporte['total'] += 1
+                valida, mensaje = _validar(fila, refs)
+                numero = fila.get('numero_empleado')
+                if valida and numero and numero in vistos:
+                    valida, mensaje = None, f"numero_empleado {numero} repetido en el archivo"
+                if valida is None:
+                    error(num, mensaje)
+                    continue
+                if numero:
+                    vistos.add(numero)
+                validas.append((num, valida))
+
+            if not validas or validar_solo:
+                continue
+            try:
+                for num, persona_id, aviso in _insertar_lote(conn, validas, refs):
+                    reporte['insertadas'] += 1
+                    if aviso:
+                        error(num, aviso, 'avisos')
+            except Exception as e:
+                conn.rollback()
+                for num, _ in validas:
+                    error(num, f"Lote revertido: {e}")
+                # Las búsquedas pudieron quedar con ids del lote revertido
+                refs = Referencias(conn.cursor())
+
+    return reporte
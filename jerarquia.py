@@ -0,0 +1,446 @@
+import os
+import time
+import threading
+from collections import defaultdict
+
+from db import get_connection
+from versiones import version_jerarquia, incrementar_versiones
+
+# Segundos que un índice se considera vigente. Cada worker de gunicorn tiene
+# su propia copia, así que el TTL acota lo desfasado que puede quedar un
+# worker cuando la escritura ocurrió en otro.
+JERARQUIA_TTL = int(os.environ.get('JERARQUIA_TTL', 60))
+
+# Profundidad máxima que recorre el CTE; protege contra ciclos en asigna_jefe
+PROFUNDIDAD_MAX = int(os.environ.get('JERARQUIA_PROFUNDIDAD_MAX', 50))
+
+# Relación jefe vigente: fecha_fin IS NULL. Al cerrarla se pone
+# fecha_fin = CURDATE() y deja de contar en ese momento, igual que en la
+# tabla de cierre; con `>= CURDATE()` el resultado cambiaría a medianoche
+# sin que ningún contador de version_tabla se moviera.
+
+# Subárbol resuelto en MySQL: deja disponible la tabla `subarbol (id, profundidad)`
+# para la consulta que se concatene después. Parámetros: (persona_id, PROFUNDIDAD_MAX)
+SUBARBOL_CTE = """
+    WITH RECURSIVE arbol (id, profundidad) AS (
+        SELECT %s, 0
+        UNION ALL
+        SELECT aj.id_persona, a.profundidad + 1
+        FROM arbol a
+        JOIN asigna_jefe aj
+            ON aj.id_jefe = a.id
+            AND aj.fecha_fin IS NULL
+        JOIN persona sp
+            ON sp.id = aj.id_persona
+            AND sp.estatus != 'Baja'
+        WHERE a.profundidad < %s
+    ),
+    subarbol AS (
+        SELECT id, MIN(profundidad) AS profundidad
+        FROM arbol
+        GROUP BY id
+    )
+"""
+
+
+class IndiceJerarquia:
+    """
+    Índice en memoria del árbol jefe → subordinados.
+
+    - padre:    persona -> jefe directo
+    - hijos:    jefe -> [subordinados directos]
+    - puesto:   persona -> id_puesto activo
+    - orden:    recorrido en preorden; el subárbol de X es el rango
+                orden[entrada[X]:salida[X]], así que pertenecer al
+                subárbol es una comparación de enteros.
+    - nivel:    profundidad de cada persona desde la raíz de su árbol
+    """
+
+    def __init__(self, filas):
+        self.padre = {}
+        self.puesto = {}
+        self.hijos = defaultdict(list)
+
+        for f in filas:
+            pid = f['id']
+            self.puesto[pid] = f['id_puesto']
+            if f.get('id_jefe') and f['id_jefe'] != pid:
+                # Si hay más de una relación vigente, gana la última leída
+                self.padre[pid] = f['id_jefe']
+            else:
+                self.padre.setdefault(pid, None)
+
+        for pid, jefe in self.padre.items():
+            if jefe is not None:
+                self.hijos[jefe].append(pid)
+
+        # Versión de la jerarquía con la que se leyeron las filas (None si se
+        # armó sin base, p. ej. en benchmarks)
+        self.version = None
+        self.orden = []
+        self.entrada = {}
+        self.salida = {}
+        self.nivel = {}
+        self._numerar()
+        self.construido = time.monotonic()
+
+    def _numerar(self):
+        nodos = set(self.padre) | set(self.hijos)
+        raices = [n for n in nodos if self.padre.get(n) is None]
+        # Primero las raíces reales; lo que quede sin visitar está en un ciclo
+        for inicio in sorted(raices) + sorted(nodos):
+            if inicio in self.entrada:
+                continue
+            pila = [(inicio, False, 0)]
+            while pila:
+                nodo, cerrar, nivel = pila.pop()
+                if cerrar:
+                    self.salida[nodo] = len(self.orden)
+                    continue
+                if nodo in self.entrada:
+                    continue
+                self.entrada[nodo] = len(self.orden)
+                self.nivel[nodo] = nivel
+                self.orden.append(nodo)
+                pila.append((nodo, True, nivel))
+                for h in reversed(self.hijos.get(nodo, ())):
+                    if h not in self.entrada:
+                        pila.append((h, False, nivel + 1))
+
+    # -----------------------
+    # Consultas
+    # -----------------------
+    def subarbol(self, persona_id):
+        """Persona y todos sus descendientes (preorden)."""
+        if persona_id not in self.entrada:
+            return [persona_id]
+        return self.orden[self.entrada[persona_id]:self.salida[persona_id]]
+
+    def profundidades(self, persona_id):
+        """{persona: profundidad relativa a persona_id} para todo su subárbol."""
+        base = self.nivel.get(persona_id, 0)
+        return {n: self.nivel.get(n, 0) - base for n in self.subarbol(persona_id)}
+
+    def en_subarbol(self, persona_id, raiz_id):
+        if persona_id == raiz_id:
+            return True
+        if persona_id not in self.entrada or raiz_id not in self.entrada:
+            return False
+        return self.entrada[raiz_id] <= self.entrada[persona_id] < self.salida[raiz_id]
+
+    def subordinados_directos(self, persona_id):
+        return list(self.hijos.get(persona_id, ()))
+
+    def total_descendientes(self, persona_id):
+        return len(self.subarbol(persona_id)) - 1
+
+
+def _filas_jerarquia(cursor):
+    cursor.execute("""
+        SELECT p.id, ap.id_puesto, aj.id_jefe
+        FROM persona p
+        JOIN asigna_puesto ap
+            ON ap.id_persona = p.id
+            AND ap.activo = 1
+        LEFT JOIN asigna_jefe aj
+            ON aj.id_persona = p.id
+            AND aj.fecha_fin IS NULL
+        WHERE p.estatus != 'Baja'
+        ORDER BY aj.fecha_inicio
+    """)
+    return cursor.fetchall()
+
+
+def _cargar_indice():
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        # Versión y filas del mismo snapshot
+        version = version_jerarquia(cursor)
+        indice = IndiceJerarquia(_filas_jerarquia(cursor))
+    indice.version = version
+    return indice
+
+
+def subarbol_sql(cursor, persona_id):
+    """Mismo resultado que IndiceJerarquia.profundidades, resuelto en MySQL."""
+    cursor.execute(SUBARBOL_CTE + "SELECT id, profundidad FROM subarbol",
+                   (persona_id, PROFUNDIDAD_MAX))
+    return {r['id']: r['profundidad'] for r in cursor.fetchall()}
+
+
+def ids_subarbol(cursor, persona_id, modo='memoria'):
+    """Ids del subárbol (incluida la persona) según SUBARBOL_MODO: 'memoria', 'sql' o 'cierre'."""
+    if modo == 'sql':
+        return list(subarbol_sql(cursor, persona_id))
+    if modo == 'cierre':
+        return list(subarbol_cierre(cursor, persona_id))
+    return obtener_jerarquia().subarbol(persona_id)
+
+
+_indice = None
+_lock = threading.Lock()
+
+
+def _vigente(indice, version):
+    if indice is None or time.monotonic() - indice.construido >= JERARQUIA_TTL:
+        return False
+    # Con una versión conocida (p. ej. la de un ETag) el índice no puede ser anterior
+    return version is None or indice.version is None or indice.version >= version
+
+
+def obtener_jerarquia(version=None):
+    """
+    Regresa el índice vigente, reconstruyéndolo si fue invalidado, expiró o
+    es anterior a `version` (versión de la jerarquía).
+    """
+    global _indice
+    indice = _indice
+    if _vigente(indice, version):
+        return indice
+    with _lock:
+        indice = _indice
+        if not _vigente(indice, version):
+            indice = _cargar_indice()
+            _indice = indice
+    return indice
+
+
+def invalidar_jerarquia():
+    global _indice
+    with _lock:
+        _indice = None
+
+
+
+# -----------------------
+# Tabla de cierre (ancestro, descendiente, profundidad)
+# -----------------------
+# Una fila por cada par ancestro → descendiente de las relaciones vigentes,
+# más (X, X, 0) para cada persona. Se mantiene en la misma transacción que
+# escribe asigna_jefe, así que no tiene TTL ni se invalida.
+TABLA_CIERRE = """
+    CREATE TABLE IF NOT EXISTS jerarquia_cierre (
+        ancestro INT NOT NULL,
+        descendiente INT NOT NULL,
+        profundidad INT NOT NULL,
+        PRIMARY KEY (ancestro, descendiente),
+        KEY idx_cierre_descendiente (descendiente, profundidad)
+    )
+"""
+
+# Filas por INSERT al reconstruir
+CIERRE_LOTE = int(os.environ.get('CIERRE_LOTE', 5000))
+
+
+class CicloJerarquia(ValueError):
+    """El jefe propuesto está dentro del subárbol de la persona."""
+
+
+def registrar_nodos(cursor, ids):
+    """Fila (X, X, 0) de cada persona; sin ella X no aparece ni en su propio subárbol."""
+    if ids:
+        cursor.executemany("""
+            INSERT IGNORE INTO jerarquia_cierre (ancestro, descendiente, profundidad)
+            VALUES (%s, %s, 0)
+        """, [(i, i) for i in ids])
+
+
+def desligar(cursor, ids):
+    """
+    Separa los subárboles de `ids` de todos sus ancestros; lo interno de cada
+    subárbol se conserva. `ids` no deben estar uno dentro del subárbol de
+    otro (p. ej. los subordinados directos de alguien).
+    """
+    if not ids:
+        return
+    # Borra (a, d) con d en el subárbol de la raíz y a fuera de él. Los
+    # joins sólo leen filas internas del subárbol, que no se borran.
+    cursor.execute("""
+        DELETE c
+        FROM jerarquia_cierre c
+        JOIN jerarquia_cierre sub
+            ON sub.descendiente = c.descendiente
+        LEFT JOIN jerarquia_cierre interno
+            ON interno.ancestro = sub.ancestro
+            AND interno.descendiente = c.ancestro
+        WHERE sub.ancestro IN %s
+          AND interno.ancestro IS NULL
+    """, (tuple(ids),))
+
+
+def _verificar_ciclo(cursor, ids, jefe_id):
+    if int(jefe_id) in {int(i) for i in ids}:
+        raise CicloJerarquia("Una persona no puede ser su propio jefe")
+    cursor.execute("""
+        SELECT 1 FROM jerarquia_cierre
+        WHERE ancestro IN %s AND descendiente = %s
+        LIMIT 1
+    """, (tuple(ids), jefe_id))
+    if cursor.fetchone():
+        raise CicloJerarquia("El jefe elegido es subordinado (directo o indirecto) de la persona")
+
+
+def ligar(cursor, ids, jefe_id):
+    """
+    Cuelga los subárboles de `ids` (ya desligados, o personas nuevas) bajo
+    jefe_id: cada ancestro del jefe pasa a serlo de cada descendiente.
+    """
+    if not ids:
+        return
+    _verificar_ciclo(cursor, ids, jefe_id)
+    registrar_nodos(cursor, [*ids, jefe_id])
+    cursor.execute("""
+        INSERT INTO jerarquia_cierre (ancestro, descendiente, profundidad)
+        SELECT sup.ancestro, sub.descendiente, sup.profundidad + sub.profundidad + 1
+        FROM jerarquia_cierre sup
+        JOIN jerarquia_cierre sub
+            ON sub.ancestro IN %s
+        WHERE sup.descendiente = %s
+    """, (tuple(ids), jefe_id))
+
+
+def mover(cursor, ids, jefe_id):
+    """Cambia de jefe los subárboles de `ids`; sin jefe_id quedan como raíces."""
+    if not ids:
+        return
+    if jefe_id:
+        # Antes de borrar nada, para que el error no deje la tabla a medias
+        _verificar_ciclo(cursor, ids, jefe_id)
+    desligar(cursor, ids)
+    if jefe_id:
+        ligar(cursor, ids, jefe_id)
+
+
+def subordinados_directos(cursor, persona_id):
+    cursor.execute("""
+        SELECT descendiente FROM jerarquia_cierre
+        WHERE ancestro = %s AND profundidad = 1
+    """, (persona_id,))
+    return [r['descendiente'] for r in cursor.fetchall()]
+
+
+def subarbol_cierre(cursor, persona_id):
+    """Mismo resultado que IndiceJerarquia.profundidades, con un rango de la llave primaria."""
+    cursor.execute("""
+        SELECT c.descendiente AS id, c.profundidad
+        FROM jerarquia_cierre c
+        JOIN persona p
+            ON p.id = c.descendiente
+            AND p.estatus != 'Baja'
+        WHERE c.ancestro = %s
+    """, (persona_id,))
+    profundidades = {r['id']: r['profundidad'] for r in cursor.fetchall()}
+    profundidades.setdefault(persona_id, 0)
+    return profundidades
+
+
+def total_descendientes(cursor, ids):
+    """{persona: descendientes a cualquier profundidad} para cada id."""
+    if not ids:
+        return {}
+    cursor.execute("""
+        SELECT ancestro AS id, COUNT(*) - 1 AS total
+        FROM jerarquia_cierre
+        WHERE ancestro IN %s
+        GROUP BY ancestro
+    """, (tuple(ids),))
+    totales = {i: 0 for i in ids}
+    totales.update({r['id']: r['total'] for r in cursor.fetchall()})
+    return totales
+
+
+def cadena_mando(cursor, persona_id):
+    """
+    Jefes de persona_id, del más alto al directo, hasta la cabeza de su
+    departamento: la cadena se corta en el primer jefe de otro departamento.
+    Regresa [{'id', 'nombre', 'puesto', 'departamento_id', 'profundidad'}].
+    """
+    cursor.execute("""
+        SELECT c.ancestro AS id,
+               c.profundidad,
+               CONCAT(p.nombres, ' ', p.apellidop, ' ', p.apellidom) AS nombre,
+               pu.nombre AS puesto,
+               pu.departamento_id
+        FROM jerarquia_cierre c
+        JOIN persona p ON p.id = c.ancestro
+        LEFT JOIN asigna_puesto ap
+            ON ap.id_persona = p.id
+            AND ap.activo = 1
+        LEFT JOIN puesto pu ON pu.id = ap.id_puesto
+        WHERE c.descendiente = %s
+        ORDER BY c.profundidad
+    """, (persona_id,))
+    filas = cursor.fetchall()
+    if not filas or filas[0]['profundidad'] != 0:
+        return []
+    departamento = filas[0]['departamento_id']
+    cadena = []
+    for f in filas[1:]:
+        if f['departamento_id'] != departamento:
+            break
+        cadena.append(f)
+    return cadena[::-1]
+
+
+def filas_cierre(indice):
+    """(ancestro, descendiente, profundidad) de todo el índice, recorriendo su preorden."""
+    ruta = []
+    for nodo in indice.orden:
+        nivel = indice.nivel[nodo]
+        del ruta[nivel:]
+        ruta.append(nodo)
+        for i, ancestro in enumerate(ruta):
+            yield ancestro, nodo, nivel - i
+
+
+def _filas_cierre(cursor):
+    """
+    Personas y jefes tal como los dejan las escrituras: registrar_nodos da
+    nodo a toda persona (tenga o no puesto activo), ligar la cuelga de su
+    jefe vigente y la baja la desliga de sus ancestros (queda como raíz de
+    los subordinados que conserve).
+    """
+    cursor.execute("""
+        SELECT p.id, NULL AS id_puesto, aj.id_jefe
+        FROM persona p
+        LEFT JOIN asigna_jefe aj
+            ON aj.id_persona = p.id
+            AND p.estatus != 'Baja'
+            AND aj.fecha_fin IS NULL
+        ORDER BY aj.fecha_inicio
+    """)
+    return cursor.fetchall()
+
+
+def reconstruir_cierre(conn, lote=CIERRE_LOTE):
+    """
+    Rehace la tabla de cierre desde asigna_jefe en UNA transacción. El
+    DELETE bloquea la tabla primero: una edición concurrente espera y aplica
+    su cambio sobre la tabla ya reconstruida, y las relaciones se leen
+    después, así que ninguna escritura se pierde. Sube la versión de la
+    jerarquía en la misma transacción. Regresa las filas escritas.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM jerarquia_cierre")
+        # Mismo manejo de ciclos que el índice en memoria
+        indice = IndiceJerarquia(_filas_cierre(cursor))
+        total = 0
+        filas = []
+        for fila in filas_cierre(indice):
+            filas.append(fila)
+            if len(filas) >= lote:
+                cursor.executemany("INSERT INTO jerarquia_cierre (ancestro, descendiente, profundidad) "
+                                   "VALUES (%s, %s, %s)", filas)
+                total += len(filas)
+                filas = []
+        if filas:
+            cursor.executemany("INSERT INTO jerarquia_cierre (ancestro, descendiente, profundidad) "
+                               "VALUES (%s, %s, %s)", filas)
+            total += len(filas)
+        incrementar_versiones(cursor, 'asigna_jefe')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return total
@@ -0,0 +1,292 @@
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from functools import lru_cache
+
+# Consultas más lentas que esto (ms) se escriben en el log 'sql.lenta'
+SQL_LENTA_MS = float(os.environ.get('SQL_LENTA_MS', 200))
+
+# Huellas distintas que se guardan; las demás se cuentan como 'otras'
+HUELLAS_MAX = int(os.environ.get('METRICAS_HUELLAS_MAX', 500))
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BUCKETS_CONSULTAS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+log_lentas = logging.getLogger('sql.lenta')
+
+
+# -----------------------
+# Huella de una consulta
+# -----------------------
+_LITERALES = [
+    (re.compile(r"'(?:[^'\\]|\\.|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(?+)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+
+@lru_cache(maxsize=2048)
+def huella(sql):
+    """
+    (id, texto) de la consulta sin literales ni espacios repetidos: el mismo
+    SELECT con distintos valores o listas IN de distinto tamaño comparte huella.
+    """
+    texto = sql
+    for patron, reemplazo in _LITERALES:
+        texto = patron.sub(reemplazo, texto)
+    texto = texto.strip()
+    return hashlib.sha1(texto.encode('utf-8')).hexdigest()[:12], texto
+
+
+# -----------------------
+# Histogramas (formato de texto de Prometheus)
+# -----------------------
+class Histograma:
+    def __init__(self, nombre, ayuda, buckets=BUCKETS_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.buckets = buckets
+        self._series = {}   # endpoint -> [conteos por bucket..., +Inf, suma]
+        self._lock = threading.Lock()
+
+    def observar(self, endpoint, valor):
+        with self._lock:
+            serie = self._series.get(endpoint)
+            if serie is None:
+                serie = self._series[endpoint] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie[i] += 1
+            serie[len(self.buckets)] += 1
+            serie[-1] += valor
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for endpoint, serie in sorted(series.items()):
+            etiqueta = _escapar(endpoint)
+            for limite, conteo in zip(self.buckets, serie):
+                lineas.append(f'{self.nombre}_bucket{{endpoint="{etiqueta}",le="{limite}"}} {conteo}')
+            lineas.append(f'{self.nombre}_bucket{{endpoint="{etiqueta}",le="+Inf"}} {serie[len(self.buckets)]}')
+            lineas.append(f'{self.nombre}_sum{{endpoint="{etiqueta}"}} {serie[-1]:.6f}')
+            lineas.append(f'{self.nombre}_count{{endpoint="{etiqueta}"}} {serie[len(self.buckets)]}')
+        return lineas
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+PETICION_SEGUNDOS = Histograma('http_peticion_segundos', 'Duración total de la petición por endpoint.')
+PETICION_DB_SEGUNDOS = Histograma('http_peticion_db_segundos', 'Tiempo en MySQL por petición.')
+PETICION_RENDER_SEGUNDOS = Histograma('http_peticion_render_segundos', 'Tiempo de render (plantillas y organigramas) por petición.')
+PETICION_CONSULTAS = Histograma('http_peticion_consultas', 'Consultas SQL por petición.', BUCKETS_CONSULTAS)
+HISTOGRAMAS = (PETICION_SEGUNDOS, PETICION_DB_SEGUNDOS, PETICION_RENDER_SEGUNDOS, PETICION_CONSULTAS)
+
+
+# -----------------------
+# Totales por huella
+# -----------------------
+class TotalesConsultas:
+    def __init__(self, maximo=HUELLAS_MAX):
+        self.maximo = maximo
+        self._por_huella = {}   # id -> {'texto', 'consultas', 'segundos', 'filas', 'max_s'}
+        self._lock = threading.Lock()
+
+    def registrar(self, sql, segundos, filas):
+        hid, texto = huella(sql)
+        with self._lock:
+            t = self._por_huella.get(hid)
+            if t is None:
+                if len(self._por_huella) >= self.maximo:
+                    hid, texto = 'otras', 'otras'
+                    t = self._por_huella.get(hid)
+                if t is None:
+                    t = self._por_huella[hid] = {'texto': texto, 'consultas': 0, 'segundos': 0.0,
+                                                 'filas': 0, 'max_s': 0.0}
+            t['consultas'] += 1
+            t['segundos'] += segundos
+            t['filas'] += filas or 0
+            t['max_s'] = max(t['max_s'], segundos)
+        return hid
+
+    def top(self, n=50):
+        with self._lock:
+            filas = [dict(v, huella=k) for k, v in self._por_huella.items()]
+        filas.sort(key=lambda t: t['segundos'], reverse=True)
+        for t in filas:
+            t['segundos'] = round(t['segundos'], 6)
+            t['max_s'] = round(t['max_s'], 6)
+        return filas[:n]
+
+    def exponer(self):
+        lineas = [
+            "# HELP sql_consultas_total Consultas ejecutadas por huella.",
+            "# TYPE sql_consultas_total counter",
+        ]
+        with self._lock:
+            totales = {k: dict(v) for k, v in self._por_huella.items()}
+        for hid, t in sorted(totales.items()):
+            lineas.append(f'sql_consultas_total{{huella="{hid}"}} {t["consultas"]}')
+        lineas += [
+            "# HELP sql_consultas_segundos_total Tiempo acumulado en MySQL por huella.",
+            "# TYPE sql_consultas_segundos_total counter",
+        ]
+        for hid, t in sorted(totales.items()):
+            lineas.append(f'sql_consultas_segundos_total{{huella="{hid}"}} {t["segundos"]:.6f}')
+        return lineas
+
+
+totales_consultas = TotalesConsultas()
+
+
+# -----------------------
+# Contexto por petición
+# -----------------------
+_peticion = contextvars.ContextVar('peticion', default=None)
+
+
+def iniciar_peticion():
+    datos = {'inicio': time.perf_counter(), 'consultas': 0, 'db_s': 0.0, 'filas': 0, 'render_s': 0.0}
+    _peticion.set(datos)
+    return datos
+
+
+def peticion_actual():
+    return _peticion.get()
+
+
+def contexto_tarea():
+    """
+    (contexto, parcial) para correr una tarea en otro hilo: copia del
+    contexto con su propio acumulador, para que los hilos no sumen a la vez
+    sobre el dict de la petición. Al terminar la tarea, quien la lanzó suma
+    `parcial` con sumar_parcial(). Fuera de una petición parcial es None.
+    """
+    contexto = contextvars.copy_context()
+    parcial = None
+    if _peticion.get() is not None:
+        parcial = {'consultas': 0, 'db_s': 0.0, 'filas': 0, 'render_s': 0.0}
+        contexto.run(_peticion.set, parcial)
+    return contexto, parcial
+
+
+def sumar_parcial(parcial):
+    datos = _peticion.get()
+    if datos is not None and parcial is not None:
+        for clave, valor in parcial.items():
+            datos[clave] += valor
+
+
+def terminar_peticion(endpoint):
+    """Cierra el contexto y alimenta los histogramas. Regresa los totales de la petición."""
+    datos = _peticion.get()
+    if datos is None:
+        return None
+    _peticion.set(None)
+    datos['total_s'] = time.perf_counter() - datos['inicio']
+    endpoint = endpoint or 'sin_ruta'
+    PETICION_SEGUNDOS.observar(endpoint, datos['total_s'])
+    PETICION_DB_SEGUNDOS.observar(endpoint, datos['db_s'])
+    PETICION_RENDER_SEGUNDOS.observar(endpoint, datos['render_s'])
+    PETICION_CONSULTAS.observar(endpoint, datos['consultas'])
+    return datos
+
+
+def registrar_consulta(sql, segundos, filas):
+    hid = totales_consultas.registrar(sql, segundos, filas)
+    datos = _peticion.get()
+    if datos is not None:
+        datos['consultas'] += 1
+        datos['db_s'] += segundos
+        datos['filas'] += filas or 0
+    if segundos * 1000 >= SQL_LENTA_MS:
+        log_lentas.warning("%.1f ms  filas=%s  huella=%s  %s",
+                           segundos * 1000, filas, hid, huella(sql)[1][:500])
+
+
+@contextmanager
+def medir_render():
+    """Suma el tiempo del bloque al render de la petición actual."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        datos = _peticion.get()
+        if datos is not None:
+            datos['render_s'] += time.perf_counter() - inicio
+
+
+# -----------------------
+# Cursor instrumentado
+# -----------------------
+class CursorMedido:
+    """
+    Envoltura de un cursor pymysql que mide cada execute/executemany. Con
+    cursores normales las filas ya llegan dentro de execute, así que la
+    latencia incluye la transferencia; con SSCursor sólo mide el envío.
+    """
+
+    def __init__(self, raw):
+        self._raw = raw
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._raw.close()
+
+    def _filas(self):
+        # SSCursor no conoce el total hasta terminar de leer
+        rowcount = self._raw.rowcount
+        return rowcount if rowcount is not None and 0 <= rowcount < 2 ** 63 - 1 else None
+
+    def execute(self, query, args=None):
+        inicio = time.perf_counter()
+        try:
+            return self._raw.execute(query, args)
+        finally:
+            registrar_consulta(query, time.perf_counter() - inicio, self._filas())
+
+    def executemany(self, query, args):
+        inicio = time.perf_counter()
+        try:
+            return self._raw.executemany(query, args)
+        finally:
+            registrar_consulta(query, time.perf_counter() - inicio, self._filas())
+
+
+def exponer(extras=()):
+    """Todas las métricas en formato de texto de Prometheus."""
+    lineas = []
+    for h in HISTOGRAMAS:
+        lineas += h.exponer()
+    lineas += totales_consultas.exponer()
+    lineas += list(extras)
+    return '\n'.join(lineas) + '\n'
+
+
+def gauges(prefijo, valores, ayuda=''):
+    """Líneas de gauge para un dict plano de números (p. ej. estadísticas del pool)."""
+    lineas = []
+    for clave, valor in sorted(valores.items()):
+        if isinstance(valor, bool) or not isinstance(valor, (int, float)):
+            continue
+        nombre = f"{prefijo}_{clave}"
+        lineas.append(f"# HELP {nombre} {ayuda or clave}")
+        lineas.append(f"# TYPE {nombre} gauge")
+        lineas.append(f"{nombre} {valor}")
+    return lineas
@@ -0,0 +1,355 @@
+import os
+import re
+import ast
+import glob
+
+from db import get_connection
+from jerarquia import TABLA_CIERRE, reconstruir_cierre
+from versiones import TABLA_VERSIONES
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+
+# nombre -> (tabla, columnas). Es la lista de referencia: las migraciones
+# los crean y `verificar_indices` confirma que existan con estas columnas.
+INDICES = {
+    # Subárbol (CTE) y reasignación: hijos vigentes de un jefe
+    'idx_asigna_jefe_jefe_fin': ('asigna_jefe', ('id_jefe', 'fecha_fin')),
+    # Jefe vigente de una persona (índice jerárquico, edición, colaborador)
+    'idx_asigna_jefe_persona_fin': ('asigna_jefe', ('id_persona', 'fecha_fin')),
+    'idx_asigna_puesto_persona_activo': ('asigna_puesto', ('id_persona', 'activo')),
+    # Conteos por puesto y plantilla
+    'idx_asigna_puesto_puesto_activo': ('asigna_puesto', ('id_puesto', 'activo')),
+    'idx_persona_estatus': ('persona', ('estatus',)),
+    # Orden y keyset del listado de personas (/personas/datatable)
+    'idx_persona_orden': ('persona', ('apellidop', 'apellidom', 'nombres', 'id')),
+    'idx_puesto_departamento_activo_nivel': ('puesto', ('departamento_id', 'activo', 'nivel')),
+    # Traslape de ausencias: por persona para subárboles chicos, por fecha
+    # (acotada por la duración máxima) para los grandes
+    'idx_ausencia_persona_fechas': ('ausencia', ('id_persona', 'fecha_inicio', 'fecha_fin')),
+    'idx_ausencia_activo_fechas': ('ausencia', ('activo', 'fecha_inicio', 'fecha_fin', 'id_persona')),
+    # Cadena de mando: ancestros de una persona ordenados por profundidad
+    'idx_cierre_descendiente': ('jerarquia_cierre', ('descendiente', 'profundidad')),
+}
+
+
+# -----------------------
+# Migraciones
+# -----------------------
+def _indices(*nombres):
+    def aplicar(cursor):
+        for nombre in nombres:
+            crear_indice(cursor, nombre)
+    return aplicar
+
+
+def _tabla_cierre(cursor):
+    # reconstruir_cierre sube el contador de la jerarquía; la tabla de
+    # versiones (migración 4) se crea aquí si aún no existe
+    cursor.execute(TABLA_VERSIONES)
+    cursor.execute(TABLA_CIERRE)
+    crear_indice(cursor, 'idx_cierre_descendiente')
+    reconstruir_cierre(cursor.connection)
+
+
+# Columnas del orden del listado: sin NULL, el keyset las compara tal cual
+# y MySQL recorre idx_persona_orden en lugar de ordenar COALESCE()
+COLUMNAS_ORDEN_PERSONA = ('apellidop', 'apellidom', 'nombres')
+
+
+def _orden_persona(cursor):
+    cursor.execute("""
+        SELECT column_name AS columna, column_type AS tipo, is_nullable AS nulo,
+               character_set_name AS juego, collation_name AS intercalacion
+        FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = 'persona' AND column_name IN %s
+    """, (COLUMNAS_ORDEN_PERSONA,))
+    nulables = [c for c in cursor.fetchall() if c['nulo'] == 'YES']
+    for c in nulables:
+        cursor.execute(f"UPDATE persona SET {c['columna']} = '' WHERE {c['columna']} IS NULL")
+    if nulables:
+        # Se conserva el tipo y la intercalación de cada columna
+        cursor.execute("ALTER TABLE persona " + ", ".join(
+            f"MODIFY {c['columna']} {c['tipo']} CHARACTER SET {c['juego']} COLLATE {c['intercalacion']} "
+            "NOT NULL DEFAULT ''" for c in nulables))
+    crear_indice(cursor, 'idx_persona_orden')
+
+
+# (versión, descripción, función(cursor)). Sólo se agregan al final; una
+# versión aplicada no se vuelve a correr.
+MIGRACIONES = [
+    (1, 'Índices de jerarquía y asignaciones', _indices(
+        'idx_asigna_jefe_jefe_fin', 'idx_asigna_jefe_persona_fin',
+        'idx_asigna_puesto_persona_activo', 'idx_asigna_puesto_puesto_activo',
+        'idx_persona_estatus', 'idx_puesto_departamento_activo_nivel',
+    )),
+    (2, 'Índices de ausencias por persona y por fecha', _indices(
+        'idx_ausencia_persona_fechas', 'idx_ausencia_activo_fechas',
+    )),
+    (3, 'Tabla de cierre de la jerarquía y carga inicial', _tabla_cierre),
+    (4, 'Contadores de versión por tabla', lambda cursor: cursor.execute(TABLA_VERSIONES)),
+    (5, 'Nombres de persona sin NULL e índice del listado', _orden_persona),
+]
+
+
+def indices_existentes(cursor, tabla):
+    """{nombre: (columnas en orden)} de los índices de la tabla."""
+    cursor.execute("""
+        SELECT index_name AS nombre, column_name AS columna
+        FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s
+        ORDER BY index_name, seq_in_index
+    """, (tabla,))
+    existentes = {}
+    for r in cursor.fetchall():
+        existentes.setdefault(r['nombre'], []).append(r['columna'])
+    return {k: tuple(v) for k, v in existentes.items()}
+
+
+def crear_indice(cursor, nombre):
+    """Crea el índice si no existe; si existe con otras columnas, lo reemplaza."""
+    tabla, columnas = INDICES[nombre]
+    actual = indices_existentes(cursor, tabla).get(nombre)
+    if actual == columnas:
+        return False
+    if actual is not None:
+        cursor.execute(f"DROP INDEX {nombre} ON {tabla}")
+    cursor.execute(f"CREATE INDEX {nombre} ON {tabla} ({', '.join(columnas)})")
+    return True
+
+
+def _asegurar_tabla_versiones(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migraciones (
+            version INT PRIMARY KEY,
+            descripcion VARCHAR(255) NOT NULL,
+            aplicada TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def versiones_aplicadas(cursor):
+    _asegurar_tabla_versiones(cursor)
+    cursor.execute("SELECT version FROM schema_migraciones")
+    return {r['version'] for r in cursor.fetchall()}
+
+
+def migrar(hasta=None):
+    """
+    Aplica en orden las migraciones pendientes. Un candado con nombre evita
+    que dos procesos (p. ej. dos contenedores arrancando) migren a la vez.
+    Regresa [(versión, descripción)] aplicadas.
+    """
+    aplicadas = []
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT GET_LOCK('schema_migraciones', 60) AS ok")
+        if not cursor.fetchone()['ok']:
+            raise TimeoutError("Otro proceso está aplicando migraciones")
+        try:
+            hechas = versiones_aplicadas(cursor)
+            for version, descripcion, aplicar in MIGRACIONES:
+                if version in hechas or (hasta is not None and version > hasta):
+                    continue
+                # DDL hace commit implícito en MySQL: cada índice queda aunque
+                # falle uno posterior, y crear_indice es idempotente
+                aplicar(cursor)
+                cursor.execute("INSERT INTO schema_migraciones (version, descripcion) VALUES (%s, %s)",
+                               (version, descripcion))
+                conn.commit()
+                aplicadas.append((version, descripcion))
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK('schema_migraciones')")
+            cursor.fetchall()
+    return aplicadas
+
+
+class EsquemaDesactualizado(RuntimeError):
+    pass
+
+
+def pendientes():
+    """[(versión, descripción)] de las migraciones que faltan en la base, sin crear nada."""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT COUNT(*) AS n FROM information_schema.tables
+            WHERE table_schema = DATABASE() AND table_name = 'schema_migraciones'
+        """)
+        hechas = set()
+        if cursor.fetchone()['n']:
+            cursor.execute("SELECT version FROM schema_migraciones")
+            hechas = {r['version'] for r in cursor.fetchall()}
+    return [(version, descripcion) for version, descripcion, _ in MIGRACIONES if version not in hechas]
+
+
+def verificar_esquema():
+    """
+    Lanza EsquemaDesactualizado si falta alguna migración. Las escrituras de
+    personas dependen de jerarquia_cierre (3), version_tabla (4) y de los
+    nombres NOT NULL (5): sin ellas cada alta, edición o baja daría 500.
+    """
+    faltan = pendientes()
+    if faltan:
+        raise EsquemaDesactualizado(
+            "Faltan migraciones de esquema: " + ", ".join(f"{v} ({d})" for v, d in faltan)
+            + ". Aplicarlas con `python migraciones.py` o `flask migrar` antes de arrancar la app."
+        )
+
+
+def verificar_indices():
+    """[(nombre, tabla, esperado, actual)] de los índices que faltan o difieren."""
+    problemas = []
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        por_tabla = {}
+        for nombre, (tabla, columnas) in INDICES.items():
+            if tabla not in por_tabla:
+                por_tabla[tabla] = indices_existentes(cursor, tabla)
+            actual = por_tabla[tabla].get(nombre)
+            if actual != columnas:
+                problemas.append((nombre, tabla, columnas, actual))
+    return problemas
+
+
+# -----------------------
+# EXPLAIN de las consultas del código
+# -----------------------
+# Tablas de catálogo: recorrerlas completas es normal
+TABLAS_CHICAS = {'departamento', 'puesto', 'rutas', 'roles', 'razon_ausencia', 'documento',
+                 'schema_migraciones'}
+
+# Filas estimadas a partir de las cuales un recorrido completo se reporta
+EXPLAIN_FILAS_MIN = int(os.environ.get('EXPLAIN_FILAS_MIN', 1000))
+
+_EXPLICABLE = re.compile(r'^\s*(SELECT|WITH|UPDATE|DELETE|INSERT\s+INTO\s+\w+\s*(\([^)]*\))?\s*SELECT)\b',
+                         re.IGNORECASE | re.DOTALL)
+
+
+def _constantes_modulo(arbol):
+    """Cadenas asignadas a nivel de módulo (PERSONAS_JOINS, SUBARBOL_CTE, ...)."""
+    constantes = {}
+    for nodo in arbol.body:
+        if isinstance(nodo, ast.Assign) and len(nodo.targets) == 1 and isinstance(nodo.targets[0], ast.Name):
+            valor = _evaluar(nodo.value, constantes)
+            if valor is not None:
+                constantes[nodo.targets[0].id] = valor
+    return constantes
+
+
+def _evaluar(nodo, constantes):
+    """Valor de cadena de una expresión estática; None si depende de datos en tiempo de ejecución."""
+    if isinstance(nodo, ast.Constant) and isinstance(nodo.value, str):
+        return nodo.value
+    if isinstance(nodo, ast.Name):
+        return constantes.get(nodo.id)
+    if isinstance(nodo, ast.BinOp) and isinstance(nodo.op, ast.Add):
+        izq, der = _evaluar(nodo.left, constantes), _evaluar(nodo.right, constantes)
+        return izq + der if izq is not None and der is not None else None
+    if isinstance(nodo, ast.IfExp):
+        # `... + (" FOR UPDATE" if bloquear else "")`: el plan es el mismo
+        valor = _evaluar(nodo.orelse, constantes)
+        return valor if valor is not None else _evaluar(nodo.body, constantes)
+    if isinstance(nodo, ast.JoinedStr):
+        partes = []
+        for v in nodo.values:
+            if isinstance(v, ast.Constant):
+                partes.append(v.value)
+            elif isinstance(v, ast.FormattedValue):
+                valor = _evaluar(v.value, constantes)
+                if valor is None:
+                    return None
+                partes.append(valor)
+        return ''.join(partes)
+    return None
+
+
+def consultas_en_codigo(archivos=None):
+    """
+    [(archivo, línea, sql)] de las consultas con texto estático: primer
+    argumento de execute/executemany y primer elemento de cada tupla que se
+    pasa a consultas_en_paralelo. Las que se arman en tiempo de ejecución
+    se regresan con sql=None para reportarlas como omitidas.
+    """
+    if archivos is None:
+        archivos = sorted(a for a in glob.glob(os.path.join(RAIZ, '*.py'))
+                          if os.path.basename(a) != 'migraciones.py')
+    encontradas = []
+    for archivo in archivos:
+        with open(archivo, encoding='utf-8') as f:
+            arbol = ast.parse(f.read(), archivo)
+        constantes = _constantes_modulo(arbol)
+        for nodo in ast.walk(arbol):
+            if not isinstance(nodo, ast.Call) or not isinstance(nodo.func, (ast.Attribute, ast.Name)):
+                continue
+            nombre = nodo.func.attr if isinstance(nodo.func, ast.Attribute) else nodo.func.id
+            if nombre in ('execute', 'executemany') and nodo.args:
+                candidatos = [nodo.args[0]]
+            elif nombre == 'consultas_en_paralelo':
+                candidatos = [a.elts[0] for a in nodo.args if isinstance(a, ast.Tuple) and a.elts]
+            else:
+                continue
+            for arg in candidatos:
+                encontradas.append((os.path.relpath(archivo, RAIZ), arg.lineno, _evaluar(arg, constantes)))
+    return encontradas
+
+
+def _parametros(sql):
+    # Un valor por marcador; con 1 el optimizador elige plan como con un id
+    # real. `IN %s` espera una tupla (pymysql la expande a una lista).
+    return tuple((1,) if m.group(1) else 1
+                 for m in re.finditer(r'(\bIN\s+)?%s', sql, re.IGNORECASE)) or None
+
+
+def revisar_plan(filas_explain, estricto=False):
+    """Problemas de un plan de EXPLAIN: recorridos completos, filesort y temporales."""
+    problemas = []
+    for fila in filas_explain:
+        tabla = fila.get('table') or ''
+        extra = fila.get('Extra') or ''
+        filas = fila.get('rows') or 0
+        chica = tabla in TABLAS_CHICAS or tabla.startswith('<') or filas < EXPLAIN_FILAS_MIN
+        if fila.get('type') == 'ALL' and (estricto or not chica):
+            problemas.append(f"recorrido completo de {tabla} (~{filas} filas)")
+        if 'Using filesort' in extra and (estricto or filas >= EXPLAIN_FILAS_MIN):
+            problemas.append(f"filesort en {tabla} (~{filas} filas)")
+        if 'Using temporary' in extra and (estricto or filas >= EXPLAIN_FILAS_MIN):
+            problemas.append(f"tabla temporal en {tabla} (~{filas} filas)")
+    return problemas
+
+
+def explain_check(archivos=None, estricto=False):
+    """
+    Corre EXPLAIN sobre cada consulta estática del código. Regresa
+    {'revisadas', 'omitidas': [(archivo, línea, motivo)], 'problemas': [(archivo, línea, [..], sql)]}.
+    Conviene correrlo contra una base con datos de volumen real (p. ej. la
+    de benchmarks/bench_rutas.py): con tablas vacías todo plan parece bueno.
+    """
+    reporte = {'revisadas': 0, 'omitidas': [], 'problemas': []}
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        for archivo, linea, sql in consultas_en_codigo(archivos):
+            if sql is None:
+                reporte['omitidas'].append((archivo, linea, 'SQL armado en tiempo de ejecución'))
+                continue
+            if not _EXPLICABLE.match(sql):
+                continue
+            try:
+                cursor.execute("EXPLAIN " + sql, _parametros(sql))
+                plan = cursor.fetchall()
+            except Exception as e:
+                conn.rollback()
+                reporte['omitidas'].append((archivo, linea, f"EXPLAIN falló: {e}"))
+                continue
+            reporte['revisadas'] += 1
+            problemas = revisar_plan(plan, estricto)
+            if problemas:
+                reporte['problemas'].append((archivo, linea, problemas, ' '.join(sql.split())))
+    return reporte
+
+
+if __name__ == '__main__':
+    # Paso de despliegue (Dockerfile): aplica lo pendiente sin cargar la app
+    for version, descripcion in migrar():
+        print(f"Aplicada {version}: {descripcion}")
+    verificar_esquema()
+    print("Esquema al día.")
@@ -0,0 +1,410 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import tempfile
+import colorsys
+import threading
+from xml.sax.saxutils import escape
+from collections import OrderedDict, defaultdict
+
+# Cambiar cuando cambie el dibujo para que no se sirvan imágenes viejas
+RENDER_VERSION = 1
+
+CACHE_DIR = os.environ.get('ORGANIGRAMA_CACHE_DIR',
+                           os.path.join(tempfile.gettempdir(), 'organigramas'))
+CACHE_MEM_BYTES = int(os.environ.get('ORGANIGRAMA_CACHE_MEM_MB', 32)) * 1024 * 1024
+CACHE_DISCO_BYTES = int(os.environ.get('ORGANIGRAMA_CACHE_DISCO_MB', 256)) * 1024 * 1024
+
+COLOR_GESTORES = (0.95, 0.90, 0.65)  # tono beige claro
+
+log = logging.getLogger(__name__)
+
+
+# -----------------------
+# Datos del organigrama
+# -----------------------
+def preparar_grafica(personas_filtradas, puesto_map):
+    """
+    Convierte las personas del subárbol en nodos y aristas listos para dibujar.
+    Los gestores (id_puesto == 1) no se dibujan uno por uno: se agrupan en un
+    nodo "N Gestores" colgando de su jefe.
+
+    nodos:   [(nodo_id, etiqueta, nivel, es_gestores)]
+    aristas: [(origen, destino)]
+    """
+    gestores_count = defaultdict(int)
+    for p in personas_filtradas:
+        if p['id_puesto'] == 1 and p.get('id_jefe'):
+            gestores_count[p['id_jefe']] += 1
+
+    nodos = []
+    aristas = []
+    vistos = set()
+    for persona in personas_filtradas:
+        if persona['id_puesto'] == 1 or persona['id'] in vistos:
+            continue
+        puesto = puesto_map.get(persona['id_puesto'])
+        if not puesto:
+            log.warning("Puesto no encontrado para persona ID %s", persona['id'])
+            continue
+        vistos.add(persona['id'])
+
+        nodo = f"p_{persona['id']}"
+        etiqueta = f"{persona['nombres']}\n{persona['apellidop']}\n({puesto['nombre']})"
+        nodos.append((nodo, etiqueta, puesto['nivel'], False))
+
+        count = gestores_count.get(persona['id'], 0)
+        if count > 0:
+            # Nodo único por jefe, con la misma etiqueta visible
+            nodo_gestores = f"gestores_{persona['id']}"
+            nodos.append((nodo_gestores, f"{count} Gestores", puesto['nivel'] + 0.5, True))
+            aristas.append((nodo, nodo_gestores))
+
+    for persona in personas_filtradas:
+        if persona['id'] in vistos and persona.get('id_jefe') in vistos:
+            aristas.append((f"p_{persona['id_jefe']}", f"p_{persona['id']}"))
+
+    return nodos, aristas
+
+
+_NOMBRE_RE = re.compile(r'[0-9a-f]{32}\.(png|svg)')
+
+FORMATOS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+
+def nombre_valido(nombre):
+    """Sólo nombres generados por clave_grafica; evita servir rutas arbitrarias."""
+    return bool(_NOMBRE_RE.fullmatch(nombre))
+
+
+def clave_grafica(nodos, aristas, formato='png'):
+    """Hash estable del contenido de la gráfica: mismo equipo → misma clave."""
+    contenido = json.dumps(
+        [RENDER_VERSION, formato, sorted(nodos), sorted(set(aristas))],
+        ensure_ascii=False, separators=(',', ':')
+    )
+    return hashlib.sha256(contenido.encode('utf-8')).hexdigest()[:32]
+
+
+def nombre_imagen(nodos, aristas, formato='png'):
+    """Nombre con el que la imagen vive en la cache (y su ETag)."""
+    return f"{clave_grafica(nodos, aristas, formato)}.{formato}"
+
+
+def colores_por_nivel(niveles):
+    """Un tono pastel por cada nivel jerárquico presente."""
+    niveles_unicos = sorted(set(niveles))
+
+    def pastel(h):
+        r, g, b = colorsys.hls_to_rgb(h, 0.8, 0.6)
+        return (r, g, b)
+
+    return {
+        nivel: pastel(i / len(niveles_unicos))
+        for i, nivel in enumerate(niveles_unicos)
+    }
+
+
+# -----------------------
+# Render con matplotlib
+# -----------------------
+def generar_png(nodos, aristas):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import networkx as nx
+    from networkx.drawing.nx_pydot import graphviz_layout
+    from io import BytesIO
+
+    G = nx.DiGraph()
+    niveles_map = {}
+    for nodo, etiqueta, nivel, _ in nodos:
+        G.add_node(nodo, label=etiqueta)
+        niveles_map[nodo] = nivel
+    G.add_edges_from(aristas)
+    log.debug("Render PNG: %d nodos, %d aristas", len(G.nodes()), len(aristas))
+
+    if not nodos:
+        return None
+
+    # Intentar con graphviz primero
+    try:
+        pos = graphviz_layout(G, prog='dot')
+    except Exception as e:
+        log.warning("Graphviz no disponible (%s), usando spring_layout", e)
+        pos = nx.spring_layout(G)
+
+    niveles_unicos = sorted(set(niveles_map.values()))
+    color_map = colores_por_nivel(niveles_unicos)
+
+    node_colors = []
+    for n in G.nodes():
+        if str(n).startswith("gestores_"):
+            node_colors.append(COLOR_GESTORES)
+        else:
+            node_colors.append(color_map[niveles_map[n]])
+
+    max_size = 2000
+    min_size = 1000
+    nivel_max = max(niveles_unicos)
+    nivel_min = min(niveles_unicos)
+    node_sizes = [
+        min_size + (niveles_map[n] - nivel_min) / (nivel_max - nivel_min) * (max_size - min_size)
+        if nivel_max != nivel_min else max_size
+        for n in G.nodes()
+    ]
+
+    plt.figure(figsize=(14, 6))
+    nx.draw_networkx_nodes(G, pos, node_color=node_colors, node_size=node_sizes)
+    labels = {n: G.nodes[n].get('label', n) for n in G.nodes()}
+    nx.draw_networkx_labels(G, pos, labels=labels, font_size=7)
+    nx.draw_networkx_edges(G, pos, arrows=False)
+    plt.axis('off')
+
+    img = BytesIO()
+    plt.savefig(img, format='png', bbox_inches='tight')
+    plt.close()
+
+    return img.getvalue()
+
+
+# -----------------------
+# Render SVG nativo (sin matplotlib ni graphviz)
+# -----------------------
+SVG_FUENTE = 11        # px
+SVG_CHAR = 6.6         # ancho aproximado de un carácter a SVG_FUENTE
+SVG_LINEA = 14
+SVG_PADDING = 8
+SVG_SEP_X = 16
+SVG_SEP_Y = 48
+
+
+def _hex(rgb):
+    return '#%02x%02x%02x' % tuple(int(round(c * 255)) for c in rgb)
+
+
+def layout_arbol(nodos, aristas, ancho_slot):
+    """
+    Layout por capas: cada hoja ocupa un slot horizontal consecutivo y cada
+    padre queda centrado sobre sus hijos. La profundidad en el árbol define
+    la capa. Iterativo para no depender del límite de recursión.
+
+    Regresa {nodo: (x_centro, capa)}.
+    """
+    ids = [n[0] for n in nodos]
+    hijos = defaultdict(list)
+    tiene_padre = set()
+    for origen, destino in aristas:
+        if destino in tiene_padre:
+            continue
+        hijos[origen].append(destino)
+        tiene_padre.add(destino)
+
+    pos = {}
+    siguiente_x = 0.0
+    for raiz in ids:
+        if raiz in tiene_padre or raiz in pos:
+            continue
+        pila = [(raiz, 0, False)]
+        while pila:
+            nodo, capa, cerrar = pila.pop()
+            if cerrar:
+                xs = [pos[h][0] for h in hijos[nodo] if h in pos]
+                pos[nodo] = ((min(xs) + max(xs)) / 2, capa)
+                continue
+            pendientes = [h for h in hijos.get(nodo, ()) if h not in pos]
+            if not pendientes:
+                pos[nodo] = (siguiente_x + ancho_slot / 2, capa)
+                siguiente_x += ancho_slot
+                continue
+            pila.append((nodo, capa, True))
+            for h in reversed(pendientes):
+                pila.append((h, capa + 1, False))
+    # Nodos en ciclos (sin raíz alcanzable) se dibujan al final, sueltos
+    for n in ids:
+        if n not in pos:
+            pos[n] = (siguiente_x + ancho_slot / 2, 0)
+            siguiente_x += ancho_slot
+    return pos
+
+
+def generar_svg(nodos, aristas):
+    if not nodos:
+        return None
+
+    lineas = {n[0]: n[1].split('\n') for n in nodos}
+    ancho_caja = max(max(len(l) for l in ls) for ls in lineas.values()) * SVG_CHAR + 2 * SVG_PADDING
+    alto_caja = max(len(ls) for ls in lineas.values()) * SVG_LINEA + 2 * SVG_PADDING
+    pos = layout_arbol(nodos, aristas, ancho_caja + SVG_SEP_X)
+
+    color_map = colores_por_nivel(n[2] for n in nodos if not n[3])
+    paso_y = alto_caja + SVG_SEP_Y
+    ancho = max(x for x, _ in pos.values()) + ancho_caja / 2 + SVG_SEP_X
+    alto = (max(c for _, c in pos.values()) + 1) * paso_y
+
+    partes = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {ancho:.0f} {alto:.0f}" '
+        f'width="{ancho:.0f}" height="{alto:.0f}" font-family="sans-serif" font-size="{SVG_FUENTE}">',
+        '<g stroke="#555" fill="none">',
+    ]
+    for origen, destino in aristas:
+        if origen not in pos or destino not in pos:
+            continue
+        x1, c1 = pos[origen]
+        x2, c2 = pos[destino]
+        y1 = c1 * paso_y + SVG_SEP_Y / 2 + alto_caja
+        y2 = c2 * paso_y + SVG_SEP_Y / 2
+        ym = (y1 + y2) / 2
+        partes.append(f'<path d="M{x1:.1f} {y1:.1f}V{ym:.1f}H{x2:.1f}V{y2:.1f}"/>')
+    partes.append('</g>')
+
+    for nodo, _, nivel, es_gestores in nodos:
+        x, capa = pos[nodo]
+        color = _hex(COLOR_GESTORES if es_gestores else color_map[nivel])
+        x0 = x - ancho_caja / 2
+        y0 = capa * paso_y + SVG_SEP_Y / 2
+        partes.append(
+            f'<rect x="{x0:.1f}" y="{y0:.1f}" width="{ancho_caja:.1f}" height="{alto_caja:.1f}" '
+            f'rx="6" fill="{color}" stroke="#888"/>'
+        )
+        ls = lineas[nodo]
+        y_texto = y0 + (alto_caja - len(ls) * SVG_LINEA) / 2 + SVG_LINEA - 3
+        tspans = ''.join(
+            f'<tspan x="{x:.1f}" y="{y_texto + i * SVG_LINEA:.1f}">{escape(l)}</tspan>'
+            for i, l in enumerate(ls)
+        )
+        partes.append(f'<text text-anchor="middle">{tspans}</text>')
+
+    partes.append('</svg>')
+    return '\n'.join(partes).encode('utf-8')
+
+
+GENERADORES = {'png': generar_png, 'svg': generar_svg}
+
+
+# -----------------------
+# Cache de renders (memoria + disco, LRU)
+# -----------------------
+class CacheRender:
+    """
+    LRU de dos niveles para imágenes ya generadas. La memoria es por worker;
+    el disco se comparte entre los workers del mismo contenedor. Ambos niveles
+    se acotan por tamaño total en bytes.
+    """
+
+    def __init__(self, directorio=CACHE_DIR, max_mem=CACHE_MEM_BYTES, max_disco=CACHE_DISCO_BYTES):
+        self.directorio = directorio
+        self.max_mem = max_mem
+        self.max_disco = max_disco
+        self._mem = OrderedDict()
+        self._mem_bytes = 0
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        os.makedirs(self.directorio, exist_ok=True)
+
+    def _ruta(self, nombre):
+        return os.path.join(self.directorio, nombre)
+
+    def _guardar_mem(self, nombre, datos):
+        with self._lock:
+            if nombre in self._mem:
+                self._mem.move_to_end(nombre)
+                return
+            if len(datos) > self.max_mem:
+                return
+            self._mem[nombre] = datos
+            self._mem_bytes += len(datos)
+            while self._mem_bytes > self.max_mem:
+                _, viejo = self._mem.popitem(last=False)
+                self._mem_bytes -= len(viejo)
+
+    def obtener(self, nombre):
+        with self._lock:
+            datos = self._mem.get(nombre)
+            if datos is not None:
+                self._mem.move_to_end(nombre)
+                self.aciertos += 1
+                return datos
+        ruta = self._ruta(nombre)
+        try:
+            with open(ruta, 'rb') as f:
+                datos = f.read()
+            os.utime(ruta)  # marcar como usado recientemente para el LRU de disco
+        except OSError:
+            self.fallos += 1
+            return None
+        self.aciertos += 1
+        self._guardar_mem(nombre, datos)
+        return datos
+
+    def existe(self, nombre):
+        with self._lock:
+            if nombre in self._mem:
+                return True
+        try:
+            os.utime(self._ruta(nombre))
+            return True
+        except OSError:
+            return False
+
+    def guardar(self, nombre, datos):
+        self._guardar_mem(nombre, datos)
+        ruta = self._ruta(nombre)
+        # Escritura atómica: otro worker nunca ve un archivo a medias
+        fd, tmp = tempfile.mkstemp(dir=self.directorio, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(datos)
+        os.replace(tmp, ruta)
+        self._podar_disco()
+
+    def _podar_disco(self):
+        archivos = []
+        total = 0
+        for entrada in os.scandir(self.directorio):
+            if not entrada.is_file() or entrada.name.endswith('.tmp') or entrada.name.startswith('.'):
+                continue
+            st = entrada.stat()
+            archivos.append((st.st_mtime, st.st_size, entrada.path))
+            total += st.st_size
+        if total <= self.max_disco:
+            return
+        for _, tam, ruta in sorted(archivos):
+            try:
+                os.remove(ruta)
+            except OSError:
+                continue
+            total -= tam
+            if total <= self.max_disco:
+                break
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                'mem_entradas': len(self._mem),
+                'mem_bytes': self._mem_bytes,
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+            }
+
+
+cache_render = CacheRender()
+
+
+def organigrama_cacheado(nodos, aristas, formato='png'):
+    """
+    Regresa el nombre de la imagen en cache para estos nodos/aristas,
+    generándola sólo si no existe. None si no hay nada que dibujar.
+    """
+    if not nodos:
+        return None
+    nombre = nombre_imagen(nodos, aristas, formato)
+    if cache_render.existe(nombre):
+        return nombre
+    datos = GENERADORES[formato](nodos, aristas)
+    if datos is None:
+        return None
+    cache_render.guardar(nombre, datos)
+    return nombre
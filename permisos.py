@@ -0,0 +1,103 @@
+import os
+import time
+import threading
+
+from db import get_connection
+from cache import CacheTTL
+from versiones import version_vigente, invalidar_versiones, TABLAS_PERMISOS
+
+# Las entradas de permisos se validan con los contadores de version_tabla en
+# cada consulta; el TTL sólo acota cuánto vive en memoria un usuario inactivo
+PERMISOS_TTL = int(os.environ.get('PERMISOS_TTL', 300))
+
+
+def _cargar_rutas():
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, ruta, activo FROM rutas")
+        rutas = cursor.fetchall()
+    return {
+        'por_id': {r['id']: r['ruta'] for r in rutas},
+        # Sólo las rutas activas se verifican en cada petición
+        'activas': {r['ruta']: r['id'] for r in rutas if r['activo']},
+    }
+
+
+_rutas = CacheTTL(_cargar_rutas, PERMISOS_TTL)
+
+
+def _cargar_bits(usuario_id):
+    """Permisos vía roles + permisos directos, en una consulta, como bitset de ids de ruta."""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT pr.ruta_id
+            FROM permiso_rol pr
+            JOIN usuario_roles ur ON ur.rol_id = pr.rol_id
+            WHERE ur.usuario_id = %s
+            UNION
+            SELECT pu.ruta_id
+            FROM permisos_usuario pu
+            WHERE pu.usuario_id = %s
+        """, (usuario_id, usuario_id))
+        bits = 0
+        for row in cursor.fetchall():
+            bits |= 1 << row['ruta_id']
+    return bits
+
+
+class CachePermisos:
+    """
+    usuario_id -> bitset de rutas permitidas. Cada entrada guarda la versión
+    de TABLAS_PERMISOS con la que se cargó y sólo se usa mientras sea la
+    vigente. Las escrituras de permisos suben esa versión en su transacción:
+    un permiso revocado en cualquier worker deja de valer en los demás en a
+    lo más VERSIONES_TTL, y una carga que empezó antes de la revocación queda
+    guardada con la versión anterior, así que se recalcula al usarse.
+    """
+
+    def __init__(self, ttl=PERMISOS_TTL):
+        self.ttl = ttl
+        self._entradas = {}   # usuario_id -> (bits, version, cargado)
+        self._lock = threading.Lock()
+
+    def bits(self, usuario_id):
+        version = version_vigente(TABLAS_PERMISOS)
+        entrada = self._entradas.get(usuario_id)
+        if entrada is not None:
+            bits, guardada, cargado = entrada
+            if guardada == version and time.monotonic() - cargado < self.ttl:
+                return bits
+        bits = _cargar_bits(usuario_id)
+        with self._lock:
+            actual = self._entradas.get(usuario_id)
+            if actual is None or actual[1] <= version:
+                self._entradas[usuario_id] = (bits, version, time.monotonic())
+        return bits
+
+    def invalidar(self):
+        """Llamar después del commit que subió la versión de TABLAS_PERMISOS."""
+        invalidar_versiones()
+
+
+cache_permisos = CachePermisos()
+
+
+def id_ruta(*nombres):
+    """Id de la primera ruta activa registrada con alguno de esos nombres; None si no está protegida."""
+    activas = _rutas.obtener()['activas']
+    for nombre in nombres:
+        if nombre in activas:
+            return activas[nombre]
+    return None
+
+
+def tiene_permiso(usuario_id, ruta_id):
+    return bool((cache_permisos.bits(usuario_id) >> ruta_id) & 1)
+
+
+def permisos_efectivos(usuario_id):
+    """Nombres de ruta permitidos al usuario (roles + permisos directos)."""
+    bits = cache_permisos.bits(usuario_id)
+    por_id = _rutas.obtener()['por_id']
+    return {ruta for rid, ruta in por_id.items() if (bits >> rid) & 1}
@@ -0,0 +1,119 @@
+import os
+import json
+import hashlib
+from collections import OrderedDict
+
+from db import get_connection
+from cache import CacheTTL
+from versiones import version_de, TABLAS_PLANTILLA
+
+# Las asignaciones se invalidan al escribir; el TTL cubre escrituras de otros workers
+PLANTILLA_TTL = int(os.environ.get('PLANTILLA_TTL', 120))
+
+# Puesto que no cuenta para decidir quiénes son las personas de mayor rango
+PUESTO_EXCLUIDO_TOP = 'Gestor 1-14'
+
+
+def _cargar_plantilla():
+    """
+    Plantilla de todos los departamentos en una sola pasada: un GROUP BY
+    departamento × puesto (con su nivel) y una consulta para las personas
+    de los puestos de mayor nivel de cada departamento.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        version = version_de(cursor, TABLAS_PLANTILLA)
+        cursor.execute("""
+            SELECT d.id AS departamento_id,
+                   d.nombre AS departamento,
+                   pu.id AS id_puesto,
+                   pu.nombre AS puesto,
+                   pu.nivel,
+                   COUNT(ap.id_persona) AS total_empleados
+            FROM departamento d
+            LEFT JOIN puesto pu
+                   ON pu.departamento_id = d.id AND pu.activo = 1
+            LEFT JOIN asigna_puesto ap
+                   ON ap.id_puesto = pu.id AND ap.activo = 1
+            WHERE d.activo = 1
+            GROUP BY d.id, d.nombre, pu.id, pu.nombre, pu.nivel
+            ORDER BY d.nombre, pu.nivel DESC, pu.nombre
+        """)
+        filas = cursor.fetchall()
+
+        departamentos = OrderedDict()
+        for f in filas:
+            dep = departamentos.setdefault(f['departamento_id'], {
+                'id': f['departamento_id'],
+                'nombre': f['departamento'],
+                'total': 0,
+                'puestos': [],
+                'niveles': {},
+                'top': [],
+            })
+            if f['id_puesto'] is None:
+                continue
+            dep['puestos'].append({
+                'id_puesto': f['id_puesto'],
+                'puesto': f['puesto'],
+                'nivel': f['nivel'],
+                'departamento': f['departamento'],
+                'total_empleados': f['total_empleados'],
+            })
+            dep['total'] += f['total_empleados']
+            dep['niveles'][f['nivel']] = dep['niveles'].get(f['nivel'], 0) + f['total_empleados']
+
+        # Puestos de mayor nivel por departamento
+        top_dep = {}
+        for dep in departamentos.values():
+            candidatos = [p for p in dep['puestos'] if p['puesto'] != PUESTO_EXCLUIDO_TOP]
+            if not candidatos:
+                continue
+            nivel_max = max(p['nivel'] for p in candidatos)
+            for p in candidatos:
+                if p['nivel'] == nivel_max:
+                    top_dep[p['id_puesto']] = dep['id']
+
+        if top_dep:
+            cursor.execute("""
+                SELECT p.id,
+                       CONCAT(p.apellidop,' ',p.apellidom,' ',p.nombres) AS nombre,
+                       ap.id_puesto
+                FROM persona p
+                JOIN asigna_puesto ap ON p.id = ap.id_persona
+                WHERE ap.id_puesto IN %s
+                  AND p.estatus != 'Baja'
+            """, (tuple(top_dep),))
+            for persona in cursor.fetchall():
+                departamentos[top_dep[persona['id_puesto']]]['top'].append(persona)
+
+    return {'departamentos': list(departamentos.values()),
+            'por_id': {d['id']: d for d in departamentos.values()},
+            'version': version,
+            'etags': {d['id']: _etag(d) for d in departamentos.values()},
+            'etag': _etag(list(departamentos.values()))}
+
+
+def _etag(datos):
+    # Hash del contenido: igual en todos los workers que tengan los mismos datos
+    return hashlib.sha1(json.dumps(datos, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:20]
+
+
+_plantilla = CacheTTL(_cargar_plantilla, PLANTILLA_TTL)
+
+
+def obtener_plantilla(version=None):
+    """
+    {'departamentos': [...], 'por_id': {id: departamento}, 'version',
+    'etags': {id: etag}, 'etag'} desde cache. Con `version` (de las tablas
+    TABLAS_PLANTILLA) se recarga si la copia es anterior.
+    """
+    plantilla = _plantilla.obtener()
+    if version is not None and plantilla['version'] < version:
+        _plantilla.invalidar()
+        plantilla = _plantilla.obtener()
+    return plantilla
+
+
+def invalidar_plantilla():
+    _plantilla.invalidar()
@@ -0,0 +1,120 @@
+import os
+import gzip
+import json
+import decimal
+import datetime
+
+from flask import Response, request
+
+try:
+    import orjson
+except ImportError:  # el json de la biblioteca estándar sirve igual, sólo más lento
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Respuestas más chicas que esto se mandan sin comprimir: el ahorro no paga el CPU
+COMPRESION_MIN_BYTES = int(os.environ.get('COMPRESION_MIN_BYTES', 1400))
+GZIP_NIVEL = int(os.environ.get('GZIP_NIVEL', 6))
+# Calidad 4-5 de brotli comprime mejor que gzip 6 en tiempo parecido
+BROTLI_CALIDAD = int(os.environ.get('BROTLI_CALIDAD', 5))
+
+COMPRIMIBLES = {'application/json', 'text/html', 'text/plain', 'text/csv', 'text/css',
+                'application/javascript', 'image/svg+xml'}
+
+
+# -----------------------
+# Serialización
+# -----------------------
+def _por_defecto(valor):
+    if isinstance(valor, decimal.Decimal):
+        return float(valor)
+    if isinstance(valor, (datetime.date, datetime.time)):
+        return valor.isoformat()
+    if isinstance(valor, (set, frozenset, tuple)):
+        return list(valor)
+    raise TypeError(f"{type(valor).__name__} no se puede convertir a JSON")
+
+
+def serializar(datos):
+    """JSON compacto en bytes; con orjson si está instalado."""
+    if orjson is not None:
+        return orjson.dumps(datos, default=_por_defecto, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(datos, default=_por_defecto, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def respuesta_json(datos, status=200):
+    return Response(serializar(datos), status=status, mimetype='application/json')
+
+
+# -----------------------
+# Formato por columnas
+# -----------------------
+def a_columnas(filas, columnas=None):
+    """
+    Lista de dicts → {'formato': 'columnas', 'total', 'columnas', 'datos',
+    'diccionarios'}. Cada columna es un arreglo; las de texto con muchos
+    repetidos (departamento, puesto, jefe...) se mandan como índices a su
+    diccionario: datos[col][i] es diccionarios[col][datos[col][i]].
+    """
+    if columnas is None:
+        columnas = list(filas[0]) if filas else []
+    datos = {}
+    diccionarios = {}
+    for col in columnas:
+        valores = [f[col] for f in filas]
+        textos = [v for v in valores if isinstance(v, str)]
+        if textos and len(textos) == sum(v is not None for v in valores):
+            unicos = {}
+            indices = [None if v is None else unicos.setdefault(v, len(unicos)) for v in valores]
+            # Sólo conviene si hay repetidos de sobra
+            if len(unicos) * 2 <= len(textos):
+                datos[col] = indices
+                diccionarios[col] = list(unicos)
+                continue
+        datos[col] = valores
+    return {'formato': 'columnas', 'total': len(filas), 'columnas': list(columnas),
+            'datos': datos, 'diccionarios': diccionarios}
+
+
+# -----------------------
+# Compresión (gzip / brotli)
+# -----------------------
+def _codificacion():
+    aceptadas = request.accept_encodings
+    if brotli is not None and aceptadas['br']:
+        return 'br'
+    if aceptadas['gzip']:
+        return 'gzip'
+    return None
+
+
+def comprimir(resp):
+    """
+    Comprime la respuesta si el cliente lo acepta, es de un tipo comprimible
+    y pasa de COMPRESION_MIN_BYTES. Deja igual las de streaming y send_file.
+    """
+    if (resp.status_code != 200 or resp.direct_passthrough or resp.is_streamed
+            or 'Content-Encoding' in resp.headers or resp.mimetype not in COMPRIMIBLES):
+        return resp
+    resp.vary.add('Accept-Encoding')
+    codificacion = _codificacion()
+    if codificacion is None:
+        return resp
+    cuerpo = resp.get_data()
+    if len(cuerpo) < COMPRESION_MIN_BYTES:
+        return resp
+    if codificacion == 'br':
+        cuerpo = brotli.compress(cuerpo, quality=BROTLI_CALIDAD)
+    else:
+        cuerpo = gzip.compress(cuerpo, compresslevel=GZIP_NIVEL, mtime=0)
+    resp.set_data(cuerpo)
+    resp.headers['Content-Encoding'] = codificacion
+    # Otra codificación es otra representación: el ETag fuerte pasa a débil
+    etag, debil = resp.get_etag()
+    if etag and not debil:
+        resp.set_etag(etag, weak=True)
+    return resp
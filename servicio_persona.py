@@ -0,0 +1,140 @@
+from jerarquia import mover, subordinados_directos
+from versiones import incrementar_versiones
+
+# -----------------------
+# Escrituras de persona en una sola transacción
+# -----------------------
+
+CAMPOS_PERSONA = ('nombres', 'apellidop', 'apellidom', 'telefono_uno', 'telefono_dos',
+                  'numero_empleado', 'correo')
+
+
+def _norm(valor):
+    """Compara valores del form (str) contra los de MySQL (str/int/None)."""
+    return '' if valor is None else str(valor).strip()
+
+
+def datos_formulario(form):
+    datos = {c: form.get(c) for c in CAMPOS_PERSONA}
+    datos['nombres'] = form['nombres']
+    datos['apellidop'] = form['apellidop']
+    # Las columnas de nombre son NOT NULL DEFAULT '' (orden del listado)
+    datos['apellidom'] = form.get('apellidom') or ''
+    datos['puesto_id'] = form.get('puesto_id')
+    datos['jefe_id'] = form.get('jefe_id')
+    return datos
+
+
+def obtener_persona_edicion(cursor, persona_id, bloquear=False):
+    """
+    Persona con su puesto y jefe vigentes en una sola consulta.
+    Con bloquear=True toma el candado de la fila (dentro de una transacción)
+    para que dos ediciones simultáneas de la misma persona se serialicen.
+    """
+    cursor.execute("""
+        SELECT p.*,
+               (SELECT ap.id_puesto FROM asigna_puesto ap
+                 WHERE ap.id_persona = p.id LIMIT 1) AS current_puesto_id,
+               (SELECT aj.id_jefe FROM asigna_jefe aj
+                 WHERE aj.id_persona = p.id AND aj.fecha_fin IS NULL LIMIT 1) AS current_jefe_id
+        FROM persona p
+        WHERE p.id=%s
+    """ + (" FOR UPDATE" if bloquear else ""), (persona_id,))
+    persona = cursor.fetchone()
+    if not persona:
+        return None, None, None
+    return persona, persona.pop('current_puesto_id'), persona.pop('current_jefe_id')
+
+
+def reasignar_subordinados(cursor, persona_id, nuevo_jefe_id):
+    """
+    Pasa todos los subordinados directos de persona_id a nuevo_jefe_id con
+    dos sentencias, sin importar cuántos sean. Sin nuevo jefe, sólo se
+    cierran las relaciones.
+    """
+    hijos = subordinados_directos(cursor, persona_id)
+    if nuevo_jefe_id:
+        cursor.execute("""
+            INSERT INTO asigna_jefe (id_persona, id_jefe, fecha_inicio)
+            SELECT id_persona, %s, CURDATE()
+            FROM asigna_jefe
+            WHERE id_jefe=%s AND fecha_fin IS NULL
+        """, (nuevo_jefe_id, persona_id))
+
+    # Las filas recién insertadas apuntan al nuevo jefe, así que aquí sólo
+    # se cierran las relaciones anteriores
+    cursor.execute("""
+        UPDATE asigna_jefe
+        SET fecha_fin = CURDATE()
+        WHERE id_jefe=%s AND fecha_fin IS NULL
+    """, (persona_id,))
+    mover(cursor, hijos, nuevo_jefe_id)
+
+
+def guardar_persona(conn, persona_id, datos, reasignar_al_cambiar_puesto=False, conservar_historial_jefe=True):
+    """
+    Aplica la edición de una persona en UNA transacción y sólo escribe lo
+    que cambió.
+
+    - reasignar_al_cambiar_puesto: si cambia el puesto, sus subordinados
+      pasan a su jefe directo actual (regla de jerarquía de editar_persona).
+    - conservar_historial_jefe: al cambiar de jefe se cierra la relación
+      vigente (fecha_fin); si es False se borran las relaciones previas.
+
+    Regresa qué partes cambiaron: {'persona', 'puesto', 'jefe'}. Lanza
+    CicloJerarquia si el jefe nuevo está dentro del subárbol de la persona.
+    """
+    cursor = conn.cursor()
+    try:
+        persona, puesto_actual, jefe_actual = obtener_persona_edicion(cursor, persona_id, bloquear=True)
+        if persona is None:
+            conn.rollback()
+            return None
+
+        cambios = [c for c in CAMPOS_PERSONA if _norm(datos.get(c)) != _norm(persona.get(c))]
+        if cambios:
+            cursor.execute(
+                "UPDATE persona SET " + ", ".join(f"{c}=%s" for c in cambios) + " WHERE id=%s",
+                [datos.get(c) for c in cambios] + [persona_id]
+            )
+
+        puesto_id = datos.get('puesto_id') or None
+        jefe_id = datos.get('jefe_id') or None
+        cambio_puesto = _norm(puesto_id) != _norm(puesto_actual)
+        cambio_jefe = _norm(jefe_id) != _norm(jefe_actual)
+        tocadas = ['persona'] if cambios else []
+
+        if cambio_puesto:
+            tocadas.append('asigna_puesto')
+            cursor.execute("DELETE FROM asigna_puesto WHERE id_persona=%s", (persona_id,))
+            if puesto_id:
+                cursor.execute("INSERT INTO asigna_puesto (id_persona, id_puesto) VALUES (%s, %s)",
+                               (persona_id, puesto_id))
+
+            # REGLA DE JERARQUÍA → SOLO SI CAMBIÓ EL PUESTO:
+            # los subordinados pasan al jefe directo que tenía antes del cambio
+            if reasignar_al_cambiar_puesto:
+                reasignar_subordinados(cursor, persona_id, jefe_actual)
+                tocadas.append('asigna_jefe')
+
+        if cambio_jefe:
+            # La tabla de cierre primero: si el jefe nuevo es subordinado de
+            # la persona, CicloJerarquia sale antes de tocar asigna_jefe
+            mover(cursor, [persona_id], jefe_id)
+            tocadas.append('asigna_jefe')
+            if conservar_historial_jefe:
+                cursor.execute("UPDATE asigna_jefe SET fecha_fin=CURDATE() WHERE id_persona=%s AND fecha_fin IS NULL",
+                               (persona_id,))
+            else:
+                cursor.execute("DELETE FROM asigna_jefe WHERE id_persona=%s", (persona_id,))
+            if jefe_id:
+                cursor.execute("INSERT INTO asigna_jefe (id_persona, id_jefe, fecha_inicio) VALUES (%s, %s, CURDATE())",
+                               (persona_id, jefe_id))
+
+        incrementar_versiones(cursor, *tocadas)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return {'persona': bool(cambios), 'puesto': cambio_puesto, 'jefe': cambio_jefe}
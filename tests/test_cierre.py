@@ -0,0 +1,104 @@
+"""
+La tabla de cierre que dejan las escrituras incrementales (registrar_nodos,
+ligar, mover, desligar, reasignar_subordinados) debe ser la misma que arma
+reconstruir_cierre, también el mismo día de un cambio de jefe.
+
+Necesita una base MySQL de pruebas (PRUEBAS_DB_*); sin ella se omite.
+
+    PRUEBAS_DB_HOST=127.0.0.1 PRUEBAS_DB_USER=root python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+pymysql = pytest.importorskip('pymysql')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jerarquia import (TABLA_CIERRE, registrar_nodos, ligar, mover, desligar,  # noqa: E402
+                       reconstruir_cierre)
+from versiones import TABLA_VERSIONES  # noqa: E402
+from servicio_persona import reasignar_subordinados  # noqa: E402
+
+BASE_PROHIBIDA = 'estado_cuenta'
+
+ESQUEMA = [
+    "DROP TABLE IF EXISTS persona, asigna_jefe, jerarquia_cierre, version_tabla",
+    """CREATE TABLE persona (
+        id INT PRIMARY KEY, estatus VARCHAR(20) NOT NULL DEFAULT 'Activo')""",
+    """CREATE TABLE asigna_jefe (
+        id INT PRIMARY KEY AUTO_INCREMENT, id_persona INT, id_jefe INT,
+        fecha_inicio DATE, fecha_fin DATE, KEY (id_persona), KEY (id_jefe))""",
+    TABLA_CIERRE,
+    TABLA_VERSIONES,
+]
+
+
+@pytest.fixture
+def conn():
+    nombre = os.environ.get('PRUEBAS_DB_NAME', 'catalogo_pruebas')
+    if nombre == BASE_PROHIBIDA:
+        pytest.fail("PRUEBAS_DB_NAME apunta a la base de producción")
+    try:
+        conexion = pymysql.connect(
+            host=os.environ.get('PRUEBAS_DB_HOST', '127.0.0.1'),
+            port=int(os.environ.get('PRUEBAS_DB_PORT', 3306)),
+            user=os.environ.get('PRUEBAS_DB_USER', 'root'),
+            password=os.environ.get('PRUEBAS_DB_PASSWORD', ''),
+            database=nombre,
+            cursorclass=pymysql.cursors.DictCursor,
+        )
+    except pymysql.err.MySQLError as e:
+        pytest.skip(f"Sin base de pruebas: {e}")
+    cursor = conexion.cursor()
+    for ddl in ESQUEMA:
+        cursor.execute(ddl)
+    yield conexion
+    conexion.close()
+
+
+def _cierre(cursor):
+    cursor.execute("SELECT ancestro, descendiente, profundidad FROM jerarquia_cierre")
+    return sorted((r['ancestro'], r['descendiente'], r['profundidad']) for r in cursor.fetchall())
+
+
+def _asignar(cursor, persona_id, jefe_id):
+    cursor.execute("INSERT INTO asigna_jefe (id_persona, id_jefe, fecha_inicio) VALUES (%s, %s, CURDATE())",
+                   (persona_id, jefe_id))
+
+
+def _cerrar(cursor, persona_id):
+    cursor.execute("UPDATE asigna_jefe SET fecha_fin=CURDATE() WHERE id_persona=%s AND fecha_fin IS NULL",
+                   (persona_id,))
+
+
+def test_reconstruir_igual_a_escrituras_el_mismo_dia(conn):
+    cursor = conn.cursor()
+    # 1 ← 2 ← 3, 1 ← 4 ← 5 ← 7, 6 sola, 8 sin jefe desde el alta
+    cursor.executemany("INSERT INTO persona (id) VALUES (%s)", [(i,) for i in range(1, 9)])
+    registrar_nodos(cursor, list(range(1, 9)))
+    for persona_id, jefe_id in ((2, 1), (3, 2), (4, 1), (5, 4), (7, 5)):
+        _asignar(cursor, persona_id, jefe_id)
+        ligar(cursor, [persona_id], jefe_id)
+    conn.commit()
+
+    # Hoy mismo: 4 se queda sin jefe (como guardar_persona con jefe vacío)
+    mover(cursor, [4], None)
+    _cerrar(cursor, 4)
+    # 3 cambia de 2 a 6
+    mover(cursor, [3], 6)
+    _cerrar(cursor, 3)
+    _asignar(cursor, 3, 6)
+    # Los subordinados de 5 pasan a 1
+    reasignar_subordinados(cursor, 5, 1)
+    # Baja de 2
+    cursor.execute("UPDATE persona SET estatus='Baja' WHERE id=2")
+    desligar(cursor, [2])
+    conn.commit()
+
+    incremental = _cierre(cursor)
+    assert (4, 7, 2) not in incremental and (1, 7, 1) in incremental
+
+    reconstruir_cierre(conn)
+    assert _cierre(cursor) == incremental
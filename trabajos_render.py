@@ -0,0 +1,258 @@
+import os
+import time
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from db import get_connection
+from jerarquia import ids_subarbol
+from plantilla import obtener_plantilla
+from organigrama import preparar_grafica, organigrama_cacheado, nombre_imagen, cache_render, CACHE_DIR
+
+# Procesos que dibujan organigramas fuera del worker de gunicorn.
+# Con 0 se dibuja dentro de la petición, como antes.
+RENDER_PROCESOS = int(os.environ.get('RENDER_PROCESOS', 2))
+
+# Segundos que la petición espera al render antes de contestar "pendiente";
+# los organigramas chicos salen en la misma respuesta
+RENDER_ESPERA = float(os.environ.get('RENDER_ESPERA', 0.5))
+
+# Cada cuántos segundos se precalientan los organigramas de las personas de
+# mayor rango de cada departamento (0 = desactivado)
+PRECALENTAR_INTERVALO = int(os.environ.get('ORGANIGRAMA_PRECALENTAR', 0))
+PRECALENTAR_FORMATOS = tuple(os.environ.get('ORGANIGRAMA_PRECALENTAR_FORMATOS', 'png').split(','))
+
+# Errores recientes que se recuerdan para contestar el estado de un trabajo
+ERRORES_MAX = 500
+
+
+# -----------------------
+# Datos del organigrama de un colaborador
+# -----------------------
+def mapa_puestos(cursor):
+    cursor.execute("SELECT id, nombre, nivel FROM puesto")
+    return {p['id']: p for p in cursor.fetchall()}
+
+
+def grafica_colaborador(cursor, persona_id, modo='memoria', puesto_map=None):
+    """
+    Nodos y aristas del subárbol de persona_id, listos para organigrama_cacheado.
+    Quien dibuja varios organigramas seguidos pasa `puesto_map` ya cargado.
+    """
+    ids = ids_subarbol(cursor, persona_id, modo)
+
+    cursor.execute("""
+        SELECT p.id,
+               p.nombres,
+               p.apellidop,
+               ap.id_puesto,
+               aj.id_jefe
+        FROM persona p
+        JOIN asigna_puesto ap ON p.id = ap.id_persona
+        LEFT JOIN asigna_jefe aj
+              ON p.id = aj.id_persona
+             AND aj.fecha_fin IS NULL
+        WHERE p.estatus != 'Baja'
+          AND p.id IN %s
+    """, (tuple(ids),))
+    personas_filtradas = cursor.fetchall()
+
+    if puesto_map is None:
+        puesto_map = mapa_puestos(cursor)
+    return preparar_grafica(personas_filtradas, puesto_map)
+
+
+# -----------------------
+# Cola de renders
+# -----------------------
+class ColaRender:
+    """
+    Manda los renders a un pool de procesos. El id de un trabajo es el nombre
+    de la imagen en cache (hash del contenido), así que dos peticiones por el
+    mismo subárbol comparten trabajo y cualquier worker puede contestar
+    "listo" leyendo la cache de disco.
+    """
+
+    def __init__(self, procesos=RENDER_PROCESOS):
+        self.procesos = procesos
+        self._executor = None
+        self._trabajos = {}            # nombre -> Future
+        self._errores = OrderedDict()  # nombre -> mensaje
+        self._lock = threading.Lock()
+        self.enviados = 0
+        self.coalescidos = 0
+
+    def _pool(self):
+        # Se crea en el primer uso, ya dentro del worker. 'spawn' evita hacer
+        # fork de un proceso con hilos (gthread, warm-up, pool de conexiones).
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                self.procesos, mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._executor
+
+    def enviar(self, nodos, aristas, formato='png'):
+        """Encola el render si hace falta. Regresa el id del trabajo, o None si no hay nada que dibujar."""
+        if not nodos:
+            return None
+        nombre = nombre_imagen(nodos, aristas, formato)
+        if cache_render.existe(nombre):
+            return nombre
+        if self.procesos <= 0:
+            organigrama_cacheado(nodos, aristas, formato)
+            return nombre
+
+        with self._lock:
+            if nombre in self._trabajos:
+                self.coalescidos += 1
+                return nombre
+            try:
+                futuro = self._pool().submit(organigrama_cacheado, nodos, aristas, formato)
+            except BrokenProcessPool:
+                # Un proceso murió (p. ej. por memoria); se arma un pool nuevo
+                self._executor = None
+                futuro = self._pool().submit(organigrama_cacheado, nodos, aristas, formato)
+            self._trabajos[nombre] = futuro
+            self._errores.pop(nombre, None)
+            self.enviados += 1
+        futuro.add_done_callback(lambda f: self._terminar(nombre, f))
+        return nombre
+
+    def _terminar(self, nombre, futuro):
+        error = futuro.exception()
+        if error is None and futuro.result() is None:
+            error = "No se pudo generar el diagrama"
+        with self._lock:
+            self._trabajos.pop(nombre, None)
+            if error is not None:
+                self._errores[nombre] = str(error)
+                while len(self._errores) > ERRORES_MAX:
+                    self._errores.popitem(last=False)
+
+    def estado(self, nombre):
+        """'pendiente', 'listo', ('error', mensaje) o None si este proceso no conoce el trabajo."""
+        with self._lock:
+            if nombre in self._trabajos:
+                return 'pendiente'
+            error = self._errores.get(nombre)
+        if cache_render.existe(nombre):
+            return 'listo'
+        if error is not None:
+            return ('error', error)
+        return None
+
+    def esperar(self, nombre, timeout=RENDER_ESPERA):
+        with self._lock:
+            futuro = self._trabajos.get(nombre)
+        if futuro is not None and (timeout is None or timeout > 0):
+            wait([futuro], timeout=timeout)
+            # El callback corre en el hilo del pool; darle la oportunidad de terminar
+            if futuro.done():
+                self._terminar(nombre, futuro)
+        return self.estado(nombre)
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                'procesos': self.procesos,
+                'en_curso': len(self._trabajos),
+                'enviados': self.enviados,
+                'coalescidos': self.coalescidos,
+                'errores': len(self._errores),
+            }
+
+
+cola_render = ColaRender()
+
+
+# -----------------------
+# Precalentado
+# -----------------------
+precalentado = {'ultima': None, 'duracion_s': None, 'enviados': 0, 'error': None}
+_lock_precalentar = threading.Lock()
+
+
+def precalentar_organigramas(formatos=PRECALENTAR_FORMATOS, modo='memoria', esperar=False):
+    """
+    Encola los organigramas de las personas de mayor rango de cada
+    departamento (las mismas que lista /nivel_jerarquico/personas/<dep>).
+    Los que ya están en cache no se vuelven a dibujar. Regresa cuántos se
+    encolaron.
+    """
+    inicio = time.monotonic()
+    trabajos = set()
+    departamentos = obtener_plantilla()['departamentos']
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        puesto_map = mapa_puestos(cursor)
+        for dep in departamentos:
+            for persona in dep['top']:
+                nodos, aristas = grafica_colaborador(cursor, persona['id'], modo, puesto_map)
+                for formato in formatos:
+                    trabajo = cola_render.enviar(nodos, aristas, formato)
+                    if trabajo:
+                        trabajos.add(trabajo)
+
+    if esperar:
+        for trabajo in trabajos:
+            cola_render.esperar(trabajo, timeout=None)
+    precalentado.update(ultima=time.time(), duracion_s=round(time.monotonic() - inicio, 2),
+                        enviados=len(trabajos), error=None)
+    return len(trabajos)
+
+
+def _turno_precalentar(intervalo):
+    """
+    Candado de archivo junto a la cache de disco, con la hora de la última
+    vuelta escrita adentro: en cada intervalo sólo un worker del contenedor
+    consulta y encola; los demás ven la hora reciente y se saltan la vuelta.
+    """
+    import fcntl
+    # 'a+' para no truncar la hora antes de tener el candado
+    f = open(os.path.join(CACHE_DIR, '.precalentar.lock'), 'a+')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    f.seek(0)
+    try:
+        ultima = float(f.read() or 0)
+    except ValueError:
+        ultima = 0.0
+    ahora = time.time()
+    if ahora - ultima < intervalo:
+        f.close()
+        return None
+    f.seek(0)
+    f.truncate()
+    f.write(repr(ahora))
+    f.flush()
+    return f
+
+
+def _ciclo_precalentar(intervalo, modo):
+    while True:
+        turno = _turno_precalentar(intervalo)
+        if turno is not None:
+            try:
+                precalentar_organigramas(modo=modo)
+            except Exception as e:
+                precalentado['error'] = str(e)
+            finally:
+                turno.close()
+        time.sleep(intervalo)
+
+
+def precalentar_periodicamente(intervalo=PRECALENTAR_INTERVALO, modo='memoria'):
+    """Lanza el ciclo de precalentado en un hilo daemon, una sola vez por proceso."""
+    if intervalo <= 0:
+        return
+    with _lock_precalentar:
+        if precalentado.get('iniciado'):
+            return
+        precalentado['iniciado'] = True
+    threading.Thread(target=_ciclo_precalentar, args=(intervalo, modo),
+                     name='precalentar-organigramas', daemon=True).start()
@@ -0,0 +1,91 @@
+import os
+
+from db import get_connection
+from cache import CacheTTL
+
+# Segundos que un worker reutiliza los contadores leídos para calcular ETags.
+# El worker que escribe los invalida; los demás ven el cambio en este tiempo.
+VERSIONES_TTL = float(os.environ.get('VERSIONES_TTL', 1))
+
+# -----------------------
+# Contadores de versión por tabla
+# -----------------------
+# Cada escritura sube, en su misma transacción, el contador de las tablas que
+# tocó. Una lectura que toma los contadores y luego los datos con la misma
+# conexión ve ambos del mismo snapshot (REPEATABLE READ), así que una versión
+# siempre corresponde a los datos leídos.
+TABLA_VERSIONES = """
+    CREATE TABLE IF NOT EXISTS version_tabla (
+        tabla VARCHAR(64) PRIMARY KEY,
+        version BIGINT UNSIGNED NOT NULL DEFAULT 0
+    )
+"""
+
+# Tablas de las que depende cada respuesta. puesto y departamento no se
+# escriben desde la app; si se editan por fuera, subir su contador con
+# `flask incrementar-version puesto` para que los clientes no sigan con 304.
+TABLAS_JERARQUIA = ('persona', 'asigna_puesto', 'asigna_jefe', 'puesto')
+TABLAS_PLANTILLA = ('departamento', 'puesto', 'persona', 'asigna_puesto')
+TABLAS_COLABORADOR = ('departamento', 'puesto', 'persona', 'asigna_puesto', 'asigna_jefe')
+TABLAS_CATALOGOS = ('departamento', 'puesto', 'persona', 'asigna_puesto')
+TABLAS_PERMISOS = ('permiso_rol', 'usuario_roles', 'permisos_usuario')
+
+
+def incrementar_versiones(cursor, *tablas):
+    """Sube el contador de cada tabla. No hace commit: va con la escritura."""
+    if tablas:
+        # Siempre en el mismo orden para que dos escrituras no se bloqueen en cruz
+        cursor.executemany("""
+            INSERT INTO version_tabla (tabla, version) VALUES (%s, 1)
+            ON DUPLICATE KEY UPDATE version = version + 1
+        """, [(t,) for t in sorted(set(tablas))])
+
+
+def leer_versiones(cursor, tablas):
+    """{tabla: versión}; 0 para las que nunca se han escrito."""
+    cursor.execute("SELECT tabla, version FROM version_tabla WHERE tabla IN %s", (tuple(tablas),))
+    versiones = dict.fromkeys(tablas, 0)
+    versiones.update({r['tabla']: int(r['version']) for r in cursor.fetchall()})
+    return versiones
+
+
+def version_de(cursor, tablas):
+    """
+    Versión monotónica de un grupo de tablas: la suma de contadores que
+    sólo crecen también sólo crece, y cambia con cualquier escritura de
+    cualquiera de ellas.
+    """
+    return sum(leer_versiones(cursor, tablas).values())
+
+
+def version_jerarquia(cursor):
+    return version_de(cursor, TABLAS_JERARQUIA)
+
+
+# -----------------------
+# Contadores en cache (para ETags)
+# -----------------------
+def _cargar_versiones():
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT tabla, version FROM version_tabla")
+        return {r['tabla']: int(r['version']) for r in cursor.fetchall()}
+
+
+_versiones = CacheTTL(_cargar_versiones, VERSIONES_TTL)
+
+
+def versiones_vigentes():
+    """{tabla: versión} en cache. Una respuesta que arma varias versiones las toma de una sola lectura."""
+    return _versiones.obtener()
+
+
+def version_vigente(tablas, versiones=None):
+    """Como version_de, con los contadores en cache: a lo más una consulta por worker cada VERSIONES_TTL."""
+    if versiones is None:
+        versiones = _versiones.obtener()
+    return sum(versiones.get(t, 0) for t in tablas)
+
+
+def invalidar_versiones():
+    _versiones.invalidar()